@@ -87,10 +87,24 @@ with st.sidebar:
     st.markdown("#### Quick Actions")
     
     if st.button("🗺️ Show All Floats"):
-        st.session_state.messages.append({
-            "role": "user",
-            "content": "show all floats on map"
-        })
+        # Straight from the float summary: no LLM round trip needed
+        st.session_state.messages.append({"role": "user", "content": "show all floats on map"})
+        try:
+            floats = requests.get(f"{BACKEND_URL}/floats", params={"limit": 1000}, timeout=10).json().get("floats", [])
+            markers = []
+            for f in floats:
+                lat = f.get("last_latitude") if f.get("last_latitude") is not None else f.get("launch_latitude")
+                lon = f.get("last_longitude") if f.get("last_longitude") is not None else f.get("launch_longitude")
+                if lat is not None and lon is not None:
+                    markers.append({"name": f"Float {f['platform_number']}", "lat": lat, "lon": lon})
+            active = sum(1 for f in floats if f.get("is_active"))
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": f"Showing last known positions of {len(markers)} floats ({active} active in the last 30 days).",
+                "data": {"formats": {"map": {"type": "markers", "data": {"markers": markers}}}}
+            })
+        except Exception as e:
+            st.session_state.messages.append({"role": "assistant", "content": f"❌ Error: {str(e)}"})
         st.rerun()
     
     if st.button("📊 Indian Ocean Stats"):
@@ -167,6 +181,159 @@ with st.sidebar:
 st.markdown('<div class="main-header">🌊 Float Chat -ARGO OCEAN INTELLIGENCE SYSTEM</div>', unsafe_allow_html=True)
 st.markdown('<div class="sub-header">AI-Powered Conversational Interface for Ocean Data</div>', unsafe_allow_html=True)
 
+# ==================== RENDERING HELPERS ====================
+def render_map(map_data):
+    """Render a map payload (markers or trajectories) with Folium"""
+    st.markdown("#### 🗺️ Map View")
+    
+    # Create map
+    m = folium.Map(location=[0, 80], zoom_start=3)
+    
+    if map_data["type"] == "markers":
+        # Add markers
+        for marker in map_data["data"]["markers"]:
+            folium.Marker(
+                location=[marker["lat"], marker["lon"]],
+                popup=f"<b>{marker['name']}</b><br>Lat: {marker['lat']}<br>Lon: {marker['lon']}",
+                tooltip=marker["name"]
+            ).add_to(m)
+    
+    elif map_data["type"] in ["trajectory", "multiple_trajectories"]:
+        # Add trajectories
+        if map_data["type"] == "trajectory":
+            trajectories = [map_data["data"]]
+        else:
+            # Defensive check to handle both list and dict structures
+            traj_dict = map_data.get("data", {}).get("trajectories", {})
+            if isinstance(traj_dict, dict):
+                trajectories = list(traj_dict.values())
+            else:
+                trajectories = traj_dict if isinstance(traj_dict, list) else []
+        
+        colors = ['blue', 'red', 'green', 'purple', 'orange', 'darkred', 'darkblue']
+        for idx, traj in enumerate(trajectories):
+            if "trajectory" in traj:
+                points = [(p["latitude"], p["longitude"]) for p in traj["trajectory"]]
+            elif "points" in traj:
+                points = [(p["lat"], p["lon"]) for p in traj["points"]]
+            else:
+                continue
+            
+            color = colors[idx % len(colors)]
+            
+            # Draw trajectory line
+            folium.PolyLine(
+                points,
+                color=color,
+                weight=2,
+                opacity=0.8,
+                popup=f"Float {traj.get('float_id', 'Unknown')}"
+            ).add_to(m)
+            
+            # Add start marker
+            if points:
+                folium.Marker(
+                    points[0],
+                    icon=folium.Icon(color=color, icon='play'),
+                    popup=f"Start: Float {traj.get('float_id', 'Unknown')}"
+                ).add_to(m)
+                
+                # Add end marker
+                folium.Marker(
+                    points[-1],
+                    icon=folium.Icon(color=color, icon='stop'),
+                    popup=f"End: Float {traj.get('float_id', 'Unknown')}"
+                ).add_to(m)
+    
+    st_folium(m, width=700, height=500)
+
+def render_graph(graph_data):
+    """Render a graph payload (bar or line chart) with Plotly"""
+    st.markdown("#### 📊 Graph View")
+    
+    if graph_data["type"] == "bar_chart":
+        # Create bar chart
+        fig = go.Figure()
+        
+        for dataset in graph_data["data"]["datasets"]:
+            fig.add_trace(go.Bar(
+                name=dataset["label"],
+                x=graph_data["data"]["labels"],
+                y=dataset["values"]
+            ))
+        
+        fig.update_layout(
+            title=f"{graph_data['data']['parameter'].title()} Comparison",
+            xaxis_title="Float ID",
+            yaxis_title=f"{graph_data['data']['parameter'].title()} (PSU)" if graph_data['data']['parameter'] == 'salinity' else graph_data['data']['parameter'].title(),
+            barmode='group',
+            height=500
+        )
+        
+        st.plotly_chart(fig, use_container_width=True)
+    
+    elif graph_data["type"] == "line_chart":
+        # Create line chart
+        fig = go.Figure()
+        
+        fig.add_trace(go.Scatter(
+            x=graph_data["data"]["x"],
+            y=graph_data["data"]["y"],
+            mode='lines+markers',
+            name=graph_data["data"].get("title", "Data")
+        ))
+        
+        fig.update_layout(
+            title=graph_data["data"].get("title", "Line Chart"),
+            xaxis_title=graph_data["data"].get("x_label", "X"),
+            yaxis_title=graph_data["data"].get("y_label", "Y"),
+            height=500
+        )
+        
+        st.plotly_chart(fig, use_container_width=True)
+
+def render_formats(formats):
+    """Render map and graph side by side when both are available"""
+    has_map = formats.get("map") is not None
+    has_graph = formats.get("graph") is not None
+    
+    if has_map and has_graph:
+        col1, col2 = st.columns(2)
+        with col1:
+            render_map(formats["map"])
+        with col2:
+            render_graph(formats["graph"])
+    elif has_map:
+        render_map(formats["map"])
+    elif has_graph:
+        render_graph(formats["graph"])
+
+def stream_query(prompt):
+    """Call the streaming /query endpoint and yield (event, data) pairs as they arrive"""
+    with requests.post(
+        f"{BACKEND_URL}/query/stream",
+        json={
+            "query": prompt,
+            "session_id": st.session_state.session_id
+        },
+        stream=True,
+        timeout=(5, 60)
+    ) as response:
+        response.raise_for_status()
+        event, data_lines = None, []
+        for line in response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == "":
+                # Blank line terminates one SSE frame
+                if event and data_lines:
+                    yield event, json.loads("\n".join(data_lines))
+                event, data_lines = None, []
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data_lines.append(line[len("data:"):].strip())
+
 # Display chat messages
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -174,133 +341,7 @@ for message in st.session_state.messages:
         
         # Display visualizations if available
         if message["role"] == "assistant" and "data" in message:
-            data = message["data"]
-            
-            # Create columns for side-by-side display
-            has_map = data.get("formats", {}).get("map") is not None
-            has_graph = data.get("formats", {}).get("graph") is not None
-            
-            if has_map and has_graph:
-                col1, col2 = st.columns(2)
-            elif has_map or has_graph:
-                col1 = st.container()
-                col2 = None
-            else:
-                col1 = col2 = None
-            
-            # Display map
-            if has_map:
-                with col1 if col2 else st.container():
-                    st.markdown("#### 🗺️ Map View")
-                    map_data = data["formats"]["map"]
-                    
-                    # Create map
-                    m = folium.Map(location=[0, 80], zoom_start=3)
-                    
-                    if map_data["type"] == "markers":
-                        # Add markers
-                        for marker in map_data["data"]["markers"]:
-                            folium.Marker(
-                                location=[marker["lat"], marker["lon"]],
-                                popup=f"<b>{marker['name']}</b><br>Lat: {marker['lat']}<br>Lon: {marker['lon']}",
-                                tooltip=marker["name"]
-                            ).add_to(m)
-                    
-                    elif map_data["type"] in ["trajectory", "multiple_trajectories"]:
-                        # Add trajectories
-                        if map_data["type"] == "trajectory":
-                            trajectories = [map_data["data"]]
-                        else:
-                            # Defensive check to handle both list and dict structures
-                            traj_dict = map_data.get("data", {}).get("trajectories", {})
-                            if isinstance(traj_dict, dict):
-                                trajectories = list(traj_dict.values())
-                            else:
-                                trajectories = traj_dict if isinstance(traj_dict, list) else []
-                        
-                        colors = ['blue', 'red', 'green', 'purple', 'orange', 'darkred', 'darkblue']
-                        for idx, traj in enumerate(trajectories):
-                            if "trajectory" in traj:
-                                points = [(p["latitude"], p["longitude"]) for p in traj["trajectory"]]
-                            elif "points" in traj:
-                                points = [(p["lat"], p["lon"]) for p in traj["points"]]
-                            else:
-                                continue
-                            
-                            color = colors[idx % len(colors)]
-                            
-                            # Draw trajectory line
-                            folium.PolyLine(
-                                points,
-                                color=color,
-                                weight=2,
-                                opacity=0.8,
-                                popup=f"Float {traj.get('float_id', 'Unknown')}"
-                            ).add_to(m)
-                            
-                            # Add start marker
-                            if points:
-                                folium.Marker(
-                                    points[0],
-                                    icon=folium.Icon(color=color, icon='play'),
-                                    popup=f"Start: Float {traj.get('float_id', 'Unknown')}"
-                                ).add_to(m)
-                                
-                                # Add end marker
-                                folium.Marker(
-                                    points[-1],
-                                    icon=folium.Icon(color=color, icon='stop'),
-                                    popup=f"End: Float {traj.get('float_id', 'Unknown')}"
-                                ).add_to(m)
-                    
-                    st_folium(m, width=700, height=500)
-            
-            # Display graph
-            if has_graph:
-                with col2 if col2 else st.container():
-                    st.markdown("#### 📊 Graph View")
-                    graph_data = data["formats"]["graph"]
-                    
-                    if graph_data["type"] == "bar_chart":
-                        # Create bar chart
-                        fig = go.Figure()
-                        
-                        for dataset in graph_data["data"]["datasets"]:
-                            fig.add_trace(go.Bar(
-                                name=dataset["label"],
-                                x=graph_data["data"]["labels"],
-                                y=dataset["values"]
-                            ))
-                        
-                        fig.update_layout(
-                            title=f"{graph_data['data']['parameter'].title()} Comparison",
-                            xaxis_title="Float ID",
-                            yaxis_title=f"{graph_data['data']['parameter'].title()} (PSU)" if graph_data['data']['parameter'] == 'salinity' else graph_data['data']['parameter'].title(),
-                            barmode='group',
-                            height=500
-                        )
-                        
-                        st.plotly_chart(fig, use_container_width=True)
-                    
-                    elif graph_data["type"] == "line_chart":
-                        # Create line chart
-                        fig = go.Figure()
-                        
-                        fig.add_trace(go.Scatter(
-                            x=graph_data["data"]["x"],
-                            y=graph_data["data"]["y"],
-                            mode='lines+markers',
-                            name=graph_data["data"].get("title", "Data")
-                        ))
-                        
-                        fig.update_layout(
-                            title=graph_data["data"].get("title", "Line Chart"),
-                            xaxis_title=graph_data["data"].get("x_label", "X"),
-                            yaxis_title=graph_data["data"].get("y_label", "Y"),
-                            height=500
-                        )
-                        
-                        st.plotly_chart(fig, use_container_width=True)
+            render_formats(message["data"].get("formats", {}))
 
 # Chat input
 if prompt := st.chat_input("Ask about ocean data... (e.g., 'Show floats in Indian Ocean')"):
@@ -311,45 +352,71 @@ if prompt := st.chat_input("Ask about ocean data... (e.g., 'Show floats in India
     with st.chat_message("user"):
         st.markdown(prompt)
     
-    # Get response from backend
+    # Get response from backend, rendering each stage as it streams in
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            try:
-                response = requests.post(
-                    f"{BACKEND_URL}/query",
-                    json={
-                        "query": prompt,
-                        "session_id": st.session_state.session_id
-                    },
-                    timeout=60
-                )
-                
-                data = response.json()
+        status_placeholder = st.empty()
+        text_placeholder = st.empty()
+        viz_placeholder = st.empty()
+        status_placeholder.caption("Thinking...")
+        
+        try:
+            data = None
+            streamed_text = ""
+            
+            for event, payload in stream_query(prompt):
+                if event == "routing":
+                    source = payload.get("processing_source", "").replace("_", " ")
+                    tool = payload.get("tool")
+                    status_placeholder.caption(f"Layer {payload.get('layer')}: {source}" + (f" → {tool}" if tool else ""))
                 
-                # Display AI response
-                ai_response = data.get("ai_synthesized_response", "")
-                if not ai_response:
-                    ai_response = "I processed your query. Check the visualizations below!"
+                elif event == "plan":
+                    status_placeholder.caption(f"Running plan: {' → '.join(str(t) for t in payload.get('steps', []))}")
                 
-                st.markdown(ai_response)
+                elif event == "tool_result":
+                    # Show maps and graphs as soon as the data is available
+                    status_placeholder.caption(f"✅ {payload.get('tool')} finished")
+                    with viz_placeholder.container():
+                        render_formats(payload.get("formats", {}))
                 
-                # Store message with data
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": ai_response,
-                    "data": data
-                })
+                elif event == "token":
+                    streamed_text += payload.get("text", "")
+                    text_placeholder.markdown(streamed_text + "▌")
                 
-                # Rerun to display visualizations
-                st.rerun()
+                elif event == "done":
+                    data = payload
                 
-            except Exception as e:
-                error_msg = f"❌ Error: {str(e)}"
-                st.error(error_msg)
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_msg
-                })
+                elif event == "error":
+                    raise RuntimeError(payload.get("detail") or payload.get("error", "Query failed"))
+            
+            if data is None:
+                raise RuntimeError("Stream ended before a result was received")
+            
+            # Display AI response
+            ai_response = data.get("ai_synthesized_response", "") or streamed_text
+            if not ai_response:
+                ai_response = "I processed your query. Check the visualizations below!"
+            
+            status_placeholder.empty()
+            text_placeholder.markdown(ai_response)
+            
+            # Store message with data
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": ai_response,
+                "data": data
+            })
+            
+            # Rerun to display visualizations
+            st.rerun()
+            
+        except Exception as e:
+            status_placeholder.empty()
+            error_msg = f"❌ Error: {str(e)}"
+            st.error(error_msg)
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": error_msg
+            })
 
 # Footer
 st.markdown("---")
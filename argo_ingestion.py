@@ -13,9 +13,12 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 import requests
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple, List
 import logging
 
+import data_versions
+import spatial
+
 logger = logging.getLogger(__name__)
 
 # HTTP Configuration (using HTTP instead of HTTPS to avoid 403 errors)
@@ -246,6 +249,7 @@ async def ingest_profiles(prof_file: str, conn) -> tuple:
     
     platform_number = int(safe_str(ds.PLATFORM_NUMBER.values[0]))
     n_profs = ds.dims['N_PROF']
+    storage = await measurements_storage(conn)
     
     total_measurements = 0
     
@@ -279,7 +283,10 @@ async def ingest_profiles(prof_file: str, conn) -> tuple:
             
             records.append((platform_number, cycle_number, int(lvl), p_val, p_val, t_val, s_val))
         
-        if records:
+        if records and storage == "arrays":
+            await write_profile_levels(conn, [profile_level_row(records)])
+            total_measurements += len(records)
+        elif records:
             await conn.copy_records_to_table(
                 'measurements', records=records,
                 columns=['float_id', 'cycle_number', 'n_level', 'pressure', 'depth_m', 'temperature', 'salinity'],
@@ -291,6 +298,423 @@ async def ingest_profiles(prof_file: str, conn) -> tuple:
     logger.info(f"Ingested {n_profs} profiles, {total_measurements} measurements for float {platform_number}")
     return (n_profs, total_measurements)
 
+# ==================== FLOAT SUMMARY ====================
+
+async def ensure_float_summary(conn):
+    """Create the float_summary table (one row per float, maintained by ingestion)"""
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS float_summary (
+        float_id INTEGER PRIMARY KEY,
+        cycle_count INTEGER NOT NULL DEFAULT 0,
+        first_profile_date TIMESTAMP,
+        last_profile_date TIMESTAMP,
+        last_latitude DOUBLE PRECISION,
+        last_longitude DOUBLE PRECISION,
+        updated_at TIMESTAMP DEFAULT NOW()
+    )
+    """)
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS float_summary_recent_idx
+    ON float_summary (last_profile_date DESC NULLS LAST, float_id)
+    """)
+
+async def refresh_float_summary(conn, float_id: Optional[int] = None) -> int:
+    """
+    Recompute float_summary rows from float_metadata/profiles.
+    Only the given float when float_id is set (incremental, after ingesting it), all floats otherwise.
+    Whether a float is active is derived at read time from last_profile_date.
+    """
+    float_id = int(float_id) if float_id is not None else None
+    result = await conn.execute("""
+        WITH ids AS (
+            SELECT platform_number AS float_id FROM float_metadata
+            WHERE $1::int IS NULL OR platform_number = $1
+            UNION
+            SELECT DISTINCT float_id FROM profiles
+            WHERE $1::int IS NULL OR float_id = $1
+        ),
+        agg AS (
+            SELECT float_id, COUNT(*) AS cycle_count,
+                   MIN(profile_date) AS first_profile_date, MAX(profile_date) AS last_profile_date
+            FROM profiles
+            WHERE $1::int IS NULL OR float_id = $1
+            GROUP BY float_id
+        ),
+        last_position AS (
+            SELECT DISTINCT ON (float_id) float_id, latitude, longitude
+            FROM profiles
+            WHERE ($1::int IS NULL OR float_id = $1)
+            AND latitude IS NOT NULL AND longitude IS NOT NULL
+            ORDER BY float_id, profile_date DESC NULLS LAST, cycle_number DESC
+        )
+        INSERT INTO float_summary (
+            float_id, cycle_count, first_profile_date, last_profile_date, last_latitude, last_longitude, updated_at
+        )
+        SELECT ids.float_id, COALESCE(agg.cycle_count, 0), agg.first_profile_date, agg.last_profile_date,
+               lp.latitude, lp.longitude, NOW()
+        FROM ids
+        LEFT JOIN agg ON agg.float_id = ids.float_id
+        LEFT JOIN last_position lp ON lp.float_id = ids.float_id
+        ON CONFLICT (float_id) DO UPDATE SET
+            cycle_count = EXCLUDED.cycle_count,
+            first_profile_date = EXCLUDED.first_profile_date,
+            last_profile_date = EXCLUDED.last_profile_date,
+            last_latitude = EXCLUDED.last_latitude,
+            last_longitude = EXCLUDED.last_longitude,
+            updated_at = EXCLUDED.updated_at
+    """, float_id)
+    rows = int(result.split()[-1])
+    logger.info(f"float_summary refreshed for {'float ' + str(float_id) if float_id else 'all floats'} ({rows} rows)")
+    return rows
+
+# ==================== FLOAT REGIONS ====================
+
+async def ensure_float_region(conn):
+    """Create the float_region membership table (region, float) and its definitions marker"""
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS float_region (
+        region TEXT NOT NULL,
+        float_id INTEGER NOT NULL,
+        profile_count INTEGER NOT NULL DEFAULT 0,
+        first_profile_date TIMESTAMP,
+        last_profile_date TIMESTAMP,
+        PRIMARY KEY (region, float_id)
+    )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS float_region_float_idx ON float_region (float_id)")
+    # Signature of each region's definition its rows were computed with
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS float_region_state (
+        region TEXT PRIMARY KEY,
+        signature TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT NOW()
+    )
+    """)
+
+async def sync_float_regions(conn) -> List[str]:
+    """
+    Bring float_region in line with spatial.REGIONS: rebuild only the regions that were never
+    computed or whose definition changed, and drop regions that are no longer defined.
+    Returns the names of the regions that changed.
+    """
+    stored = {r["region"]: r["signature"] for r in await conn.fetch("SELECT region, signature FROM float_region_state")}
+    removed = [name for name in stored if name not in spatial.REGIONS]
+    if removed:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM float_region WHERE region = ANY($1::text[])", removed)
+            await conn.execute("DELETE FROM float_region_state WHERE region = ANY($1::text[])", removed)
+        logger.info(f"float_region dropped regions no longer defined: {removed}")
+    stale = [name for name in spatial.REGIONS if stored.get(name) != spatial.region_signature(name)]
+    if stale:
+        await refresh_float_region(conn, regions=stale)
+    return removed + stale
+
+def _polygon_members(region: spatial.Region, rows) -> List[Tuple]:
+    """float_region rows for the profiles inside the region's polygon (CPU-bound; run in a thread)"""
+    df = pd.DataFrame([dict(r) for r in rows])
+    inside = region.contains(df["latitude"].to_numpy(float), df["longitude"].to_numpy(float))
+    if not inside.any():
+        return []
+    grouped = df[inside].groupby("float_id")["profile_date"].agg(["size", "min", "max"])
+    return [
+        (region.name, int(fid), int(g["size"]),
+         None if pd.isna(g["min"]) else g["min"].to_pydatetime(),
+         None if pd.isna(g["max"]) else g["max"].to_pydatetime())
+        for fid, g in grouped.iterrows()
+    ]
+
+async def _region_members(conn, region: spatial.Region, float_id: Optional[int]) -> List[Tuple]:
+    """
+    float_region rows for one region. The bounding box is applied in SQL through the grid_cell
+    index; box-only regions are aggregated there too, and only the profiles inside the box of a
+    polygon region are fetched for the polygon test.
+    """
+    cell_join, params = spatial.box_filter(*region.bounds, alias="q", first_param=2)
+    # Semi-join: a profile can match more than one cell range at the antimeridian
+    in_box = f"""
+        (p.float_id, p.cycle_number) IN (
+            SELECT q.float_id, q.cycle_number FROM profiles q {cell_join}
+            WHERE ($1::int IS NULL OR q.float_id = $1)
+        )
+    """
+    if region.polygon is None:
+        rows = await conn.fetch(f"""
+            SELECT p.float_id, COUNT(*) AS profile_count,
+                   MIN(p.profile_date) AS first_profile_date, MAX(p.profile_date) AS last_profile_date
+            FROM profiles p
+            WHERE {in_box}
+            GROUP BY p.float_id
+        """, float_id, *params)
+        return [(region.name, r["float_id"], r["profile_count"], r["first_profile_date"], r["last_profile_date"])
+                for r in rows]
+    rows = await conn.fetch(f"""
+        SELECT p.float_id, p.latitude, p.longitude, p.profile_date
+        FROM profiles p
+        WHERE {in_box}
+    """, float_id, *params)
+    if not rows:
+        return []
+    return await asyncio.to_thread(_polygon_members, region, rows)
+
+async def refresh_float_region(conn, float_id: Optional[int] = None, regions: Optional[List[str]] = None) -> int:
+    """
+    Recompute float_region rows from profile positions using the region engine (spatial.REGIONS).
+    Only the given float when float_id is set (incremental, after ingesting it), all floats otherwise;
+    only the given regions when regions is set, every region otherwise.
+    """
+    float_id = int(float_id) if float_id is not None else None
+    names = list(regions) if regions is not None else list(spatial.REGIONS)
+    records = []
+    for name in names:
+        records.extend(await _region_members(conn, spatial.REGIONS[name], float_id))
+    
+    async with conn.transaction():
+        await conn.execute("""
+            DELETE FROM float_region WHERE region = ANY($1::text[]) AND ($2::int IS NULL OR float_id = $2)
+        """, names, float_id)
+        if records:
+            await conn.copy_records_to_table(
+                'float_region', records=records,
+                columns=['region', 'float_id', 'profile_count', 'first_profile_date', 'last_profile_date'],
+                schema_name='public'
+            )
+        if float_id is None:
+            await conn.executemany("""
+                INSERT INTO float_region_state (region, signature, updated_at) VALUES ($1, $2, NOW())
+                ON CONFLICT (region) DO UPDATE SET signature = EXCLUDED.signature, updated_at = EXCLUDED.updated_at
+            """, [(name, spatial.region_signature(name)) for name in names])
+    logger.info(f"float_region refreshed for {'float ' + str(float_id) if float_id else 'all floats'} "
+                f"in {len(names)} region(s) ({len(records)} rows)")
+    return len(records)
+
+# ==================== MEASUREMENTS LAYOUT ====================
+
+MEASUREMENT_COLUMNS = ["float_id", "cycle_number", "n_level", "pressure", "depth_m", "temperature", "salinity", "created_at"]
+
+async def measurements_is_partitioned(conn, table: str = "measurements") -> Optional[bool]:
+    """True for a partitioned table, False for a plain heap, None when the table does not exist"""
+    relkind = await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = to_regclass($1)", table)
+    if relkind is None:
+        return None
+    return relkind == 'p'
+
+async def create_measurements_table(conn, table: str = "measurements", hash_partitions: int = 0):
+    """
+    Create the measurements table (if missing) with its indexes.
+    hash_partitions > 0: PARTITION BY HASH (float_id) into that many partitions, keyed on
+    (float_id, cycle_number, n_level) so per-float queries touch a single partition.
+    Otherwise the original single-heap layout.
+    """
+    if hash_partitions <= 0:
+        await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id SERIAL PRIMARY KEY,
+            float_id INTEGER NOT NULL,
+            cycle_number INTEGER NOT NULL,
+            n_level INTEGER NOT NULL,
+            pressure DOUBLE PRECISION,
+            depth_m DOUBLE PRECISION,
+            temperature DOUBLE PRECISION,
+            salinity DOUBLE PRECISION,
+            created_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE (float_id, cycle_number, n_level)
+        )
+        """)
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_float_id_idx ON {table}(float_id);")
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_cycle_idx ON {table}(cycle_number);")
+        return
+    
+    # The partition key must be part of every unique constraint, so (float_id, cycle_number, n_level)
+    # becomes the primary key; it also serves every per-float lookup (no separate float_id index)
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        id BIGSERIAL,
+        float_id INTEGER NOT NULL,
+        cycle_number INTEGER NOT NULL,
+        n_level INTEGER NOT NULL,
+        pressure DOUBLE PRECISION,
+        depth_m DOUBLE PRECISION,
+        temperature DOUBLE PRECISION,
+        salinity DOUBLE PRECISION,
+        created_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (float_id, cycle_number, n_level)
+    ) PARTITION BY HASH (float_id)
+    """)
+    for remainder in range(hash_partitions):
+        await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table}_p{remainder:02d} PARTITION OF {table}
+        FOR VALUES WITH (MODULUS {hash_partitions}, REMAINDER {remainder})
+        """)
+    # Created on the parent, so each partition gets a matching local index
+    await conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_cycle_idx ON {table}(cycle_number);")
+
+# ==================== ARRAY-PER-PROFILE STORAGE ====================
+
+# Row-level view over profile_levels with the original measurements columns (Layer 3 SQL, ad-hoc queries)
+MEASUREMENTS_VIEW_SQL = """
+CREATE OR REPLACE VIEW measurements AS
+SELECT pl.float_id, pl.cycle_number, u.n_level::int AS n_level,
+       u.pressure::float8 AS pressure, u.pressure::float8 AS depth_m,
+       u.temperature::float8 AS temperature, u.salinity::float8 AS salinity
+FROM profile_levels pl
+CROSS JOIN LATERAL unnest(pl.n_level, pl.pressure, pl.temperature, pl.salinity)
+    AS u(n_level, pressure, temperature, salinity)
+"""
+
+async def measurements_storage(conn) -> str:
+    """'arrays' when measurements is the compatibility view over profile_levels, 'rows' otherwise"""
+    relkind = await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = to_regclass('measurements')")
+    return "arrays" if relkind == 'v' else "rows"
+
+async def create_profile_levels(conn, with_view: bool = True):
+    """
+    One row per profile with real[] arrays (aligned by position; NULL elements for missing
+    values, NULL arrays when a variable is missing throughout), plus the measurements view.
+    """
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS profile_levels (
+        float_id INTEGER NOT NULL,
+        cycle_number INTEGER NOT NULL,
+        n_level SMALLINT[] NOT NULL,
+        pressure REAL[] NOT NULL,
+        temperature REAL[],
+        salinity REAL[],
+        PRIMARY KEY (float_id, cycle_number)
+    )
+    """)
+    if with_view:
+        await conn.execute(MEASUREMENTS_VIEW_SQL)
+
+def profile_level_row(records: list) -> tuple:
+    """measurements-style records (float_id, cycle, n_level, pressure, depth_m, temp, psal) of one profile -> profile_levels row"""
+    float_id, cycle_number = records[0][0], records[0][1]
+    temperature = [r[5] for r in records]
+    salinity = [r[6] for r in records]
+    return (
+        float_id, cycle_number,
+        [r[2] for r in records],
+        [r[3] for r in records],
+        temperature if any(v is not None for v in temperature) else None,
+        salinity if any(v is not None for v in salinity) else None,
+    )
+
+async def write_profile_levels(conn, rows: list):
+    """Upsert profile_levels rows (re-ingesting a profile replaces its arrays)"""
+    await conn.executemany("""
+        INSERT INTO profile_levels (float_id, cycle_number, n_level, pressure, temperature, salinity)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (float_id, cycle_number) DO UPDATE SET
+            n_level = EXCLUDED.n_level, pressure = EXCLUDED.pressure,
+            temperature = EXCLUDED.temperature, salinity = EXCLUDED.salinity
+    """, rows)
+
+# ==================== CLIMATOLOGY CUBE ====================
+
+CLIMATOLOGY_PARAMETERS = ("temperature", "salinity")
+
+# (grid cell, month) keys of the profiles being refreshed: one float's, or all when $1 is NULL
+_CLIMATOLOGY_KEYS = """
+    SELECT DISTINCT floor(latitude::float8 / $2) * $2 AS cell_lat, floor(longitude::float8 / $2) * $2 AS cell_lon,
+           EXTRACT(MONTH FROM profile_date)::smallint AS month
+    FROM profiles
+    WHERE ($1::int IS NULL OR float_id = $1)
+    AND latitude IS NOT NULL AND longitude IS NOT NULL AND profile_date IS NOT NULL
+"""
+
+async def ensure_climatology(conn):
+    """
+    Create climatology_cube: count / sum / sum of squares / min / max of each parameter per
+    (grid cell, pressure bin, calendar month), so any set of cells, bins and months merges
+    into exact means and standard deviations. climatology_state holds the grid it was built with.
+    """
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS climatology_cube (
+        parameter TEXT NOT NULL,
+        pressure_bin DOUBLE PRECISION NOT NULL,
+        month SMALLINT NOT NULL,
+        cell_lat DOUBLE PRECISION NOT NULL,
+        cell_lon DOUBLE PRECISION NOT NULL,
+        value_count BIGINT NOT NULL,
+        value_sum DOUBLE PRECISION NOT NULL,
+        value_sum_sq DOUBLE PRECISION NOT NULL,
+        value_min REAL,
+        value_max REAL,
+        PRIMARY KEY (parameter, pressure_bin, month, cell_lat, cell_lon)
+    )
+    """)
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS climatology_state (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        cell_deg DOUBLE PRECISION NOT NULL,
+        pressure_bin DOUBLE PRECISION NOT NULL,
+        updated_at TIMESTAMP DEFAULT NOW()
+    )
+    """)
+
+async def climatology_grid(conn) -> Optional[Tuple[float, float]]:
+    """(cell_deg, pressure_bin) the cube was built with, None when it was never built"""
+    if not await conn.fetchval("SELECT to_regclass('climatology_state') IS NOT NULL"):
+        return None
+    row = await conn.fetchrow("SELECT cell_deg, pressure_bin FROM climatology_state WHERE id")
+    return (row['cell_deg'], row['pressure_bin']) if row else None
+
+async def refresh_climatology(conn, float_id: Optional[int] = None,
+                              cell_deg: Optional[float] = None, pressure_bin: Optional[float] = None) -> int:
+    """
+    Recompute the cube cells touched by one float's profiles (incremental, after ingesting it),
+    or every cell when float_id is None. The grid defaults to the one the cube was built with;
+    passing a new one requires a full refresh. Does nothing when the cube was never built.
+    """
+    float_id = int(float_id) if float_id is not None else None
+    if cell_deg is None or pressure_bin is None:
+        grid = await climatology_grid(conn)
+        if grid is None:
+            return 0
+        cell_deg, pressure_bin = grid
+    elif float_id is not None:
+        raise ValueError("A new climatology grid needs a full refresh (float_id=None)")
+    cell_deg, pressure_bin = float(cell_deg), float(pressure_bin)
+    
+    async with conn.transaction():
+        if float_id is None:
+            await conn.execute("DELETE FROM climatology_cube")
+        else:
+            await conn.execute(f"""
+                DELETE FROM climatology_cube c USING ({_CLIMATOLOGY_KEYS}) k
+                WHERE c.cell_lat = k.cell_lat AND c.cell_lon = k.cell_lon AND c.month = k.month
+            """, float_id, cell_deg)
+        # Every profile in the touched (cell, month) keys is re-aggregated, so min / max stay exact
+        result = await conn.execute(f"""
+            WITH keys AS ({_CLIMATOLOGY_KEYS}),
+            cells AS (
+                SELECT float_id, cycle_number,
+                       floor(latitude::float8 / $2) * $2 AS cell_lat, floor(longitude::float8 / $2) * $2 AS cell_lon,
+                       EXTRACT(MONTH FROM profile_date)::smallint AS month
+                FROM profiles
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND profile_date IS NOT NULL
+            )
+            INSERT INTO climatology_cube (parameter, pressure_bin, month, cell_lat, cell_lon,
+                                          value_count, value_sum, value_sum_sq, value_min, value_max)
+            SELECT v.parameter, floor(m.pressure / $3) * $3, c.month, c.cell_lat, c.cell_lon,
+                   COUNT(*), SUM(v.value), SUM(v.value * v.value), MIN(v.value), MAX(v.value)
+            FROM cells c
+            JOIN keys k ON k.cell_lat = c.cell_lat AND k.cell_lon = c.cell_lon AND k.month = c.month
+            JOIN measurements m ON m.float_id = c.float_id AND m.cycle_number = c.cycle_number
+            CROSS JOIN LATERAL (VALUES ('temperature', m.temperature::float8), ('salinity', m.salinity::float8))
+                AS v(parameter, value)
+            WHERE m.pressure IS NOT NULL AND v.value IS NOT NULL
+            GROUP BY 1, 2, 3, 4, 5
+        """, float_id, cell_deg, pressure_bin)
+        if float_id is None:
+            await conn.execute("""
+                INSERT INTO climatology_state (id, cell_deg, pressure_bin, updated_at) VALUES (TRUE, $1, $2, NOW())
+                ON CONFLICT (id) DO UPDATE SET cell_deg = EXCLUDED.cell_deg, pressure_bin = EXCLUDED.pressure_bin,
+                    updated_at = EXCLUDED.updated_at
+            """, cell_deg, pressure_bin)
+    rows = int(result.split()[-1])
+    logger.info(f"climatology_cube refreshed for {'float ' + str(float_id) if float_id else 'all floats'} ({rows} cells)")
+    return rows
+
 async def ingest_float(float_id: str, db_url: str, data_dir: str = DATA_DIR) -> Dict[str, Any]:
     """
     Ingest both metadata and profiles for a float
@@ -329,6 +753,14 @@ async def ingest_float(float_id: str, db_url: str, data_dir: str = DATA_DIR) ->
             
             if os.path.exists(prof_file):
                 profiles_count, measurements_count = await ingest_profiles(prof_file, conn)
+            
+            await ensure_float_summary(conn)
+            await refresh_float_summary(conn, float_id)
+            await ensure_float_region(conn)
+            await refresh_float_region(conn, float_id)
+            await refresh_climatology(conn, float_id)
+            # Cached results for this float (and aggregates) are stale in every process from here on
+            await data_versions.record_change(conn, float_id)
         finally:
             await conn.close()
         
@@ -15,26 +15,50 @@ sentence-transformers==2.2.2
 # backend13.py - COMPREHENSIVE AI-FIRST 3-LAYER SYSTEM
 import os
 import re
+import base64
+import hashlib
 import asyncio
+import inspect
 import logging
 import json
+import math
+import random
+import threading
+import time
 import uuid
-from datetime import datetime, date, timedelta
-from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime, date, timedelta, timezone
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable
 from contextlib import asynccontextmanager
-from collections import defaultdict
+from contextvars import ContextVar, copy_context
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import asyncpg
 import chromadb
+import httpx
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import pandas as pd
 import numpy as np
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from chromadb.utils import embedding_functions
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+import bulk_export
+import data_versions
+import downsample
+import float_columns
+import spatial
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # shared result cache is optional
+    redis_asyncio = None
+
 # Load environment variables
 load_dotenv()
 
@@ -44,26 +68,867 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "your-gemini-api-key")
 SUPABASE_URL = os.getenv("SUPABASE_URL", "https://your-project.supabase.co")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "your-supabase-key")
 
+# LLM gateway: "gemini" or "stub" (deterministic offline model for benchmarking)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "20"))
+
+# Query planning: "unified" (one LLM call picks tool / plan / SQL, cascade as fallback) or "cascade" (Layer 1 → 2 → 3)
+PLANNER_MODE = os.getenv("PLANNER_MODE", "unified")
+
+# Speculative prefetch of likely tool results while the LLM routes (off by default)
+SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "false").lower() in ("1", "true", "yes")
+
+# Coalesce identical concurrent queries and tool calls into one execution
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "true").lower() in ("1", "true", "yes")
+
+# Tool result cache: in-process LRU, optionally backed by Redis shared between workers
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "1024"))  # 0 disables the cache
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "3600"))  # upper bound on entry age, on top of data-version invalidation
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Hot-float column cache: per-float NumPy measurement columns, LRU-bounded by memory
+HOT_FLOAT_CACHE_MB = float(os.getenv("HOT_FLOAT_CACHE_MB", "256"))  # 0 disables the cache
+HOT_FLOAT_MAX_LEVELS = int(os.getenv("HOT_FLOAT_MAX_LEVELS", "2000000"))  # larger floats are always read with SQL
+HOT_FLOAT_CACHE_TTL = float(os.getenv("HOT_FLOAT_CACHE_TTL", str(TOOL_CACHE_TTL)))
+
+# Guards for LLM-generated SQL
+SQL_MAX_COST = float(os.getenv("SQL_MAX_COST", "500000"))  # planner cost units (EXPLAIN)
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "5000"))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "100"))
+SQL_MAX_REWRITES = int(os.getenv("SQL_MAX_REWRITES", "1"))  # LLM retries after a rejection
+
+# Supabase RPC fallback for generated SQL (async HTTP, pooled, circuit-broken)
+SUPABASE_RPC_TIMEOUT = float(os.getenv("SUPABASE_RPC_TIMEOUT", "10"))
+SUPABASE_RPC_MAX_CONNECTIONS = int(os.getenv("SUPABASE_RPC_MAX_CONNECTIONS", "20"))
+SUPABASE_BREAKER_THRESHOLD = int(os.getenv("SUPABASE_BREAKER_THRESHOLD", "5"))  # consecutive failures to open
+SUPABASE_BREAKER_RESET = float(os.getenv("SUPABASE_BREAKER_RESET", "30"))  # seconds before a trial call
+
+# Keyset pagination for listing / measurement endpoints
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "5000"))
+FLOAT_PROFILE_PAGE_SIZE = int(os.getenv("FLOAT_PROFILE_PAGE_SIZE", "2000"))  # measurements per /float/{id} page
+
+# Streaming bulk export (/export)
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "20000"))  # rows per cursor fetch / Parquet row group
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))  # each export holds a pooled connection
+
+# Chart payloads: default max_points for depth profiles / time series (0 returns raw points)
+PLOT_MAX_POINTS = int(os.getenv("PLOT_MAX_POINTS", "500"))
+PROFILE_MAX_SERIES = int(os.getenv("PROFILE_MAX_SERIES", "50"))  # most recent cycles returned by get_depth_profile(mode="all")
+
+# Hash partitions for a newly created measurements table (0 = single table; see migrate_measurements.py)
+MEASUREMENTS_PARTITIONS = int(os.getenv("MEASUREMENTS_PARTITIONS", "0"))
+
+# Storage for a new database: "rows" (one measurements row per level) or "arrays" (one profile_levels
+# row per profile with real[] arrays; measurements becomes a compatibility view)
+MEASUREMENTS_STORAGE = os.getenv("MEASUREMENTS_STORAGE", "rows")
+
+# date_trunc units accepted by get_temporal_analysis / get_timeseries
+TIME_BUCKETS = ("day", "week", "month")
+
+# Climatology cube grid (get_climatology): lat/lon cell size in degrees and pressure bin width in dbar.
+# Changing either rebuilds climatology_cube at the next start.
+CLIMATOLOGY_CELL_DEG = float(os.getenv("CLIMATOLOGY_CELL_DEG", "1.0"))
+CLIMATOLOGY_PRESSURE_BIN = float(os.getenv("CLIMATOLOGY_PRESSURE_BIN", "50"))
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# Extended regions with proper bounding boxes
-REGIONS = {
-    "equator": (-5, 5, -180, 180),
-    "arabian_sea": (5, 25, 50, 75),
-    "indian_ocean": (-40, 25, 40, 120),
-    "bay_of_bengal": (5, 22, 80, 95),
-    "south_atlantic": (-40, 0, -50, 20),
-    "north_pacific": (0, 60, 120, -120),
-}
+# Region name -> bounding box (lat_min, lat_max, lon_min, lon_max; lon_min > lon_max wraps the antimeridian).
+# Definitions (boxes and polygons) live in spatial.REGION_DEFINITIONS; membership is in float_region.
+REGIONS = {name: region.bounds for name, region in spatial.REGIONS.items()}
+
+# Async callback used to push progress events (routing, tool results, tokens) to streaming clients
+EventEmitter = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# ==================== QUERY BUDGET ====================
+class BudgetExhausted(Exception):
+    """Raised when a query runs out of time or LLM calls"""
+
+class QueryBudget:
+    """Per-request deadline and LLM-call allowance, carried through every layer via a context variable"""
+    def __init__(self, timeout: float, max_llm_calls: int):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.max_llm_calls = max_llm_calls
+        self.llm_calls = 0
+        # Tool results gathered so far, returned when the budget runs out
+        self.partial_results: Dict[str, Any] = {}
+    
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+    
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+    
+    @property
+    def llm_calls_left(self) -> int:
+        return max(0, self.max_llm_calls - self.llm_calls)
+    
+    def check(self):
+        if self.expired:
+            raise BudgetExhausted(f"Query deadline of {self.timeout}s exceeded")
+    
+    def consume_llm_call(self):
+        self.check()
+        if self.llm_calls >= self.max_llm_calls:
+            raise BudgetExhausted(f"LLM call budget of {self.max_llm_calls} per query exhausted")
+        self.llm_calls += 1
+    
+    def record(self, tool_name: str, result: Any):
+        self.partial_results[tool_name] = result
+
+_current_budget: ContextVar[Optional[QueryBudget]] = ContextVar("query_budget", default=None)
+
+def current_budget() -> Optional[QueryBudget]:
+    return _current_budget.get()
+
+def db_timeout() -> Optional[float]:
+    """Timeout for one DB call under the current request budget (None = pool command_timeout)"""
+    budget = _current_budget.get()
+    if budget is None:
+        return None
+    budget.check()
+    return budget.remaining()
+
+# ==================== LLM GATEWAY ====================
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds)"""
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, math.inf)
+    
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.total = 0.0
+    
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bucket bound containing the q-th quantile"""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.BUCKETS, self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return self.BUCKETS[-1]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_seconds": round(self.total / self.count, 4) if self.count else None,
+            "p50_le": self.quantile(0.5),
+            "p95_le": self.quantile(0.95),
+            "buckets": {("+Inf" if math.isinf(b) else str(b)): c for b, c in zip(self.BUCKETS, self.counts)}
+        }
+
+class LLMGateway:
+    """
+    Single entry point for every LLM call.
+    
+    Calls run on a dedicated bounded thread pool (not the default executor shared with other
+    to_thread work), behind a semaphore that caps concurrent requests to the provider. A slot is
+    held until the provider thread returns, even after the caller timed out. Each call
+    is charged to the current QueryBudget, bounded by a per-call timeout and retried with
+    jittered exponential backoff on transient provider errors.
+    """
+    RETRYABLE_ERRORS = (
+        asyncio.TimeoutError,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    )
+    
+    def __init__(self, model, max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES,
+                 call_timeout: float = LLM_CALL_TIMEOUT, backoff_base: float = 0.5):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.call_timeout = call_timeout
+        self.backoff_base = backoff_base
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.histogram = LatencyHistogram()
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "timeouts": 0, "in_flight": 0, "waiting": 0}
+    
+    def _call_timeout(self) -> float:
+        budget = current_budget()
+        if budget is None:
+            return self.call_timeout
+        budget.check()
+        return min(self.call_timeout, budget.remaining())
+    
+    async def _acquire_slot(self):
+        """Wait for a concurrency slot without outliving the request deadline"""
+        self.stats["waiting"] += 1
+        try:
+            budget = current_budget()
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=budget.remaining() if budget else None)
+        except asyncio.TimeoutError:
+            raise BudgetExhausted("Query deadline exceeded while waiting for an LLM slot")
+        finally:
+            self.stats["waiting"] -= 1
+    
+    def _release_slot(self):
+        self.stats["in_flight"] -= 1
+        self._semaphore.release()
+    
+    def _submit(self, fn) -> asyncio.Future:
+        """
+        Run fn on the LLM executor under an already acquired slot. The slot is released when the
+        thread finishes rather than when the caller stops waiting, so a call that timed out keeps
+        counting against max_concurrency until the provider actually returns.
+        """
+        loop = asyncio.get_running_loop()
+        
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self._release_slot)
+            except RuntimeError:
+                # Event loop already closed (shutdown)
+                pass
+        
+        self.stats["in_flight"] += 1
+        future = self._executor.submit(fn)
+        future.add_done_callback(release)
+        return asyncio.wrap_future(future)
+    
+    def _start_attempt(self, fn) -> Tuple[asyncio.Future, float]:
+        """Submit one attempt after _acquire_slot; returns (future, timeout). Frees the slot if nothing was submitted."""
+        try:
+            timeout = self._call_timeout()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self._submit(fn), timeout
+    
+    async def _backoff(self, e: BaseException, attempt: int, budget: Optional[QueryBudget]):
+        """Sleep before retry attempt + 1, or re-raise e when retries are used up"""
+        if attempt >= self.max_retries:
+            self.stats["failures"] += 1
+            raise e
+        delay = self.backoff_base * (2 ** attempt) * random.uniform(0.5, 1.5)
+        if budget:
+            delay = min(delay, budget.remaining())
+        self.stats["retries"] += 1
+        logger.warning(f"LLM call failed ({type(e).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+    
+    async def generate(self, prompt: str):
+        """Run one completion and return the provider response (with .text)"""
+        budget = current_budget()
+        if budget:
+            budget.consume_llm_call()
+        
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_slot()
+            future, timeout = self._start_attempt(partial(self.model.generate_content, prompt))
+            self.stats["calls"] += 1
+            started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(future, timeout=timeout)
+                self.histogram.observe(time.monotonic() - started)
+                return response
+            except self.RETRYABLE_ERRORS as e:
+                self.histogram.observe(time.monotonic() - started)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["timeouts"] += 1
+                    if budget and budget.expired:
+                        raise BudgetExhausted(f"Query deadline of {budget.timeout}s exceeded while waiting on the LLM")
+                await self._backoff(e, attempt, budget)
+            except Exception:
+                self.stats["failures"] += 1
+                raise
+    
+    def _produce(self, prompt: str, loop, queue: asyncio.Queue, stop: threading.Event, finished: object):
+        """Executor side of stream(): push text chunks, then an exception (if any), then finished"""
+        try:
+            for chunk in self.model.generate_content(prompt, stream=True):
+                if stop.is_set():
+                    return
+                try:
+                    text = chunk.text
+                except (ValueError, AttributeError):
+                    # Blocked or empty candidates carry no text
+                    continue
+                if text:
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+    
+    async def stream(self, prompt: str, on_token: Callable[[str], Awaitable[None]]) -> str:
+        """
+        Stream one completion, awaiting on_token for every text chunk. Returns the full text.
+        
+        Retryable provider errors and per-call timeouts are retried like generate() only until the
+        first chunk has been forwarded; after that a retry would repeat text the client already has,
+        so the error is raised. BudgetExhausted is raised only once the query deadline has passed.
+        """
+        budget = current_budget()
+        if budget:
+            budget.consume_llm_call()
+        
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            queue: asyncio.Queue = asyncio.Queue()
+            finished = object()
+            stop = threading.Event()
+            
+            await self._acquire_slot()
+            producer, _ = self._start_attempt(partial(self._produce, prompt, loop, queue, stop, finished))
+            self.stats["calls"] += 1
+            started = time.monotonic()
+            parts = []
+            retry = None
+            try:
+                while True:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout=self._call_timeout())
+                    except asyncio.TimeoutError as e:
+                        self.stats["timeouts"] += 1
+                        if budget and budget.expired:
+                            raise BudgetExhausted(f"Query deadline of {budget.timeout}s exceeded while streaming from the LLM")
+                        if not parts:
+                            retry = e
+                            break
+                        self.stats["failures"] += 1
+                        raise asyncio.TimeoutError("LLM stream stalled past the call timeout")
+                    if item is finished:
+                        break
+                    if isinstance(item, Exception):
+                        if isinstance(item, self.RETRYABLE_ERRORS) and not parts:
+                            retry = item
+                            break
+                        self.stats["failures"] += 1
+                        raise item
+                    parts.append(item)
+                    await on_token(item)
+            finally:
+                # The producer thread stops at its next chunk; its slot is freed when it exits
+                stop.set()
+                self.histogram.observe(time.monotonic() - started)
+            
+            if retry is not None:
+                await self._backoff(retry, attempt, budget)
+                continue
+            await producer
+            return "".join(parts)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.model).__name__,
+            "max_concurrency": self.max_concurrency,
+            **self.stats,
+            "latency": self.histogram.snapshot()
+        }
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class _StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class DeterministicLLMStub:
+    """
+    Offline stand-in for the Gemini model (LLM_BACKEND=stub).
+    
+    Recognises each prompt the pipeline sends and answers with deterministic keyword-based JSON,
+    so the whole pipeline can be exercised and benchmarked without network access.
+    """
+    PARAMETERS = ("temperature", "salinity", "pressure", "depth_m")
+    
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+    
+    def generate_content(self, prompt: str, stream: bool = False):
+        if self.latency:
+            time.sleep(self.latency)
+        text = self._respond(prompt)
+        if stream:
+            return iter(_StubResponse(word + " ") for word in text.split(" "))
+        return _StubResponse(text)
+    
+    def _extract_query(self, prompt: str) -> str:
+        match = re.search(r'(?:Query|QUERY|USER_QUERY)["\']?\s*[:=]\s*["\']([^"\']*)["\']', prompt)
+        return match.group(1) if match else prompt
+    
+    def _entities(self, query: str) -> Dict[str, Any]:
+        lowered = query.lower()
+        return {
+            "float_ids": [int(f) for f in re.findall(r'\b\d{7}\b', query)],
+            "parameter": next((p for p in self.PARAMETERS if p in lowered), None),
+            "region": next((r for r in REGIONS if r in lowered.replace(' ', '_')), None),
+            "lowered": lowered
+        }
+    
+    def _route(self, query: str) -> Dict[str, Any]:
+        e = self._entities(query)
+        lowered, float_ids, parameter, region = e["lowered"], e["float_ids"], e["parameter"], e["region"]
+        
+        def tool(name, params):
+            return {"tool": name, "parameters": params, "confidence": 0.95, "reasoning": "stub keyword match"}
+        
+        if re.search(r'\b(hello|hi|hey|good morning)\b', lowered):
+            return tool("greeting", {})
+        if re.search(r'\b(bye|goodbye)\b', lowered):
+            return tool("farewell", {})
+        if "what can you do" in lowered or lowered.strip() == "help":
+            return tool("capabilities", {})
+        if re.search(r'\b(average|mean|maximum|minimum)\b', lowered) and parameter in ("temperature", "salinity") and not float_ids:
+            depth = re.search(r'\b(\d+)\s*(?:m|dbar)\b', lowered)
+            return tool("get_climatology", {"parameter": parameter, **({"region": region} if region else {}),
+                                            **({"depth": int(depth.group(1))} if depth else {})})
+        if re.search(r'\b(average|mean|maximum|minimum|median)\b', lowered):
+            return {"tool": None, "confidence": 0.0, "reasoning": "stub: aggregation", "requires_sql": True}
+        if re.search(r'\b(how many|count)\b', lowered):
+            return tool("count_floats", {"region": region} if region else {})
+        if region and (parameter or "trajector" in lowered or "location" in lowered):
+            return {"tool": None, "confidence": 0.0, "reasoning": "stub: multi-step", "requires_multiple_tools": True,
+                    "suggested_tools": ["get_floats_in_region", "compare_floats" if parameter else "get_multiple_trajectories"]}
+        if region:
+            return tool("get_floats_in_region", {"region": region})
+        if len(float_ids) >= 2:
+            if parameter:
+                return tool("compare_floats", {"float_ids": float_ids, "parameter": parameter})
+            return tool("get_multiple_trajectories", {"float_ids": float_ids})
+        if len(float_ids) == 1:
+            if re.search(r'\b(path|trajectory|route|where)\b', lowered):
+                return tool("get_trajectory", {"float_id": float_ids[0]})
+            if "over time" in lowered or "trend" in lowered:
+                return tool("get_timeseries", {"float_id": float_ids[0], "parameter": parameter or "temperature"})
+            if parameter:
+                return tool("get_depth_profile", {"float_id": float_ids[0], "parameter": parameter})
+            return tool("get_float_profile", {"float_id": float_ids[0]})
+        if "all floats" in lowered or "list" in lowered:
+            return tool("list_all_floats", {"limit": 10})
+        return {"tool": None, "confidence": 0.0, "reasoning": "Query is ambiguous or cannot be answered with available tools"}
+    
+    def _plan(self, query: str) -> Dict[str, Any]:
+        e = self._entities(query)
+        steps = [{"tool": "get_floats_in_region", "parameters": {"region": e["region"] or "indian_ocean"}, "purpose": "find floats"}]
+        if e["parameter"]:
+            steps.append({"tool": "compare_floats", "parameters": {"float_ids": "EXTRACT:floats:ALL", "parameter": e["parameter"]}, "purpose": "compare"})
+        else:
+            steps.append({"tool": "get_multiple_trajectories", "parameters": {"float_ids": "EXTRACT:floats:ALL"}, "purpose": "map"})
+        return {"plan": steps, "expected_output": "Regional float data"}
+    
+    def _respond(self, prompt: str) -> str:
+        if "query planner for an ARGO" in prompt:
+            query = self._extract_query(prompt)
+            route = self._route(query)
+            if route.get("tool"):
+                return json.dumps({"mode": "tool", **route})
+            if route.get("requires_multiple_tools"):
+                return json.dumps({"mode": "plan", **self._plan(query)})
+            if route.get("requires_sql"):
+                sql = json.loads(self._respond(f"Database Schema USER_QUERY: '{query}'"))[0]["SQL"]
+                return json.dumps({"mode": "sql", "sql": sql, "text": ""})
+            return json.dumps({"mode": "none", "reasoning": route.get("reasoning", "")})
+        if "STRICT tool selector" in prompt:
+            return json.dumps(self._route(self._extract_query(prompt)))
+        if "orchestration planner" in prompt:
+            return json.dumps(self._plan(self._extract_query(prompt)))
+        if "parameter resolver" in prompt:
+            float_ids = [int(f) for f in re.findall(r'"platform_number":\s*(\d+)', prompt)]
+            parameter = re.search(r'"parameter":\s*"(\w+)"', prompt)
+            resolved = {"float_ids": float_ids}
+            if parameter:
+                resolved["parameter"] = parameter.group(1)
+            return json.dumps({"resolved_parameters": resolved, "resolution_notes": "stub: all floats from previous step"})
+        if "Database Schema" in prompt:
+            e = self._entities(self._extract_query(prompt))
+            column = e["parameter"] or "temperature"
+            where = f" WHERE float_id = {e['float_ids'][0]}" if e["float_ids"] else ""
+            return json.dumps([{"SQL": f"SELECT AVG({column}) AS avg_{column} FROM measurements{where} LIMIT 100;",
+                                "TEXT": "", "GRAPHS": {}, "CONTEXT": []}])
+        return "Offline stub analysis: the requested ARGO data was retrieved; see the attached tool results."
+
+# ==================== SUPABASE RPC CLIENT ====================
+class CircuitOpenError(Exception):
+    """Remote call skipped because the circuit breaker is open"""
+    pass
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    
+    closed → open after failure_threshold failures in a row; open → half_open after reset_timeout,
+    letting one trial call through; a success closes it again, a failure re-opens it.
+    """
+    def __init__(self, failure_threshold: int = SUPABASE_BREAKER_THRESHOLD, reset_timeout: float = SUPABASE_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.rejected = 0
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+    
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_in_flight):
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit open after {self.failures} consecutive failures")
+        if state == "half_open":
+            self.trial_in_flight = True
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+    
+    def release_trial(self):
+        """The half-open trial ended without an outcome (e.g. cancelled); let the next call try instead"""
+        self.trial_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures, "rejected_calls": self.rejected}
+
+class SupabaseRPCClient:
+    """
+    Non-blocking PostgREST RPC client (POST {url}/rest/v1/rpc/{function}).
+    
+    Shares one pooled httpx.AsyncClient with connect/read timeouts and a circuit breaker,
+    so a slow or failing remote never stalls the event loop. base_url can point at a local
+    HTTP stand-in for testing.
+    """
+    def __init__(self, base_url: str, api_key: str, timeout: float = SUPABASE_RPC_TIMEOUT,
+                 max_connections: int = SUPABASE_RPC_MAX_CONNECTIONS, breaker: Optional[CircuitBreaker] = None):
+        self.client = httpx.AsyncClient(
+            base_url=f"{base_url.rstrip('/')}/rest/v1",
+            headers={"apikey": api_key, "Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 3.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.latency = LatencyHistogram()
+    
+    async def rpc(self, function: str, params: Dict[str, Any]) -> Any:
+        """Call a Postgres function over PostgREST; returns the decoded JSON body"""
+        timeout = self.timeout
+        budget = current_budget()
+        if budget is not None:
+            budget.check()
+            timeout = min(timeout, budget.remaining())
+        self.breaker.before_call()
+        self.calls += 1
+        
+        started = time.monotonic()
+        try:
+            response = await self.client.post(f"/rpc/{function}", json=params, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+        except httpx.HTTPStatusError as e:
+            self.failures += 1
+            # 4xx means the request was bad (e.g. invalid SQL), not that the remote is unhealthy
+            if e.response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except Exception:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled (e.g. by the request deadline): says nothing about the remote's health
+            self.breaker.release_trial()
+            raise
+        finally:
+            self.latency.observe(time.monotonic() - started)
+        
+        self.breaker.record_success()
+        return data
+    
+    async def aclose(self):
+        await self.client.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "circuit": self.breaker.snapshot(),
+            "latency": self.latency.snapshot()
+        }
+
+# ==================== GUARDED SQL EXECUTOR ====================
+class SQLRejected(Exception):
+    """Generated SQL refused by the guard (not read-only, too expensive, or timed out)"""
+    def __init__(self, reason: str, estimated_cost: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.estimated_cost = estimated_cost
+
+class GuardedSQLExecutor:
+    """
+    Read-only, cost-checked execution of LLM-generated SQL.
+    
+    - single SELECT / WITH statement only, run in a READ ONLY transaction
+    - SET LOCAL statement_timeout (capped by the request budget)
+    - EXPLAIN first; plans above max_cost are refused. Streamable plans are judged by the cost
+      of producing max_rows rows, since rows are read through a cursor and never beyond the cap
+    """
+    WRITE_KEYWORDS = re.compile(r"\b(insert|update|delete|merge|drop|alter|create|truncate|grant|revoke|copy|vacuum|call|do|lock|set|reset)\b", re.IGNORECASE)
+    
+    def __init__(self, db_pool, max_cost: float = SQL_MAX_COST, statement_timeout_ms: int = SQL_STATEMENT_TIMEOUT_MS,
+                 max_rows: int = SQL_MAX_ROWS):
+        self.db_pool = db_pool
+        self.max_cost = max_cost
+        self.statement_timeout_ms = statement_timeout_ms
+        self.max_rows = max_rows
+        self.executed = 0
+        self.rejected = 0
+    
+    @classmethod
+    def validate(cls, sql_query: str) -> str:
+        """Single read-only statement without trailing semicolon, or SQLRejected"""
+        sql = sql_query.strip().rstrip(";").strip()
+        without_literals = re.sub(r"'(?:[^']|'')*'", "''", sql)
+        if ";" in without_literals:
+            raise SQLRejected("Only a single SQL statement is allowed")
+        if not re.match(r"^\s*(select|with)\b", without_literals, re.IGNORECASE):
+            raise SQLRejected("Only SELECT queries are allowed")
+        if cls.WRITE_KEYWORDS.search(without_literals):
+            raise SQLRejected("Query must be read-only")
+        return sql
+    
+    def _effective_cost(self, plan: Dict[str, Any]) -> float:
+        """Cost of reading at most max_rows rows from the plan's output"""
+        startup = plan.get("Startup Cost", 0.0)
+        total = plan.get("Total Cost", 0.0)
+        rows = plan.get("Plan Rows", 0) or 1
+        return startup + (total - startup) * min(1.0, self.max_rows / rows)
+    
+    def _timeout_ms(self) -> int:
+        timeout = self.statement_timeout_ms
+        budget = current_budget()
+        if budget is not None:
+            budget.check()
+            timeout = min(timeout, max(1, int(budget.remaining() * 1000)))
+        return timeout
+    
+    async def fetch(self, sql_query: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Run the query under the guards; returns (rows, execution info)"""
+        try:
+            sql = self.validate(sql_query)
+        except SQLRejected:
+            self.rejected += 1
+            raise
+        
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                await conn.execute(f"SET LOCAL statement_timeout = {self._timeout_ms()}")
+                explain = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}")
+                plan = (json.loads(explain) if isinstance(explain, str) else explain)[0]["Plan"]
+                cost = self._effective_cost(plan)
+                if cost > self.max_cost:
+                    self.rejected += 1
+                    raise SQLRejected(
+                        f"Estimated cost {cost:.0f} exceeds the limit of {self.max_cost:.0f} "
+                        f"(top plan node: {plan.get('Node Type')}, ~{plan.get('Plan Rows')} rows). "
+                        "Filter by float_id/cycle_number or aggregate before joining measurements.",
+                        estimated_cost=cost
+                    )
+                
+                try:
+                    cursor = await conn.cursor(sql)
+                    rows = await cursor.fetch(self.max_rows + 1)
+                except asyncpg.exceptions.QueryCanceledError:
+                    self.rejected += 1
+                    raise SQLRejected(f"Query exceeded the statement timeout of {self.statement_timeout_ms} ms",
+                                      estimated_cost=cost)
+        
+        self.executed += 1
+        truncated = len(rows) > self.max_rows
+        return [dict(row) for row in rows[:self.max_rows]], {
+            "estimated_cost": round(cost, 1),
+            "truncated": truncated,
+            "row_cap": self.max_rows
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "rejected": self.rejected,
+            "max_cost": self.max_cost,
+            "statement_timeout_ms": self.statement_timeout_ms,
+            "max_rows": self.max_rows
+        }
+
+# ==================== SQL TEMPLATE STORE ====================
+class SQLTemplateStore:
+    """
+    Reuse of generated SQL for structurally identical questions.
+    
+    Literals in the question (float IDs, numbers such as depths, ISO dates) become typed slots;
+    the same literal values in the generated SQL become placeholders. A later question with the
+    same shape gets the SQL with its own literals substituted, without an LLM call.
+    A template is only kept when every slot maps to exactly one place in the SQL and the SQL has
+    no other numeric or date literal (outside LIMIT): a value the LLM derived from a question
+    literal or took from conversation context (e.g. '2024-01-01' for "in 2023") would otherwise
+    stay fixed while the slots change. The LLM's TEXT describes the original values and is not kept.
+    """
+    LITERAL_PATTERN = re.compile(r'\b(\d{4}-\d{2}-\d{2})\b|(?<![\w.])(\d{7})(?![\d.])|(?<![\w.])(-?\d+(?:\.\d+)?)(?![\d.])')
+    # Any number left in the SQL (dates are caught by their year); slot placeholders are preceded by "slot"
+    SQL_LITERAL_PATTERN = re.compile(r'(?<![\w.])\d+(?:\.\d+)?(?![\w.])')
+    
+    def __init__(self, max_templates: int = 256):
+        self.max_templates = max_templates
+        self.templates: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+    
+    def _parameterize(self, query: str) -> Tuple[str, List[str]]:
+        """Question shape with typed slots, and the literal values in slot order"""
+        literals = []
+        
+        def slot(match):
+            if match.group(1):
+                kind = "DATE"
+            elif match.group(2):
+                kind = "FLOAT_ID"
+            else:
+                kind = "NUM"
+            literals.append(match.group(0))
+            return f"{{{kind}}}"
+        
+        normalized = " ".join(query.lower().strip().rstrip("?.!").split())
+        return self.LITERAL_PATTERN.sub(slot, normalized), literals
+    
+    @staticmethod
+    def _literal_regex(value: str) -> re.Pattern:
+        return re.compile(r"(?<![\w.])" + re.escape(value) + r"(?![\w.])")
+    
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Generated-SQL result for the query from a stored template, or None"""
+        shape, literals = self._parameterize(query)
+        template = self.templates.get(shape)
+        if template is None:
+            self.misses += 1
+            return None
+        self.templates.move_to_end(shape)
+        self.hits += 1
+        sql = template["SQL"]
+        for i, value in enumerate(literals):
+            sql = sql.replace(f"{{{{slot{i}}}}}", value)
+        return {**template, "SQL": sql}
+    
+    def remember(self, query: str, result: Dict[str, Any]):
+        """Store the template behind a successful generated-SQL result"""
+        sql = (result.get("SQL") or "").strip()
+        if not sql:
+            return
+        shape, literals = self._parameterize(query)
+        if len(set(literals)) != len(literals):
+            return  # repeated value: cannot tell which occurrence is which slot
+        
+        # LIMIT values are safety caps, not question literals
+        limit_clause = re.search(r"\bLIMIT\s+\d+", sql, re.IGNORECASE)
+        body, tail = (sql[:limit_clause.start()], sql[limit_clause.start():]) if limit_clause else (sql, "")
+        for i, value in enumerate(literals):
+            pattern = self._literal_regex(value)
+            if len(pattern.findall(body)) != 1:
+                return
+            body = pattern.sub(f"{{{{slot{i}}}}}", body)
+        if self.SQL_LITERAL_PATTERN.search(body):
+            return  # literal not taken verbatim from the question
+        
+        self.templates[shape] = {
+            "SQL": body + tail,
+            "TEXT": "",
+            "GRAPHS": result.get("GRAPHS", {}),
+            "CONTEXT": []
+        }
+        self.templates.move_to_end(shape)
+        self.stored += 1
+        while len(self.templates) > self.max_templates:
+            self.templates.popitem(last=False)
+    
+    def forget(self, query: str):
+        self.templates.pop(self._parameterize(query)[0], None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "templates": len(self.templates),
+            "stored": self.stored,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None
+        }
 
 # ==================== SQL GENERATION SYSTEM ====================
 class SQLGenerationSystem:
-    def __init__(self, gemini_model, supabase_client, db_pool=None):
-        self.gemini_model = gemini_model
+    def __init__(self, llm: LLMGateway, supabase_client, db_pool=None, rpc_client: Optional[SupabaseRPCClient] = None):
+        self.llm = llm
         self.supabase = supabase_client
+        self.rpc_client = rpc_client
         self.db_pool = db_pool
+        self.guard = GuardedSQLExecutor(db_pool) if db_pool else None
+        self.templates = SQLTemplateStore()
+        # Executed SQL results keyed by normalized SQL text + global data version
+        self.result_cache = LRUCacheBackend(TOOL_CACHE_SIZE, TOOL_CACHE_TTL)
+        self.result_cache_hits = 0
+        self.result_cache_misses = 0
+    
+    @staticmethod
+    def _result_cache_key(sql_query: str) -> Optional[str]:
+        """None while the shared data versions are not being followed (results are then not cached)"""
+        if not data_versions.versions.synced:
+            return None
+        normalized = " ".join(sql_query.strip().rstrip(";").split())
+        return json.dumps([normalized, data_versions.versions.tag()])
+    
+    def from_template(self, query: str) -> Optional[Dict[str, Any]]:
+        """Generated SQL for a question with the same shape as an earlier one (no LLM call)"""
+        return self.templates.lookup(query)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.result_cache_hits + self.result_cache_misses
+        return {
+            "guard": self.guard.get_stats() if self.guard else None,
+            "supabase_rpc": self.rpc_client.get_stats() if self.rpc_client else None,
+            "templates": self.templates.get_stats(),
+            "result_cache": {
+                "entries": len(self.result_cache.entries),
+                "hits": self.result_cache_hits,
+                "misses": self.result_cache_misses,
+                "hit_rate": round(self.result_cache_hits / lookups, 3) if lookups else None
+            }
+        }
         
     def _get_sql_generation_prompt(self) -> str:
         return '''
@@ -88,12 +953,20 @@ class SQLGenerationSystem:
         - measurements(
             FLOAT_ID, CYCLE_NUMBER, N_LEVEL, PRESSURE, DEPTH_M, TEMPERATURE, SALINITY
         )
+        - climatology_cube(
+            PARAMETER, PRESSURE_BIN, MONTH, CELL_LAT, CELL_LON,
+            VALUE_COUNT, VALUE_SUM, VALUE_SUM_SQ, VALUE_MIN, VALUE_MAX
+        )
 
         COLUMN NOTES:
         - Use TEMPERATURE (not TEMP)
         - Use SALINITY (not PSAL) 
         - PRESSURE is in dbar (depth equivalent)
         - DEPTH_M is actual depth in meters
+        - climatology_cube pre-aggregates measurements per lat/lon grid cell (CELL_LAT / CELL_LON = south-west
+          corner), pressure bin (PRESSURE_BIN = lower edge, dbar) and calendar MONTH, for PARAMETER
+          'temperature' or 'salinity'. Average = SUM(VALUE_SUM) / SUM(VALUE_COUNT). Prefer it over
+          measurements for regional / depth / monthly averages, min and max.
 
         Rules:
 
@@ -143,9 +1016,21 @@ class SQLGenerationSystem:
         ]
         '''
     
-    async def generate_sql_response(self, query: str, context: dict) -> Dict[str, Any]:
-        """Generate SQL or appropriate response using Gemini"""
+    async def generate_sql_response(self, query: str, context: dict, check_templates: bool = True) -> Dict[str, Any]:
+        """
+        Generate SQL or appropriate response using Gemini (stored templates first, unless the
+        caller already looked the query up and passes check_templates=False)
+        """
         try:
+            templated = self.from_template(query) if check_templates else None
+            if templated:
+                logger.info(f"Reusing SQL template: {templated['SQL']}")
+                response = await self.execute_sql_result(templated)
+                if response.get("success"):
+                    response["sql_template"] = True
+                    return response
+                self.templates.forget(query)
+            
             user_data = [{
                 "USER_QUERY": query,
                 "RETRIEVED_CONTEXT": context,
@@ -155,59 +1040,146 @@ class SQLGenerationSystem:
             
             final_prompt = f"{self._get_sql_generation_prompt()}\n\n### Actual Data for this Query:\n{user_data}"
             
-            response = await asyncio.to_thread(
-                lambda: self.gemini_model.generate_content(final_prompt)
-            )
-            
-            response_text = response.text.strip()
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-            
-            response_json = json.loads(response_text)
-            result = response_json[0] if isinstance(response_json, list) else response_json
-            
-            logger.info(f"SQL Generation Result: {result}")
-            
+            for attempt in range(1 + SQL_MAX_REWRITES):
+                response = await self.llm.generate(final_prompt)
+                
+                response_text = response.text.strip()
+                response_text = response_text.replace('```json', '').replace('```', '').strip()
+                
+                response_json = json.loads(response_text)
+                result = response_json[0] if isinstance(response_json, list) else response_json
+                
+                logger.info(f"SQL Generation Result: {result}")
+                
+                response = await self.execute_sql_result(result)
+                if response.get("success") and response.get("sql_query"):
+                    self.templates.remember(query, result)
+                
+                budget = current_budget()
+                if not response.get("rejected") or (budget and budget.llm_calls_left == 0):
+                    return response
+                
+                # Tell the model why its SQL was refused so the retry is cheaper
+                logger.info(f"Generated SQL rejected ({response['error']}), asking for a cheaper query")
+                final_prompt = (
+                    f"{self._get_sql_generation_prompt()}\n\n### Actual Data for this Query:\n{user_data}\n\n"
+                    f"### Your previous SQL was REJECTED by the database guard:\n{result.get('SQL')}\n"
+                    f"Reason: {response['error']}\n"
+                    f"Write a cheaper read-only SELECT: filter early (float_id, cycle_number, pressure ranges), "
+                    f"aggregate instead of returning raw rows, avoid cross joins, return at most {SQL_MAX_ROWS} rows."
+                )
+            return response
+                
+        except BudgetExhausted:
+            raise
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error in SQL generation: {e}")
+            return {
+                "success": False,
+                "error": "Failed to parse AI response",
+                "text_response": "I encountered an error processing your query. Please try again.",
+                "source": "sql_generation"
+            }
+        except Exception as e:
+            logger.error(f"SQL generation failed: {e}")
+            return {
+                "success": False,
+                "error": f"SQL generation failed: {str(e)}",
+                "source": "sql_generation"
+            }
+
+    async def execute_sql_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Execute an already-generated {"SQL", "TEXT", "GRAPHS", "CONTEXT"} result (no LLM call)"""
+        try:
             # If SQL is generated, execute it
             if result.get('SQL') and result['SQL'].strip():
                 sql_query = result['SQL'].strip()
-                if 'LIMIT' not in sql_query.upper():
-                    sql_query = sql_query.replace(';', '') + ' LIMIT 100'
+                
+                cache_key = self._result_cache_key(sql_query)
+                cached = self.result_cache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    self.result_cache_hits += 1
+                    logger.info(f"Generated SQL served from cache: {sql_query}")
+                    return {
+                        **cached,
+                        "text_response": result.get('TEXT', ''),
+                        "graphs": result.get('GRAPHS', {}),
+                        "context": result.get('CONTEXT', []),
+                        "cached": True
+                    }
+                self.result_cache_misses += 1
                 
                 logger.info(f"Executing generated SQL: {sql_query}")
-                # Try direct database query first
-                if self.db_pool:
+                # Try the guarded direct database query first
+                if self.guard:
                     try:
-                        async with self.db_pool.acquire() as conn:
-                            rows = await conn.fetch(sql_query)
-                            data = [dict(row) for row in rows]
-                            return {
-                                "success": True,
-                                "data": data,
-                                "sql_query": sql_query,
-                                "text_response": result.get('TEXT', ''),
-                                "graphs": result.get('GRAPHS', {}),
-                                "context": result.get('CONTEXT', []),
-                                "source": "sql_generation",
-                                "data_count": len(data)
-                            }
+                        data, execution = await self.guard.fetch(sql_query)
+                        response = {
+                            "success": True,
+                            "data": data,
+                            "sql_query": sql_query,
+                            "text_response": result.get('TEXT', ''),
+                            "graphs": result.get('GRAPHS', {}),
+                            "context": result.get('CONTEXT', []),
+                            "source": "sql_generation",
+                            "data_count": len(data),
+                            "execution": execution
+                        }
+                        if cache_key:
+                            self.result_cache.set(cache_key, dict(response))
+                        return response
+                    except SQLRejected as e:
+                        logger.warning(f"Generated SQL rejected: {e.reason}")
+                        return {
+                            "success": False,
+                            "rejected": True,
+                            "error": e.reason,
+                            "estimated_cost": e.estimated_cost,
+                            "sql_query": sql_query,
+                            "source": "sql_generation"
+                        }
+                    except BudgetExhausted:
+                        raise
                     except Exception as e:
                         logger.error(f"Direct SQL query failed: {e}")
 
-                # Fallback to Supabase RPC if direct query failed or no pool
+                # Fallback to Supabase RPC if direct query failed or no pool (row cap applied by wrapping)
                 try:
-                    sql_response = self.supabase.rpc("execute_sql_query", {"query": sql_query}).execute()
+                    capped_query = f"SELECT * FROM ({GuardedSQLExecutor.validate(sql_query)}) AS q LIMIT {SQL_MAX_ROWS}"
+                    if self.rpc_client:
+                        rpc_data = await self.rpc_client.rpc("execute_sql_query", {"query": capped_query})
+                    else:
+                        # Synchronous supabase client: keep it off the event loop
+                        sql_response = await asyncio.to_thread(
+                            lambda: self.supabase.rpc("execute_sql_query", {"query": capped_query}).execute()
+                        )
+                        rpc_data = sql_response.data
                     
-                    if sql_response.data and len(sql_response.data) > 0:
-                        return {
+                    if rpc_data and len(rpc_data) > 0:
+                        response = {
                             "success": True,
-                            "data": sql_response.data,
+                            "data": rpc_data,
                             "sql_query": sql_query,
                             "text_response": result.get('TEXT', ''),
                             "graphs": result.get('GRAPHS', {}),
                             "context": result.get('CONTEXT', []),
                             "source": "sql_generation",
-                            "data_count": len(sql_response.data)
+                            "data_count": len(rpc_data)
                         }
+                        if cache_key:
+                            self.result_cache.set(cache_key, dict(response))
+                        return response
+                except SQLRejected as e:
+                    logger.warning(f"Generated SQL rejected: {e.reason}")
+                    return {
+                        "success": False,
+                        "rejected": True,
+                        "error": e.reason,
+                        "sql_query": sql_query,
+                        "source": "sql_generation"
+                    }
+                except BudgetExhausted:
+                    raise
                 except Exception as e:
                     logger.error(f"Supabase RPC query failed: {e}")
                     return {
@@ -231,37 +1203,52 @@ class SQLGenerationSystem:
                     "context": result.get('CONTEXT', []),
                     "source": "text_response"
                 }
-                
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error in SQL generation: {e}")
-            return {
-                "success": False,
-                "error": "Failed to parse AI response",
-                "text_response": "I encountered an error processing your query. Please try again.",
-                "source": "sql_generation"
-            }
+        except BudgetExhausted:
+            raise
         except Exception as e:
-            logger.error(f"SQL generation failed: {e}")
+            logger.error(f"SQL execution failed: {e}")
             return {
                 "success": False,
-                "error": f"SQL generation failed: {str(e)}",
+                "error": f"SQL execution failed: {str(e)}",
                 "source": "sql_generation"
             }
 
 # ==================== DATA FORMATTER ====================
 class DataFormatter:
     @staticmethod
-    def format_depth_profile_data(data: List[Dict], parameter: str = "temperature", float_id: Optional[int] = None) -> Dict[str, Any]:
-        """Format depth profile data for frontend plotting"""
+    def format_depth_profile_data(data: List[Dict], parameter: str = "temperature", float_id: Optional[int] = None,
+                                  max_points: Optional[int] = None) -> Dict[str, Any]:
+        """Format depth profile data for frontend plotting
+        
+        More than max_points (default PLOT_MAX_POINTS) levels are averaged into pressure bins.
+        """
         if not data:
             return {"error": "No data available"}
             
-        # Use pressure for depth (as per your CSV structure)
-        depths = [item.get('pressure') for item in data if item.get('pressure') is not None]
-        values = [item.get(parameter) for item in data if item.get(parameter) is not None]
+        # Use pressure for depth (as per your CSV structure); keep depth/value pairs aligned
+        pairs = [(item['pressure'], item[parameter]) for item in data
+                 if item.get('pressure') is not None and item.get(parameter) is not None]
         
-        if not depths or not values:
+        if not pairs:
             return {"error": f"No {parameter} data available"}
+        
+        return DataFormatter.format_depth_profile_arrays(
+            [p for p, _ in pairs], [v for _, v in pairs], parameter, float_id, max_points)
+    
+    @staticmethod
+    def format_depth_profile_arrays(depths, values, parameter: str = "temperature", float_id: Optional[int] = None,
+                                    max_points: Optional[int] = None) -> Dict[str, Any]:
+        """format_depth_profile_data for aligned, non-null depth / value sequences (lists or NumPy arrays)"""
+        max_points = PLOT_MAX_POINTS if max_points is None else max_points
+        downsampled = None
+        if max_points and max_points > 0 and len(depths) > max_points:
+            depths_arr, values_arr, counts = downsample.bin_profile(depths, values, max_points)
+            downsampled = {"method": "pressure_bin_mean", "original_points": len(depths),
+                           "bin_counts": counts.tolist()}
+            depths, values = depths_arr.round(2).tolist(), values_arr.round(4).tolist()
+        else:
+            depths = depths.tolist() if isinstance(depths, np.ndarray) else list(depths)
+            values = values.tolist() if isinstance(values, np.ndarray) else list(values)
             
         return {
             "type": "depth_profile",
@@ -277,6 +1264,7 @@ class DataFormatter:
                     "parameter": "°C" if parameter == "temperature" else "PSU" if parameter == "salinity" else "dbar"
                 },
                 "data_points": len(depths),
+                "downsampled": downsampled,
                 "parameter_name": parameter.capitalize()
             }
         }
@@ -319,38 +1307,50 @@ class DataFormatter:
         }
     
     @staticmethod
-    def format_timeseries_data(data: List[Dict], parameter: str = "temperature", float_id: Optional[int] = None) -> Dict[str, Any]:
-        """Format time series data for frontend plotting"""
+    def format_timeseries_data(data: List[Dict], parameter: str = "temperature", float_id: Optional[int] = None,
+                               max_points: Optional[int] = None) -> Dict[str, Any]:
+        """Format time series data for frontend plotting
+        
+        More than max_points (default PLOT_MAX_POINTS) points are reduced with LTTB.
+        """
         if not data:
             return {"error": "No time series data available"}
             
-        dates = []
-        values = []
-        for item in data:
-            if item.get('profile_date') and item.get(parameter) is not None:
-                try:
-                    dates.append(item['profile_date'].isoformat() if hasattr(item['profile_date'], 'isoformat') else str(item['profile_date']))
-                    values.append(item[parameter])
-                except:
-                    continue
+        points = [(item['profile_date'], item[parameter], item) for item in data
+                  if item.get('profile_date') and item.get(parameter) is not None]
         
-        if not dates or not values:
+        if not points:
             return {"error": f"No valid {parameter} time series data"}
+        
+        points.sort(key=lambda point: point[0])
+        max_points = PLOT_MAX_POINTS if max_points is None else max_points
+        downsampled = None
+        if max_points and max_points > 0 and len(points) > max_points:
+            epoch = [d.timestamp() if hasattr(d, 'timestamp') else datetime.fromisoformat(str(d)).timestamp() for d, _, _ in points]
+            keep = downsample.lttb(epoch, [v for _, v, _ in points], max_points)
+            downsampled = {"method": "lttb", "original_points": len(points)}
+            points = [points[i] for i in keep.tolist()]
+        
+        dates = [d.isoformat() if hasattr(d, 'isoformat') else str(d) for d, _, _ in points]
+        values = [v for _, v, _ in points]
+        series = {"dates": dates, "values": values}
+        # Bucketed series (get_timeseries) carry a min/max band per point
+        for band in ("min", "max"):
+            if f"{parameter}_{band}" in points[0][2]:
+                series[band] = [item.get(f"{parameter}_{band}") for _, _, item in points]
             
         return {
             "type": "timeseries",
             "float_id": float_id,
             "parameter": parameter,
-            "data": {
-                "dates": dates,
-                "values": values
-            },
+            "data": series,
             "metadata": {
                 "units": {
                     "parameter": "°C" if parameter == "temperature" else "PSU" if parameter == "salinity" else "dbar"
                 },
-                "date_range": [min(dates), max(dates)] if dates else [],
+                "date_range": [dates[0], dates[-1]],
                 "data_points": len(dates),
+                "downsampled": downsampled,
                 "parameter_name": parameter.capitalize()
             }
         }
@@ -501,20 +1501,890 @@ class ConversationMemory:
         history = self.sessions.get(session_id, {}).get('history', [])
         return history[-last_n:]
 
+# ==================== TOOL DEFINITIONS ====================
+# Tools the LLM may select, with the EXACT parameters each accepts (shared by Layer 1 and the unified planner)
+TOOL_DEFINITIONS = {
+    "greeting": {
+        "params": [],
+        "description": "User is greeting (hello, hi, hey, good morning)",
+        "examples": ["hello", "hi there", "good morning", "hey"],
+        "returns_data": False
+    },
+    "farewell": {
+        "params": [],
+        "description": "User is saying goodbye",
+        "examples": ["bye", "goodbye", "see you", "thanks bye"],
+        "returns_data": False
+    },
+    "capabilities": {
+        "params": [],
+        "description": "User asking what the system can do",
+        "examples": ["what can you do", "help", "capabilities", "features"],
+        "returns_data": False
+    },
+    "list_all_floats": {
+        "params": ["limit", "offset"],
+        "description": "List/show all available floats",
+        "examples": ["show all floats", "list floats", "which floats do you have"],
+        "returns_data": True
+    },
+    "count_floats": {
+        "params": ["region"],
+        "description": "Count total number of floats, optionally in a region",
+        "examples": ["how many floats", "count floats", "total floats"],
+        "returns_data": True
+    },
+    "get_float_profile": {
+        "params": ["float_id", "cycle_number"],
+        "description": "Get complete metadata and profile for ONE specific float",
+        "examples": ["info about float 2902296", "details of float 2902296"],
+        "returns_data": True
+    },
+    "get_depth_profile": {
+        "params": ["float_id", "parameter", "cycle_number", "mode", "near_date"],
+        "description": "Get depth profile of ONE parameter for ONE float (mode: latest [default], cycle, nearest_date with near_date YYYY-MM-DD, all = every cycle as its own series)",
+        "examples": ["temperature of float 2902296", "salinity profile of float 2902296"],
+        "returns_data": True,
+        "valid_parameters": ["temperature", "salinity", "pressure", "depth_m"]
+    },
+    "get_trajectory": {
+        "params": ["float_id"],
+        "description": "Get path/trajectory/route of ONE specific float",
+        "examples": ["path of float 2902296", "trajectory of float 2902296", "where did float 2902296 go"],
+        "returns_data": True
+    },
+    "get_multiple_trajectories": {
+        "params": ["float_ids", "max_points_per_float"],
+        "description": "Get trajectory paths for MULTIPLE floats (bulk operation)",
+        "examples": ["locations of all floats", "trajectories of floats 2902296 and 2902297", "map paths for each float"],
+        "returns_data": True,
+        "important": "Use when query asks for locations of MULTIPLE floats"
+    },
+    "get_timeseries": {
+        "params": ["float_id", "parameter", "start_date", "end_date", "bucket", "depth_min", "depth_max"],
+        "description": "Get time series data for ONE parameter of ONE float (per day/week/month bucket; dates YYYY-MM-DD, default = the float's whole record; depth_min/max in dbar)",
+        "examples": ["temperature over time for float 2902296"],
+        "returns_data": True,
+        "valid_parameters": ["temperature", "salinity", "pressure", "depth_m"]
+    },
+    "get_floats_in_region": {
+        "params": ["region"],
+        "description": "Get list of floats in a specific region (NO parameter data, just float IDs)",
+        "examples": ["floats in arabian sea", "show floats in indian ocean"],
+        "returns_data": True,
+        "valid_regions": ["arabian_sea", "indian_ocean", "bay_of_bengal", "equator", "south_atlantic", "north_pacific"],
+        "important": "This tool ONLY returns float IDs, NOT their parameter data"
+    },
+    "get_region_data": {
+        "params": ["region"],
+        "description": "Get metadata about floats in a region (NO parameter data)",
+        "examples": ["data about arabian sea region"],
+        "returns_data": True,
+        "important": "This tool ONLY returns metadata, NOT temperature/salinity data"
+    },
+    "search_floats_by_location": {
+        "params": ["latitude", "longitude", "radius", "k", "latest_only"],
+        "description": "Find floats near specific coordinates (k = the k nearest floats at any distance; latest_only = use each float's last known position)",
+        "examples": ["floats near 15.0, 60.0", "find floats at latitude 15 longitude 60",
+                     "5 nearest floats to 15, 60", "which floats are currently closest to 10N 70E"],
+        "returns_data": True
+    },
+    "compare_floats": {
+        "params": ["float_ids", "parameter"],
+        "description": "Compare ONE parameter across multiple floats (needs 2+ float IDs)",
+        "examples": ["compare temperature of floats 2902296 and 2902297", "temperature of all floats", "compare all floats salinity"],
+        "returns_data": True,
+        "valid_parameters": ["temperature", "salinity", "pressure", "depth_m"],
+        "important": "Use for BULK comparison of multiple floats"
+    },
+    "get_climatology": {
+        "params": ["parameter", "region", "depth", "depth_min", "depth_max", "month"],
+        "description": "Average / stddev / min / max of temperature or salinity in a region (optional), at a depth or depth band (dbar), per calendar month (month 1-12 to pick one) - precomputed, no SQL needed",
+        "examples": ["average salinity at 500m in the arabian sea by month", "mean temperature in bay of bengal in july",
+                     "maximum temperature at 100m in the indian ocean"],
+        "returns_data": True,
+        "valid_parameters": ["temperature", "salinity"],
+        "valid_regions": ["arabian_sea", "indian_ocean", "bay_of_bengal", "equator", "south_atlantic", "north_pacific"],
+        "important": "Prefer this over SQL for averages / min / max of temperature or salinity by region, depth or month"
+    }
+}
+
+
+# ==================== SPECULATIVE PREFETCH ====================
+class PrefetchStats:
+    """Server-wide counters for speculative prefetching"""
+    def __init__(self):
+        self.started = 0
+        self.hits = 0
+        self.wasted = 0
+        self.skipped = 0
+        self.in_flight = 0
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "wasted": self.wasted,
+            "skipped": self.skipped,
+            "in_flight": self.in_flight,
+            "hit_rate": round(self.hits / self.started, 3) if self.started else None
+        }
+
+class SpeculativePrefetcher:
+    """
+    Per-request speculative tool executions.
+    
+    While the LLM routes the query, cheaply extracted entities (float IDs, parameter, region)
+    start the tool calls the router will most likely choose. execute_tool claims a matching
+    task instead of querying again; unclaimed tasks are cancelled when the request ends.
+    """
+    PARAMETERS = ("temperature", "salinity", "pressure", "depth_m")
+    
+    def __init__(self, server, stats: PrefetchStats, max_per_request: int = 3, max_in_flight: int = 8):
+        self.server = server
+        self.stats = stats
+        self.max_per_request = max_per_request
+        self.max_in_flight = max_in_flight
+        self.tasks: Dict[str, asyncio.Task] = {}
+    
+    def predict(self, query: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Likely (tool, parameters) calls for the query, most likely first"""
+        lowered = query.lower()
+        float_ids = list(dict.fromkeys(int(f) for f in re.findall(r'\b\d{7}\b', query)))
+        parameter = next((p for p in self.PARAMETERS if p in lowered), None)
+        region = next((r for r in REGIONS if r in lowered.replace(' ', '_')), None)
+        wants_path = re.search(r'\b(path|trajector\w*|route|track|where|location\w*|map)\b', lowered) is not None
+        
+        candidates = []
+        if len(float_ids) >= 2:
+            if parameter:
+                candidates.append(("compare_floats", {"float_ids": float_ids, "parameter": parameter}))
+            if wants_path or not parameter:
+                candidates.append(("get_multiple_trajectories", {"float_ids": float_ids}))
+        elif len(float_ids) == 1:
+            float_id = float_ids[0]
+            if parameter and re.search(r'\b(over time|trend|time series|timeseries)\b', lowered):
+                candidates.append(("get_timeseries", {"float_id": float_id, "parameter": parameter}))
+            elif parameter:
+                candidates.append(("get_depth_profile", {"float_id": float_id, "parameter": parameter}))
+            if wants_path or not parameter:
+                candidates.append(("get_trajectory", {"float_id": float_id}))
+        if region:
+            candidates.append(("get_floats_in_region", {"region": region}))
+        return candidates[:self.max_per_request]
+    
+    def start_for_query(self, query: str):
+        for tool_name, parameters in self.predict(query):
+            if self.stats.in_flight >= self.max_in_flight:
+                self.stats.skipped += 1
+                continue
+            key = self.server.tool_cache_key(tool_name, parameters)
+            if key in self.tasks:
+                continue
+            task = asyncio.create_task(getattr(self.server, tool_name)(**parameters))
+            # Counted from creation so the cap also covers tasks that have not started running yet
+            self.stats.in_flight += 1
+            task.add_done_callback(self._finished)
+            self.tasks[key] = task
+            self.stats.started += 1
+            logger.info(f"Speculatively prefetching {tool_name} with {parameters}")
+    
+    def _finished(self, task: asyncio.Task):
+        self.stats.in_flight -= 1
+        if not task.cancelled():
+            task.exception()  # retrieved here so an unclaimed failure is not logged as unhandled
+    
+    @staticmethod
+    def _succeeded(task: asyncio.Task) -> bool:
+        if task.cancelled() or task.exception() is not None:
+            return False
+        result = task.result()
+        return not (isinstance(result, dict) and result.get("error"))
+    
+    def _count_hit(self, task: asyncio.Task):
+        if self._succeeded(task):
+            self.stats.hits += 1
+        else:
+            self.stats.wasted += 1
+    
+    def claim(self, key: str) -> Optional[asyncio.Task]:
+        """
+        Hand over a matching prefetch task (running or done), if one was started. A task that
+        already failed is not handed over, so the caller runs the tool itself. Hits are counted
+        once a claimed task has completed successfully.
+        """
+        task = self.tasks.pop(key, None)
+        if task is None or task.cancelled():
+            return None
+        if task.done() and not self._succeeded(task):
+            self.stats.wasted += 1
+            return None
+        task.add_done_callback(self._count_hit)
+        return task
+    
+    def cancel_unused(self):
+        for task in self.tasks.values():
+            self.stats.wasted += 1
+            if not task.done():
+                task.cancel()
+        self.tasks.clear()
+
+_current_prefetcher: ContextVar[Optional[SpeculativePrefetcher]] = ContextVar("speculative_prefetcher", default=None)
+
+def current_prefetcher() -> Optional[SpeculativePrefetcher]:
+    return _current_prefetcher.get()
+
+# ==================== SINGLEFLIGHT ====================
+class SingleFlight:
+    """
+    In-flight deduplication: concurrent callers with the same key share one execution.
+    
+    The first caller (leader) starts the work as a task; callers arriving while it runs
+    await the same task. The task runs outside any caller's QueryBudget and is shielded, so
+    each caller waits under its own deadline and one timing out or disconnecting does not
+    cancel or time out the work for the others.
+    """
+    def __init__(self, name: str, max_tracked_keys: int = 200):
+        self.name = name
+        self.max_tracked_keys = max_tracked_keys
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.key_stats: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Run fn once per key among concurrent callers; returns (result, shared).
+        Waits at most timeout seconds (default: the caller's remaining QueryBudget).
+        """
+        budget = current_budget()
+        if timeout is None and budget is not None:
+            budget.check()
+            timeout = budget.remaining()
+        task = self.in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.executions += 1
+            # Not the leader's budget or prefetcher: the work belongs to every caller
+            context = copy_context()
+            context.run(_current_budget.set, None)
+            context.run(_current_prefetcher.set, None)
+            task = asyncio.create_task(fn(), context=context)
+            self.in_flight[key] = task
+            task.add_done_callback(partial(self._finished, key))
+        self._track(key, shared)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise BudgetExhausted(f"Deadline exceeded while waiting on a shared {self.name} execution")
+        if shared and isinstance(result, dict):
+            result = dict(result)
+        return result, shared
+    
+    def _finished(self, key: str, task: asyncio.Task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an abandoned failure is not reported as unhandled
+    
+    def _track(self, key: str, shared: bool):
+        stats = self.key_stats.pop(key, None) or {"executions": 0, "coalesced": 0}
+        stats["coalesced" if shared else "executions"] += 1
+        self.key_stats[key] = stats
+        while len(self.key_stats) > self.max_tracked_keys:
+            self.key_stats.popitem(last=False)
+    
+    def get_stats(self, top_n: int = 10) -> Dict[str, Any]:
+        total = self.executions + self.coalesced
+        top = sorted(self.key_stats.items(), key=lambda kv: kv[1]["coalesced"], reverse=True)[:top_n]
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.in_flight),
+            "coalesce_rate": round(self.coalesced / total, 3) if total else None,
+            "top_keys": [{"key": k, **v} for k, v in top if v["coalesced"]]
+        }
+
+# ==================== TOOL RESULT CACHE ====================
+class LRUCacheBackend:
+    """In-process LRU with per-entry expiry"""
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+    
+    def set(self, key: str, value: Any):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def clear(self):
+        self.entries.clear()
+
+class RedisCacheBackend:
+    """Shared cache backend so workers reuse each other's results (values stored as JSON)"""
+    PREFIX = "argo:tool:"
+    
+    def __init__(self, url: str, ttl: float):
+        self.client = redis_asyncio.from_url(url)
+        self.ttl = ttl
+    
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.client.get(self.PREFIX + key)
+        return json.loads(raw) if raw is not None else None
+    
+    async def set(self, key: str, value: Any):
+        await self.client.set(self.PREFIX + key, json.dumps(value, default=str), ex=max(1, int(self.ttl)))
+    
+    async def clear(self):
+        async for key in self.client.scan_iter(match=self.PREFIX + "*"):
+            await self.client.delete(key)
+
+class ToolResultCache:
+    """
+    Result cache for read-only tools, keyed by tool + canonical parameters + data version.
+    
+    Float-scoped calls (float_id / float_ids) are tagged with those floats' versions, everything
+    else with the global version, so an ingest makes exactly the affected entries unreachable.
+    Error results are never cached.
+    """
+    CACHEABLE_TOOLS = {
+        "query_measurements", "get_float_profile", "get_float_trajectory", "get_multiple_trajectories",
+        "get_floats_in_region", "compare_floats", "get_temporal_analysis", "get_depth_profile",
+        "get_trajectory", "get_timeseries", "get_region_data", "list_all_floats", "count_floats",
+        "search_floats_by_location", "get_climatology"
+    }
+    
+    def __init__(self, max_entries: int = TOOL_CACHE_SIZE, ttl: float = TOOL_CACHE_TTL,
+                 redis_url: Optional[str] = REDIS_URL):
+        self.enabled = max_entries > 0
+        self.local = LRUCacheBackend(max_entries, ttl)
+        self.shared = None
+        if redis_url and redis_asyncio is not None:
+            self.shared = RedisCacheBackend(redis_url, ttl)
+        elif redis_url:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using in-process cache only")
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+    
+    def key_for(self, tool_name: str, call_key: str, parameters: Dict[str, Any]) -> Optional[str]:
+        """Versioned cache key, or None when the tool is not cacheable"""
+        if not self.enabled or tool_name not in self.CACHEABLE_TOOLS:
+            return None
+        # Without the shared versions an ingest elsewhere would go unnoticed
+        if not data_versions.versions.synced:
+            return None
+        if parameters.get("float_id") is not None:
+            tag = data_versions.versions.tag([parameters["float_id"]])
+        elif parameters.get("float_ids"):
+            tag = data_versions.versions.tag(parameters["float_ids"])
+        else:
+            tag = data_versions.versions.tag()
+        return json.dumps([call_key, tag], default=str)
+    
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return dict(value) if isinstance(value, dict) else value
+        if self.shared:
+            try:
+                value = await self.shared.get(key)
+            except Exception as e:
+                logger.warning(f"Shared cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.shared_hits += 1
+                self.local.set(key, value)
+                return value
+        self.misses += 1
+        return None
+    
+    async def set(self, key: str, value: Any):
+        if isinstance(value, dict) and "error" in value:
+            return
+        self.local.set(key, dict(value) if isinstance(value, dict) else value)
+        if self.shared:
+            try:
+                await self.shared.set(key, value)
+            except Exception as e:
+                logger.warning(f"Shared cache write failed: {e}")
+    
+    async def clear(self):
+        self.local.clear()
+        if self.shared:
+            await self.shared.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "shared_backend": "redis" if self.shared else None,
+            "entries": len(self.local.entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 3) if lookups else None,
+            "data_versions": data_versions.versions.snapshot()
+        }
+
+# ==================== HOT FLOAT CACHE ====================
+class HotFloatCache:
+    """
+    LRU of float_columns.FloatColumns, bounded by the bytes of the arrays it holds.
+    
+    Requests never wait for a load: lookup() returns resident columns or None, and the caller
+    reads SQL on a miss. A float missed WARM_AFTER_MISSES times within the TTL is loaded in a
+    background task, outside any request budget (one cursor over all of its levels and profiles,
+    arrays built off the event loop). Floats are dropped when ingestion bumps their data version,
+    and a load that races an ingest is not kept. Floats above HOT_FLOAT_MAX_LEVELS are never loaded.
+    """
+    WARM_AFTER_MISSES = 2
+    MAX_TRACKED_MISSES = 1024
+    
+    def __init__(self, max_bytes: float = HOT_FLOAT_CACHE_MB * 1024 * 1024,
+                 max_levels: int = HOT_FLOAT_MAX_LEVELS, ttl: float = HOT_FLOAT_CACHE_TTL):
+        self.max_bytes = int(max_bytes)
+        self.max_levels = max_levels
+        self.ttl = ttl
+        self.db_pool = None
+        self.storage = "rows"
+        self.entries: "OrderedDict[int, Tuple[float_columns.FloatColumns, float]]" = OrderedDict()
+        self.loading: Dict[int, asyncio.Task] = {}
+        # float_id -> (misses, first miss time) for floats not resident yet
+        self.recent_misses: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+        self.too_large: set = set()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.loads = 0
+        self.load_failures = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.db_pool is not None and data_versions.versions.synced
+    
+    def start(self, db_pool, storage: str = "rows"):
+        self.db_pool = db_pool
+        self.storage = storage
+        data_versions.subscribe(self.invalidate)
+    
+    def stop(self):
+        for task in list(self.loading.values()):
+            task.cancel()
+    
+    def invalidate(self, float_id: Optional[str] = None):
+        """data_versions listener: drop one float (or everything)"""
+        if float_id is None:
+            self.entries.clear()
+            self.too_large.clear()
+            self.bytes = 0
+        else:
+            fid = int(float_id)
+            self.too_large.discard(fid)
+            entry = self.entries.pop(fid, None)
+            if entry:
+                self.bytes -= entry[0].nbytes
+        self.invalidations += 1
+    
+    def _lookup(self, float_id: int) -> Optional[float_columns.FloatColumns]:
+        entry = self.entries.get(float_id)
+        if entry is None:
+            return None
+        columns, loaded_at = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            self.entries.pop(float_id)
+            self.bytes -= columns.nbytes
+            return None
+        self.entries.move_to_end(float_id)
+        self.hits += 1
+        return columns
+    
+    def peek(self, float_id: int) -> Optional[float_columns.FloatColumns]:
+        """Resident columns only (never loads); for bulk tools that must not flood the cache"""
+        return self._lookup(int(float_id)) if self.enabled else None
+    
+    def lookup(self, float_id: int) -> Optional[float_columns.FloatColumns]:
+        """Resident columns for a single-float request; a repeated miss schedules a background load"""
+        if not self.enabled:
+            return None
+        float_id = int(float_id)
+        columns = self._lookup(float_id)
+        if columns is not None or float_id in self.too_large:
+            return columns
+        self.misses += 1
+        now = time.monotonic()
+        count, first = self.recent_misses.pop(float_id, (0, now))
+        if now - first > self.ttl:
+            count, first = 0, now
+        count += 1
+        if count >= self.WARM_AFTER_MISSES:
+            self._warm(float_id)
+        else:
+            self.recent_misses[float_id] = (count, first)
+            while len(self.recent_misses) > self.MAX_TRACKED_MISSES:
+                self.recent_misses.popitem(last=False)
+        return None
+    
+    def _warm(self, float_id: int):
+        if float_id in self.loading:
+            return
+        # Not the request's budget: the load serves later requests and must not die with this one
+        context = copy_context()
+        context.run(_current_budget.set, None)
+        context.run(_current_prefetcher.set, None)
+        task = asyncio.create_task(self._load(float_id), context=context)
+        self.loading[float_id] = task
+        task.add_done_callback(partial(self._loaded, float_id))
+    
+    def _loaded(self, float_id: int, task: asyncio.Task):
+        self.loading.pop(float_id, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.load_failures += 1
+            logger.warning(f"Hot float cache load failed for {float_id}: {task.exception()}")
+        else:
+            self.loads += 1
+    
+    LOAD_CHUNK_ROWS = 50000
+    
+    async def _load(self, float_id: int) -> Optional[float_columns.FloatColumns]:
+        tag = data_versions.versions.tag([float_id])
+        async with self.db_pool.acquire() as conn:
+            # Level count first (stops counting past the cap), so oversized floats are never fetched
+            if self.storage == "arrays":
+                n_levels = await conn.fetchval(
+                    "SELECT COALESCE(SUM(cardinality(pressure)), 0) FROM profile_levels WHERE float_id = $1",
+                    float_id, timeout=db_timeout())
+            else:
+                n_levels = await conn.fetchval(
+                    "SELECT COUNT(*) FROM (SELECT 1 FROM measurements WHERE float_id = $1 LIMIT $2) t",
+                    float_id, self.max_levels + 1, timeout=db_timeout())
+            if n_levels > self.max_levels:
+                self.too_large.add(float_id)
+                return None
+            found = "p.float_id IS NOT NULL"
+            if self.storage == "arrays":
+                sql = f"""
+                    SELECT pl.cycle_number, pl.n_level, pl.pressure, pl.temperature, pl.salinity,
+                           p.profile_date, p.latitude, p.longitude, {found} AS profile_found
+                    FROM profile_levels pl
+                    LEFT JOIN profiles p ON p.float_id = pl.float_id AND p.cycle_number = pl.cycle_number
+                    WHERE pl.float_id = $1
+                    ORDER BY pl.cycle_number
+                """
+                build = float_columns.FloatColumns.from_profile_arrays
+            else:
+                sql = f"""
+                    SELECT m.cycle_number, m.n_level, m.pressure, m.depth_m, m.temperature, m.salinity,
+                           p.profile_date, p.latitude, p.longitude, {found} AS profile_found
+                    FROM measurements m
+                    LEFT JOIN profiles p ON p.float_id = m.float_id AND p.cycle_number = m.cycle_number
+                    WHERE m.float_id = $1
+                    ORDER BY m.cycle_number, m.n_level
+                """
+                build = float_columns.FloatColumns.from_level_rows
+            # Read in chunks so other requests get the event loop between them
+            rows = []
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(sql, float_id, timeout=db_timeout())
+                while True:
+                    chunk = await cursor.fetch(self.LOAD_CHUNK_ROWS, timeout=db_timeout())
+                    if not chunk:
+                        break
+                    rows.extend(chunk)
+        
+        columns = await asyncio.to_thread(build, float_id, rows)
+        
+        if len(columns) > self.max_levels or columns.nbytes > self.max_bytes:
+            self.too_large.add(float_id)
+            return columns
+        if data_versions.versions.tag([float_id]) != tag:
+            return columns  # ingested while loading: serve this call, keep nothing
+        previous = self.entries.pop(float_id, None)
+        if previous:
+            self.bytes -= previous[0].nbytes
+        self.entries[float_id] = (columns, time.monotonic())
+        self.bytes += columns.nbytes
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+        logger.info(f"Hot float cache loaded float {float_id}: {len(columns)} levels, {columns.nbytes / 1e6:.1f} MB")
+        return columns
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "floats": len(self.entries),
+            "megabytes": round(self.bytes / 1024 / 1024, 2),
+            "max_megabytes": round(self.max_bytes / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "loads": self.loads,
+            "loading": len(self.loading),
+            "load_failures": self.load_failures,
+            "too_large": len(self.too_large)
+        }
+
+# ==================== FLOAT POSITION INDEX ====================
+class FloatPositionIndex:
+    """
+    In-memory KD-trees (spatial.KDTree, unit-sphere coordinates) over every profile position
+    and every float's last known position.
+    
+    Built in the background at startup and refreshed per float when ingestion bumps the data
+    version. While it is not usable (first build or a refresh in progress) callers use SQL instead.
+    """
+    KM_PER_DEGREE = 111.195
+    
+    def __init__(self):
+        self.ready = False
+        self.db_pool = None
+        self.profile_ids = np.empty(0, dtype=np.int64)
+        self.profile_latlon = np.empty((0, 2))
+        self.last_ids = np.empty(0, dtype=np.int64)
+        self.last_latlon = np.empty((0, 2))
+        self.profile_tree = spatial.KDTree(np.empty((0, 3)))
+        self.last_tree = spatial.KDTree(np.empty((0, 3)))
+        self.pending: set = set()
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.built_at: Optional[str] = None
+        self.build_seconds: Optional[float] = None
+        self.queries = 0
+    
+    def start(self, db_pool) -> asyncio.Task:
+        """Subscribe to ingestion and build the index in the background"""
+        self.db_pool = db_pool
+        data_versions.subscribe(self.schedule_refresh)
+        self.pending.add(None)
+        self.refresh_task = asyncio.create_task(self._refresh_pending())
+        return self.refresh_task
+    
+    @property
+    def usable(self) -> bool:
+        """Built and not mid-refresh (results must not lag an ingest that already bumped the cache version)"""
+        return self.ready and (self.refresh_task is None or self.refresh_task.done())
+    
+    def schedule_refresh(self, float_id: Optional[str] = None):
+        """data_versions listener: reload one float (or everything) without blocking the caller"""
+        if self.db_pool is None:
+            return
+        self.pending.add(int(float_id) if float_id is not None else None)
+        if self.refresh_task is None or self.refresh_task.done():
+            try:
+                self.refresh_task = asyncio.get_running_loop().create_task(self._refresh_pending())
+            except RuntimeError:
+                pass  # no running loop (CLI); the next server start rebuilds
+    
+    async def _refresh_pending(self):
+        while self.pending:
+            pending, self.pending = self.pending, set()
+            try:
+                await self._reload(None if None in pending else sorted(pending))
+            except Exception as e:
+                logger.error(f"Float position index refresh failed: {e}")
+    
+    async def _reload(self, float_ids: Optional[List[int]]):
+        started = time.monotonic()
+        async with self.db_pool.acquire() as conn:
+            if float_ids is None:
+                profile_rows = await conn.fetch(
+                    "SELECT float_id, latitude, longitude FROM profiles WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+                last_rows = await conn.fetch(
+                    "SELECT float_id, last_latitude, last_longitude FROM float_summary WHERE last_latitude IS NOT NULL AND last_longitude IS NOT NULL")
+            else:
+                profile_rows = await conn.fetch(
+                    "SELECT float_id, latitude, longitude FROM profiles WHERE float_id = ANY($1::int[]) AND latitude IS NOT NULL AND longitude IS NOT NULL",
+                    float_ids)
+                last_rows = await conn.fetch(
+                    "SELECT float_id, last_latitude, last_longitude FROM float_summary WHERE float_id = ANY($1::int[]) AND last_latitude IS NOT NULL AND last_longitude IS NOT NULL",
+                    float_ids)
+        
+        def merge(ids: np.ndarray, latlon: np.ndarray, rows) -> Tuple[np.ndarray, np.ndarray]:
+            new_ids = np.array([r[0] for r in rows], dtype=np.int64)
+            new_latlon = np.array([(r[1], r[2]) for r in rows], dtype=np.float64).reshape(-1, 2)
+            if float_ids is None:
+                return new_ids, new_latlon
+            keep = ~np.isin(ids, float_ids)
+            return np.concatenate([ids[keep], new_ids]), np.concatenate([latlon[keep], new_latlon])
+        
+        profile_ids, profile_latlon = merge(self.profile_ids, self.profile_latlon, profile_rows)
+        last_ids, last_latlon = merge(self.last_ids, self.last_latlon, last_rows)
+        
+        def build():
+            return (spatial.KDTree(spatial.to_unit_vectors(profile_latlon[:, 0], profile_latlon[:, 1])),
+                    spatial.KDTree(spatial.to_unit_vectors(last_latlon[:, 0], last_latlon[:, 1])))
+        
+        profile_tree, last_tree = await asyncio.to_thread(build)
+        # Swap everything at once so queries never see a half-updated index
+        self.profile_ids, self.profile_latlon, self.profile_tree = profile_ids, profile_latlon, profile_tree
+        self.last_ids, self.last_latlon, self.last_tree = last_ids, last_latlon, last_tree
+        self.ready = True
+        self.built_at = datetime.now().isoformat()
+        self.build_seconds = round(time.monotonic() - started, 3)
+        logger.info(f"Float position index {'built' if float_ids is None else f'refreshed for {float_ids}'}: "
+                    f"{len(profile_ids)} profile positions, {len(last_ids)} floats in {self.build_seconds}s")
+    
+    def _nearest_per_float(self, ids: np.ndarray, chords: np.ndarray) -> List[Tuple[int, float]]:
+        """(float_id, km) for each distinct float at its closest point, nearest first"""
+        if not len(ids):
+            return []
+        order = np.lexsort((chords, ids))
+        ids, chords = ids[order], chords[order]
+        first = np.concatenate(([True], ids[1:] != ids[:-1]))
+        ids, km = ids[first], spatial.km_for_chord(chords[first])
+        by_distance = np.argsort(km, kind="stable")
+        return [(int(ids[i]), float(km[i])) for i in by_distance]
+    
+    def within(self, latitude: float, longitude: float, radius_km: float,
+               use_last_position: bool = False) -> List[Tuple[int, float]]:
+        """Floats with a profile (or last position) within radius_km, nearest first"""
+        self.queries += 1
+        tree, ids = (self.last_tree, self.last_ids) if use_last_position else (self.profile_tree, self.profile_ids)
+        q = spatial.to_unit_vectors([latitude], [longitude])[0]
+        idx, chords = tree.query_radius(q, spatial.chord_for_km(radius_km))
+        return self._nearest_per_float(ids[idx], chords)
+    
+    def nearest(self, latitude: float, longitude: float, k: int = 10,
+                use_last_position: bool = False) -> List[Tuple[int, float]]:
+        """The k nearest distinct floats, nearest first"""
+        self.queries += 1
+        tree, ids = (self.last_tree, self.last_ids) if use_last_position else (self.profile_tree, self.profile_ids)
+        q = spatial.to_unit_vectors([latitude], [longitude])[0]
+        points = k
+        while True:
+            idx, chords = tree.query_knn(q, points)
+            found = self._nearest_per_float(ids[idx], chords)
+            if len(found) >= k or points >= len(tree):
+                return found[:k]
+            points *= 4
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "profile_positions": int(len(self.profile_ids)),
+            "floats_with_position": int(len(self.last_ids)),
+            "built_at": self.built_at,
+            "build_seconds": self.build_seconds,
+            "queries": self.queries
+        }
+
+# ==================== KEYSET PAGINATION ====================
+class InvalidPageToken(ValueError):
+    """Page token is malformed or belongs to a different query"""
+
+
+# Sort key layout per query kind ("timestamp" = ISO datetime or null)
+PAGE_KEY_TYPES = {
+    "measurements": ("int", "int", "int"),
+    "float_profile": ("int", "int"),
+    "floats": ("timestamp", "int"),
+}
+
+
+def _page_key_value(kind: str, value: Any) -> Any:
+    if kind == "int":
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(value)
+        return value
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _page_scope(kind: str, filters: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps([kind, filters], sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def encode_page_token(kind: str, filters: Dict[str, Any], key: List[Any]) -> str:
+    """
+    Opaque continuation token: the sort key of the last row returned, bound to the query
+    kind and its filters so it cannot be replayed against a different query.
+    """
+    payload = json.dumps({"s": _page_scope(kind, filters), "k": key}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_page_token(token: str, kind: str, filters: Dict[str, Any]) -> List[Any]:
+    """Sort key from a token, checked against PAGE_KEY_TYPES[kind] (timestamps come back as datetime)"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        key = payload["k"]
+    except Exception:
+        raise InvalidPageToken("Invalid page token")
+    if payload.get("s") != _page_scope(kind, filters) or not isinstance(key, list):
+        raise InvalidPageToken("Page token does not match this query")
+    types = PAGE_KEY_TYPES[kind]
+    if len(key) != len(types):
+        raise InvalidPageToken("Invalid page token")
+    try:
+        return [_page_key_value(t, v) for t, v in zip(types, key)]
+    except (TypeError, ValueError):
+        raise InvalidPageToken("Invalid page token")
+
+
+def clamp_page_size(limit: Optional[int], default: int) -> int:
+    return max(1, min(int(limit or default), PAGE_SIZE_MAX))
+
+
+async def fetch_page(conn, sql: str, params: List[Any], page_size: int) -> Tuple[List[Any], bool]:
+    """
+    Read one page through a server-side cursor (page_size + 1 rows, so has_more is exact
+    without a COUNT). The keyset predicate in `sql` makes every page cost the same.
+    """
+    async with conn.transaction(readonly=True):
+        cursor = await conn.cursor(sql, *params, timeout=db_timeout())
+        rows = await cursor.fetch(page_size + 1, timeout=db_timeout())
+    return rows[:page_size], len(rows) > page_size
+
 # ==================== COMPREHENSIVE AI-FIRST MCP SERVER ====================
 class OptimizedArgoMCPServer:
     def __init__(self):
         self.db_pool = None
         self.collection = None
         self.gemini_model = None
+        self.llm: Optional[LLMGateway] = None
         self.supabase = None
         self.sql_generator = None
         self.data_formatter = DataFormatter()
         self.memory = ConversationMemory()
+        self.planner_mode = PLANNER_MODE
+        self.speculative_prefetch = SPECULATIVE_PREFETCH
+        self.prefetch_stats = PrefetchStats()
+        self.singleflight = SINGLEFLIGHT
+        self.query_flight = SingleFlight("query")
+        self.tool_flight = SingleFlight("tool")
+        self.tool_cache = ToolResultCache()
+        self.position_index = FloatPositionIndex()
+        self.hot_floats = HotFloatCache()
+        self.export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+        self.measurement_storage = "rows"  # detected from the schema at startup ("rows" / "arrays")
         
+        # Enforced per request through QueryBudget: Layer 1 + Layer 2 plan + one resolution + synthesis
         self.execution_limits = {
             "max_tools_per_query": 6,
-            "max_ai_calls_per_query": 2,
+            "max_ai_calls_per_query": 4,
             "query_timeout": 30
         }
     
@@ -522,100 +2392,7 @@ class OptimizedArgoMCPServer:
     async def layer1_ai_detection(self, query: str, context: dict) -> Dict[str, Any]:
         """LAYER 1: AI understands query and selects appropriate tool with STRICT validation"""
         try:
-            tool_definitions = {
-                "greeting": {
-                    "params": [],
-                    "description": "User is greeting (hello, hi, hey, good morning)",
-                    "examples": ["hello", "hi there", "good morning", "hey"],
-                    "returns_data": False
-                },
-                "farewell": {
-                    "params": [],
-                    "description": "User is saying goodbye",
-                    "examples": ["bye", "goodbye", "see you", "thanks bye"],
-                    "returns_data": False
-                },
-                "capabilities": {
-                    "params": [],
-                    "description": "User asking what the system can do",
-                    "examples": ["what can you do", "help", "capabilities", "features"],
-                    "returns_data": False
-                },
-                "list_all_floats": {
-                    "params": ["limit", "offset"],
-                    "description": "List/show all available floats",
-                    "examples": ["show all floats", "list floats", "which floats do you have"],
-                    "returns_data": True
-                },
-                "count_floats": {
-                    "params": ["region"],
-                    "description": "Count total number of floats, optionally in a region",
-                    "examples": ["how many floats", "count floats", "total floats"],
-                    "returns_data": True
-                },
-                "get_float_profile": {
-                    "params": ["float_id", "cycle_number"],
-                    "description": "Get complete metadata and profile for ONE specific float",
-                    "examples": ["info about float 2902296", "details of float 2902296"],
-                    "returns_data": True
-                },
-                "get_depth_profile": {
-                    "params": ["float_id", "parameter", "cycle_number"],
-                    "description": "Get depth profile of ONE parameter for ONE float",
-                    "examples": ["temperature of float 2902296", "salinity profile of float 2902296"],
-                    "returns_data": True,
-                    "valid_parameters": ["temperature", "salinity", "pressure", "depth_m"]
-                },
-                "get_trajectory": {
-                    "params": ["float_id"],
-                    "description": "Get path/trajectory/route of ONE specific float",
-                    "examples": ["path of float 2902296", "trajectory of float 2902296", "where did float 2902296 go"],
-                    "returns_data": True
-                },
-                "get_multiple_trajectories": {
-                    "params": ["float_ids"],
-                    "description": "Get trajectory paths for MULTIPLE floats (bulk operation)",
-                    "examples": ["locations of all floats", "trajectories of floats 2902296 and 2902297", "map paths for each float"],
-                    "returns_data": True,
-                    "important": "Use when query asks for locations of MULTIPLE floats"
-                },
-                "get_timeseries": {
-                    "params": ["float_id", "parameter"],
-                    "description": "Get time series data for ONE parameter of ONE float",
-                    "examples": ["temperature over time for float 2902296"],
-                    "returns_data": True,
-                    "valid_parameters": ["temperature", "salinity", "pressure", "depth_m"]
-                },
-                "get_floats_in_region": {
-                    "params": ["region"],
-                    "description": "Get list of floats in a specific region (NO parameter data, just float IDs)",
-                    "examples": ["floats in arabian sea", "show floats in indian ocean"],
-                    "returns_data": True,
-                    "valid_regions": ["arabian_sea", "indian_ocean", "bay_of_bengal", "equator", "south_atlantic", "north_pacific"],
-                    "important": "This tool ONLY returns float IDs, NOT their parameter data"
-                },
-                "get_region_data": {
-                    "params": ["region"],
-                    "description": "Get metadata about floats in a region (NO parameter data)",
-                    "examples": ["data about arabian sea region"],
-                    "returns_data": True,
-                    "important": "This tool ONLY returns metadata, NOT temperature/salinity data"
-                },
-                "search_floats_by_location": {
-                    "params": ["latitude", "longitude", "radius"],
-                    "description": "Find floats near specific coordinates",
-                    "examples": ["floats near 15.0, 60.0", "find floats at latitude 15 longitude 60"],
-                    "returns_data": True
-                },
-                "compare_floats": {
-                    "params": ["float_ids", "parameter"],
-                    "description": "Compare ONE parameter across multiple floats (needs 2+ float IDs)",
-                    "examples": ["compare temperature of floats 2902296 and 2902297", "temperature of all floats", "compare all floats salinity"],
-                    "returns_data": True,
-                    "valid_parameters": ["temperature", "salinity", "pressure", "depth_m"],
-                    "important": "Use for BULK comparison of multiple floats"
-                }
-            }
+            tool_definitions = TOOL_DEFINITIONS
             
             prompt = f'''You are a STRICT tool selector for ARGO oceanographic data queries.
 
@@ -649,9 +2426,13 @@ class OptimizedArgoMCPServer:
     - Only these parameters exist: temperature, salinity, pressure, depth_m
     - Only these regions exist: arabian_sea, indian_ocean, bay_of_bengal, equator, south_atlantic, north_pacific
 
-    6. **Analytical/Aggregation Queries → Layer 3 (SQL)**
-    - If query asks for CALCULATIONS (average, sum, count, min, max, median) that tools don't provide → return null WITHOUT "requires_multiple_tools"
-    - Examples: "average temperature at 100m", "total floats in region", "maximum salinity"
+    6. **Climatology Queries → get_climatology (NOT SQL)**
+    - Average / mean / stddev / min / max of temperature or salinity over a region, a depth or a month → get_climatology
+    - Example: "average salinity at 500m in the arabian sea by month" → get_climatology(parameter="salinity", region="arabian_sea", depth=500)
+
+    7. **Analytical/Aggregation Queries → Layer 3 (SQL)**
+    - If query asks for CALCULATIONS (sum, count, median, per-float or per-year statistics) that tools (including get_climatology) don't provide → return null WITHOUT "requires_multiple_tools"
+    - Examples: "median salinity of each float", "number of profiles recorded per year", "which float has the most cycles"
     - These queries need SQL aggregation, NOT multiple tools
     - Return: {{"tool": null, "confidence": 0.0, "reasoning": "Query requires SQL aggregation/calculation not available in tools", "requires_sql": true}}
 
@@ -704,9 +2485,7 @@ class OptimizedArgoMCPServer:
     Now analyze the query and return ONLY valid JSON:
     '''
             
-            response = await asyncio.to_thread(
-                lambda: self.gemini_model.generate_content(prompt)
-            )
+            response = await self.llm.generate(prompt)
             
             response_text = response.text.strip()
             response_text = response_text.replace('```json', '').replace('```', '').strip()
@@ -727,6 +2506,8 @@ class OptimizedArgoMCPServer:
             logger.info(f"LAYER 1 AI Detection: {validated_result}")
             return validated_result
             
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.error(f"Layer 1 AI detection failed: {e}", exc_info=True)
             return {
@@ -763,7 +2544,7 @@ class OptimizedArgoMCPServer:
                 "validation_error": f"Invalid parameters provided"
             }
         
-        if tool in ['get_depth_profile', 'get_timeseries', 'compare_floats']:
+        if tool in ['get_depth_profile', 'get_timeseries', 'compare_floats', 'get_climatology']:
             param_value = provided_params.get('parameter')
             valid_params = tool_definitions[tool].get('valid_parameters', [])
             if param_value and param_value not in valid_params:
@@ -774,7 +2555,7 @@ class OptimizedArgoMCPServer:
                     "confidence": 0.0
                 }
         
-        if tool in ['get_floats_in_region', 'get_region_data']:
+        if tool in ['get_floats_in_region', 'get_region_data', 'get_climatology']:
             region_value = provided_params.get('region')
             valid_regions = tool_definitions[tool].get('valid_regions', [])
             if region_value and region_value not in valid_regions:
@@ -795,7 +2576,7 @@ class OptimizedArgoMCPServer:
         processed_params = provided_params.copy()
         
         # Numeric parameters that need integer casting
-        int_params = ['float_id', 'cycle_number', 'limit', 'offset', 'radius']
+        int_params = ['float_id', 'cycle_number', 'limit', 'offset', 'radius', 'month', 'max_points_per_float', 'k']
         for param in int_params:
             if param in processed_params:
                 try:
@@ -828,7 +2609,7 @@ class OptimizedArgoMCPServer:
         return result
 
     # ==================== LAYER 2: COMPREHENSIVE AI-POWERED ORCHESTRATION ====================
-    async def layer2_complex_orchestration(self, query: str, context: dict) -> Dict[str, Any]:
+    async def layer2_complex_orchestration(self, query: str, context: dict, emit: Optional[EventEmitter] = None) -> Dict[str, Any]:
         """LAYER 2: AI creates comprehensive plans for both single and multiple float queries"""
         try:
             prompt = f'''You are an AI orchestration planner for ARGO oceanographic data. Your task is to create COMPREHENSIVE multi-step plans.
@@ -842,8 +2623,9 @@ class OptimizedArgoMCPServer:
        - Input: region (string from: equator, arabian_sea, indian_ocean, bay_of_bengal, south_atlantic, north_pacific)
        - Output: {{"region": "arabian_sea", "floats": [2902296, 2902297, ...], "float_count": 15}}
 
-    2. get_depth_profile(float_id, parameter, cycle_number=null)
-       - Input: float_id (integer), parameter (temperature/salinity/pressure/depth_m), cycle_number (optional integer)
+    2. get_depth_profile(float_id, parameter, cycle_number=null, mode="latest", near_date=null)
+       - Input: float_id (integer), parameter (temperature/salinity/pressure/depth_m), cycle_number (optional integer),
+         mode (latest/cycle/nearest_date/all), near_date (YYYY-MM-DD, for nearest_date)
        - Output: Depth profile data for ONE float
 
     3. compare_floats(float_ids, parameter)
@@ -858,10 +2640,15 @@ class OptimizedArgoMCPServer:
        - Input: float_ids (array of integers)
        - Output: Trajectory paths for MULTIPLE floats (bulk operation)
 
-    6. get_timeseries(float_id, parameter)
-       - Input: float_id (integer), parameter (temperature/salinity/pressure/depth_m)
+    6. get_timeseries(float_id, parameter, start_date=null, end_date=null, bucket=null, depth_min=null, depth_max=null)
+       - Input: float_id (integer), parameter (temperature/salinity/pressure/depth_m), optional YYYY-MM-DD window,
+         bucket (day/week/month), depth band in dbar
        - Output: Time series data for ONE float
 
+    7. get_climatology(parameter, region=null, depth=null, depth_min=null, depth_max=null, month=null)
+       - Input: parameter (temperature/salinity), region (as above), depth or depth band in dbar, month (1-12)
+       - Output: Precomputed mean/stddev/min/max per calendar month over ALL floats (no float IDs needed)
+
     🔄 COMPREHENSIVE DATA FLOW RULES:
 
     1. **SINGLE FLOAT QUERIES** (mentions one specific float ID):
@@ -876,6 +2663,7 @@ class OptimizedArgoMCPServer:
     3. **REGIONAL QUERIES** (mentions regions):
        - First: get_floats_in_region(region) to get float IDs
        - Then: Choose appropriate single/bulk tools based on query intent
+       - Regional averages / min / max of temperature or salinity: get_climatology alone, no float lookup
 
     4. **COMPREHENSIVE COVERAGE**:
        - If query asks for "location AND temp" → plan for BOTH trajectory AND temperature data
@@ -904,9 +2692,7 @@ class OptimizedArgoMCPServer:
     Now create a COMPREHENSIVE plan for the current query. Return ONLY valid JSON:
     '''
             
-            response = await asyncio.to_thread(
-                lambda: self.gemini_model.generate_content(prompt)
-            )
+            response = await self.llm.generate(prompt)
             
             response_text = response.text.strip()
             response_text = response_text.replace('```json', '').replace('```', '').strip()
@@ -920,16 +2706,10 @@ class OptimizedArgoMCPServer:
             if "error" in plan_data:
                 return {"error": plan_data["error"]}
             
-            results = await self._execute_comprehensive_orchestration_plan(plan_data.get("plan", []))
-            
-            if not results or all("error" in str(result) for result in results.values()):
-                return {"error": "All orchestration steps failed"}
-            
-            final_response = await self._synthesize_orchestration_results(
-                query, results, plan_data.get("expected_output", "")
-            )
-            return final_response
+            return await self._run_orchestration_plan(query, plan_data, emit)
             
+        except BudgetExhausted:
+            raise
         except json.JSONDecodeError as e:
             logger.error(f"Layer 2 JSON parse error: {e}")
             return {"error": "Failed to create execution plan"}
@@ -937,12 +2717,33 @@ class OptimizedArgoMCPServer:
             logger.error(f"Layer 2 complex orchestration failed: {e}")
             return {"error": f"Complex orchestration failed: {str(e)}"}
         
-    async def _execute_comprehensive_orchestration_plan(self, plan: List[Dict]) -> Dict:
+    async def _run_orchestration_plan(self, query: str, plan_data: Dict, emit: Optional[EventEmitter] = None) -> Dict[str, Any]:
+        """Execute a Layer 2 plan and synthesize the results"""
+        await self._emit(emit, "plan", {
+            "steps": [step.get("tool") for step in plan_data.get("plan", [])],
+            "expected_output": plan_data.get("expected_output", "")
+        })
+        
+        results = await self._execute_comprehensive_orchestration_plan(plan_data.get("plan", []), emit)
+        
+        if not results or all("error" in str(result) for result in results.values()):
+            return {"error": "All orchestration steps failed"}
+        
+        return await self._synthesize_orchestration_results(
+            query, results, plan_data.get("expected_output", ""), emit
+        )
+    
+    async def _execute_comprehensive_orchestration_plan(self, plan: List[Dict], emit: Optional[EventEmitter] = None) -> Dict:
         """Execute comprehensive orchestration plan with smart parameter resolution"""
         results = {}
         previous_results = {}
         
+        budget = current_budget()
+        
         for step_index, step in enumerate(plan[:self.execution_limits["max_tools_per_query"]]):
+            if budget and budget.expired:
+                logger.warning(f"Query deadline reached - stopping orchestration after {step_index} steps")
+                break
             try:
                 tool_name = step['tool']
                 parameters = step.get('parameters', {})
@@ -958,9 +2759,10 @@ class OptimizedArgoMCPServer:
                 logger.info(f"Resolved parameters: {resolved_params}")
                 
                 if hasattr(self, tool_name):
-                    result = await getattr(self, tool_name)(**resolved_params)
+                    result = await self.execute_tool(tool_name, resolved_params)
                     results[tool_name] = result
                     previous_results[tool_name] = result
+                    await self._emit(emit, "tool_result", self._tool_result_event(tool_name, result))
                 else:
                     results[tool_name] = {"error": f"Tool {tool_name} not found"}
                     
@@ -982,6 +2784,14 @@ class OptimizedArgoMCPServer:
         previous_step_name = list(previous_results.keys())[-1]
         previous_result = previous_results[previous_step_name]
         
+        # Standard placeholders can be resolved without another LLM round trip
+        if all(not isinstance(v, str) or not v.startswith("EXTRACT:") or v in self.STANDARD_EXTRACTS
+               for v in parameters.values()):
+            local_params = self._fallback_resolve_parameters(step, previous_result)
+            if "error" not in local_params:
+                logger.info(f"Resolved parameters locally: {local_params}")
+                return local_params
+        
         prompt = f'''You are a comprehensive parameter resolver for ARGO data tools. Resolve parameters for step {step_index + 1}.
 
     CURRENT STEP:
@@ -1021,9 +2831,7 @@ class OptimizedArgoMCPServer:
     '''
         
         try:
-            response = await asyncio.to_thread(
-                lambda: self.gemini_model.generate_content(prompt)
-            )
+            response = await self.llm.generate(prompt)
             
             response_text = response.text.strip()
             response_text = response_text.replace('```json', '').replace('```', '').strip()
@@ -1035,11 +2843,42 @@ class OptimizedArgoMCPServer:
             
             return resolved_params
             
+        except BudgetExhausted as e:
+            logger.warning(f"Parameter resolution out of budget ({e}) - resolving without the LLM")
+            return self._fallback_resolve_parameters(step, previous_result)
         except Exception as e:
             logger.error(f"Comprehensive parameter resolution failed: {e}")
             return {"error": f"Parameter resolution failed: {str(e)}"}
     
-    async def _synthesize_orchestration_results(self, original_query: str, tool_results: Dict, expected_output: str) -> Dict:
+    STANDARD_EXTRACTS = ("EXTRACT:floats", "EXTRACT:floats:ALL", "EXTRACT:floats[0]")
+    
+    def _fallback_resolve_parameters(self, step: Dict, previous_result: Any) -> Dict:
+        """Resolve EXTRACT: placeholders from the previous step without an LLM call"""
+        float_ids = []
+        if isinstance(previous_result, dict):
+            for item in previous_result.get("floats", []) or []:
+                fid = item.get("platform_number") if isinstance(item, dict) else item
+                if fid is not None:
+                    float_ids.append(int(fid))
+            if not float_ids and previous_result.get("float_id") is not None:
+                float_ids.append(int(previous_result["float_id"]))
+        
+        resolved = {}
+        for key, value in step.get('parameters', {}).items():
+            if isinstance(value, str) and value.startswith("EXTRACT:"):
+                if key == "float_ids":
+                    resolved[key] = float_ids
+                elif key == "float_id" and float_ids:
+                    resolved[key] = float_ids[0]
+            else:
+                resolved[key] = value
+        
+        if any(isinstance(v, str) and v.startswith("EXTRACT:") for v in step.get('parameters', {}).values()) and not float_ids:
+            return {"error": "Parameter resolution failed: previous step returned no float IDs"}
+        return resolved
+    
+    async def _synthesize_orchestration_results(self, original_query: str, tool_results: Dict, expected_output: str,
+                                                emit: Optional[EventEmitter] = None) -> Dict:
         """Generate AI response from orchestration results with multi-format support"""
         prompt = f"""
     Original Query: "{original_query}"
@@ -1057,19 +2896,30 @@ class OptimizedArgoMCPServer:
     """
         
         try:
-            response = await asyncio.to_thread(
-                lambda: self.gemini_model.generate_content(prompt)
-            )
+            if emit:
+                synthesized_text = await self._stream_llm_text(prompt, emit)
+            else:
+                response = await self.llm.generate(prompt)
+                synthesized_text = response.text
             
             # Build multi-format response
             multi_format_response = self._build_multi_format_response(original_query, tool_results)
             
             return {
-                "ai_synthesized_response": response.text,
+                "ai_synthesized_response": synthesized_text,
                 "tool_results": tool_results,
                 "processing_source": "complex_orchestration",
                 **multi_format_response  # Add formats: text, map, graph
             }
+        except BudgetExhausted as e:
+            logger.warning(f"Skipping synthesis: {e}")
+            return {
+                "tool_results": tool_results,
+                "processing_source": "complex_orchestration",
+                "degraded": True,
+                "degradation_reason": str(e),
+                **self._build_multi_format_response(original_query, tool_results)
+            }
         except Exception as e:
             return {
                 "error": "AI synthesis failed", 
@@ -1217,6 +3067,23 @@ class OptimizedArgoMCPServer:
                     }
                 }
         
+        # Check for climatology (monthly bar chart)
+        elif "get_climatology" in tool_results:
+            climatology = tool_results["get_climatology"]
+            if "by_month" in climatology:
+                graph_data = {
+                    "type": "bar_chart",
+                    "data": {
+                        "labels": [str(m["month"]) for m in climatology["by_month"]],
+                        "datasets": [
+                            {"label": "Mean", "values": [m["mean"] for m in climatology["by_month"]]},
+                            {"label": "Min", "values": [m["min"] for m in climatology["by_month"]]},
+                            {"label": "Max", "values": [m["max"] for m in climatology["by_month"]]}
+                        ],
+                        "parameter": climatology.get("parameter", "value")
+                    }
+                }
+        
         # Check for time series (line chart)
         elif "get_timeseries" in tool_results:
             timeseries = tool_results["get_timeseries"]
@@ -1235,9 +3102,294 @@ class OptimizedArgoMCPServer:
         return graph_data
 
 
+    # ==================== UNIFIED PLANNER: ROUTING + PLANNING IN ONE CALL ====================
+    def _compact_tool_catalog(self) -> str:
+        """One line per tool: name(params): description"""
+        return "\n".join(
+            f"- {name}({', '.join(spec['params'])}): {spec['description']}"
+            for name, spec in TOOL_DEFINITIONS.items()
+        )
+    
+    async def unified_planner(self, query: str, context: dict) -> Dict[str, Any]:
+        """Single LLM call that returns either one tool, a multi-step plan, or SQL"""
+        prompt = f'''You are the query planner for an ARGO oceanographic data system. Decide in ONE answer how to serve the query.
+
+    TOOLS (use ONLY the listed parameters):
+    {self._compact_tool_catalog()}
+    Valid parameter values: temperature, salinity, pressure, depth_m
+    Valid regions: {", ".join(REGIONS.keys())}
+
+    TABLES (SQL mode only):
+    float_metadata(platform_number, float_serial_number, launch_date, launch_latitude, launch_longitude, pi_name, project_name, operating_institute, float_owner)
+    profiles(float_id, cycle_number, profile_date, latitude, longitude, direction, max_depth, n_levels)
+    measurements(float_id, cycle_number, n_level, pressure, depth_m, temperature, salinity)
+    climatology_cube(parameter, pressure_bin, month, cell_lat, cell_lon, value_count, value_sum, value_sum_sq, value_min, value_max)
+
+    Return ONLY JSON in exactly one of these shapes:
+    {{"mode": "tool", "tool": "<name>", "parameters": {{}}, "confidence": 0.95}}
+        → one tool answers the query (includes greeting / farewell / capabilities)
+    {{"mode": "plan", "plan": [{{"tool": "<name>", "parameters": {{}}, "purpose": "..."}}], "expected_output": "..."}}
+        → tools chained; later steps use "EXTRACT:floats:ALL" (every float ID from the previous step) or "EXTRACT:floats[0]"
+        → use bulk tools (compare_floats, get_multiple_trajectories) when the user wants several floats
+    {{"mode": "sql", "sql": "SELECT ... LIMIT 100", "text": ""}}
+        → calculations (average, min, max, per-group statistics) no tool provides; one read-only SELECT with LIMIT
+        → averages / min / max of temperature or salinity by region, depth or month: use get_climatology, not SQL
+    {{"mode": "none", "reasoning": "..."}}
+        → ambiguous or unrelated query
+
+    Query: "{query}"
+    Previous Context: {json.dumps(context, default=str)}
+    '''
+        
+        try:
+            response = await self.llm.generate(prompt)
+            response_text = response.text.strip().replace('```json', '').replace('```', '').strip()
+            
+            json_match = re.search(r'\{[\s\S]*\}', response_text)
+            if not json_match:
+                logger.error(f"Failed to parse unified planner response: {response_text}")
+                return {"mode": None, "reasoning": "Failed to parse planner response"}
+            
+            decision = json.loads(json_match.group())
+            logger.info(f"UNIFIED PLANNER: {decision}")
+            return decision
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            logger.error(f"Unified planner failed: {e}")
+            return {"mode": None, "reasoning": f"Unified planner failed: {str(e)}"}
+    
+    async def _process_query_unified(self, query: str, session_id: str, emit: Optional[EventEmitter] = None) -> Optional[Dict[str, Any]]:
+        """
+        Serve the query from one planner call. "none" and uncertain tool picks are answered here
+        (the latter via Layer 2 only); None means the planner failed and the layer cascade takes over.
+        """
+        context = self.memory.get_context(session_id)
+        decision = await self.unified_planner(query, context)
+        mode = decision.get("mode")
+        
+        if mode == "tool":
+            validated = self._validate_layer1_response({
+                "tool": decision.get("tool"),
+                "parameters": decision.get("parameters") or {},
+                "confidence": decision.get("confidence", 0)
+            }, TOOL_DEFINITIONS)
+            tool_name = validated.get("tool")
+            confidence = validated.get("confidence", 0)
+            if tool_name and confidence > 0.7:
+                logger.info(f"UNIFIED PLANNER → single tool {tool_name}")
+                return await self._run_single_tool(query, session_id, tool_name, validated.get("parameters", {}),
+                                                   confidence, "unified", emit)
+            # Layer 1 would only repeat this uncertain pick; let Layer 2 plan the query instead
+            logger.info(f"UNIFIED PLANNER unsure of {tool_name} ({confidence}) → Layer 2")
+            return await self._run_layer2(query, session_id, context, emit) or self._unclear_query_response()
+        
+        elif mode == "none":
+            logger.info(f"UNIFIED PLANNER found no way to serve the query: {decision.get('reasoning', '')}")
+            return self._unclear_query_response()
+        
+        elif mode == "plan" and decision.get("plan"):
+            logger.info("UNIFIED PLANNER → multi-step plan")
+            await self._emit(emit, "routing", {"layer": "unified", "processing_source": "complex_orchestration"})
+            plan_result = await self._run_orchestration_plan(query, decision, emit)
+            if plan_result and not plan_result.get("error"):
+                self.memory.add_exchange(session_id, query, plan_result, "complex_orchestration", {})
+                return {
+                    "result": plan_result,
+                    "processing_source": "complex_orchestration",
+                    "intent": "complex_query",
+                    "confidence": 0.7,
+                    "timestamp": datetime.now().isoformat()
+                }
+        
+        elif mode == "sql" and decision.get("sql"):
+            logger.info("UNIFIED PLANNER → SQL")
+            await self._emit(emit, "routing", {"layer": "unified", "processing_source": "sql_generation"})
+            generated = {
+                "SQL": decision["sql"],
+                "TEXT": decision.get("text", ""),
+                "GRAPHS": decision.get("graphs", {}),
+                "CONTEXT": []
+            }
+            sql_result = await self.sql_generator.execute_sql_result(generated)
+            if sql_result.get("success"):
+                self.sql_generator.templates.remember(query, generated)
+                self.memory.add_exchange(session_id, query, sql_result, "sql_generation", {})
+                await self._emit(emit, "tool_result", self._tool_result_event("sql_generation", sql_result))
+                return {
+                    "result": sql_result,
+                    "processing_source": "sql_generation",
+                    "intent": "analytical_query",
+                    "confidence": 0.8,
+                    "timestamp": datetime.now().isoformat()
+                }
+        
+        logger.info(f"UNIFIED PLANNER could not serve the query (mode={mode}) → layer cascade")
+        return None
+    
+    async def _process_query_planned(self, query: str, session_id: str, emit: Optional[EventEmitter] = None) -> Dict[str, Any]:
+        """Unified planner first (when enabled), the Layer 1 → 2 → 3 cascade as fallback"""
+        if self.sql_generator:
+            templated = self.sql_generator.from_template(query)
+            if templated:
+                result = await self._run_templated_sql(query, session_id, templated, emit)
+                if result is not None:
+                    return result
+        if self.planner_mode == "unified":
+            result = await self._process_query_unified(query, session_id, emit)
+            if result is not None:
+                return result
+        return await self._process_query_layers(query, session_id, emit)
+
+    async def _run_templated_sql(self, query: str, session_id: str, templated: Dict[str, Any],
+                                 emit: Optional[EventEmitter] = None) -> Optional[Dict[str, Any]]:
+        """Answer from a stored SQL template; None (and the template dropped) if it no longer works"""
+        logger.info(f"SQL TEMPLATE HIT: {templated['SQL']}")
+        await self._emit(emit, "routing", {"layer": 3, "processing_source": "sql_generation", "sql_template": True})
+        sql_result = await self.sql_generator.execute_sql_result(templated)
+        if not sql_result.get("success"):
+            self.sql_generator.templates.forget(query)
+            return None
+        sql_result["sql_template"] = True
+        self.memory.add_exchange(session_id, query, sql_result, "sql_generation", {})
+        await self._emit(emit, "tool_result", self._tool_result_event("sql_generation", sql_result))
+        return {
+            "result": sql_result,
+            "processing_source": "sql_generation",
+            "intent": "analytical_query",
+            "confidence": 0.8,
+            "timestamp": datetime.now().isoformat()
+        }
+    
     # ==================== MAIN PROCESSING FLOW ====================
-    async def process_query_optimized(self, query: str, session_id: str) -> Dict[str, Any]:
-        """MAIN PROCESSING: 3-Layer AI-First Approach"""
+    async def process_query_optimized(self, query: str, session_id: str, emit: Optional[EventEmitter] = None) -> Dict[str, Any]:
+        """MAIN PROCESSING: 3-Layer AI-First Approach
+        
+        With planner_mode "unified" a single planner call picks a tool, a plan or SQL, and the
+        Layer 1 → 2 → 3 cascade only runs when that fails. Runs under a per-request QueryBudget (query_timeout / max_ai_calls_per_query). When the
+        budget runs out the best partial result gathered so far is returned instead of waiting.
+        
+        When an emit callback is given, progress events are pushed as the pipeline advances
+        (routing decision, each tool result, synthesized text tokens) for the streaming endpoint.
+        
+        Identical concurrent non-streaming queries from sessions with the same context are
+        coalesced: one pipeline runs and every caller receives its result.
+        """
+        if not self.singleflight or emit is not None:
+            return await self._process_query_budgeted(query, session_id, emit)
+        
+        context = self.memory.get_context(session_id)
+        key = json.dumps([" ".join(query.lower().split()), context], sort_keys=True, default=str)
+        timeout = self.execution_limits["query_timeout"]
+        deadline = time.monotonic() + timeout
+        try:
+            response, shared = await self.query_flight.do(
+                key, partial(self._process_query_budgeted, query, session_id, None), timeout=timeout
+            )
+        except BudgetExhausted as e:
+            return self._degraded_response(QueryBudget(timeout, 0), str(e))
+        remaining = deadline - time.monotonic()
+        if shared and response.get("degraded") and remaining > 0:
+            # The shared run hit the leader's deadline; this caller still has time of its own
+            logger.info(f"Shared run of '{query}' degraded; retrying with {remaining:.1f}s left")
+            return await self._process_query_budgeted(query, session_id, None, timeout=remaining)
+        if shared:
+            logger.info(f"Coalesced identical in-flight query: {query}")
+            self.memory.add_exchange(session_id, query, response.get("result", response),
+                                     response.get("intent", "coalesced"), {})
+        return response
+    
+    async def _process_query_budgeted(self, query: str, session_id: str, emit: Optional[EventEmitter] = None,
+                                      timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run the pipeline under a fresh QueryBudget, degrading to partial results when it runs out"""
+        budget = QueryBudget(timeout or self.execution_limits["query_timeout"], self.execution_limits["max_ai_calls_per_query"])
+        token = _current_budget.set(budget)
+        
+        # Overlap likely DB work with LLM routing
+        prefetcher = None
+        prefetch_token = None
+        if self.speculative_prefetch and self.db_pool:
+            prefetcher = SpeculativePrefetcher(self, self.prefetch_stats)
+            prefetcher.start_for_query(query)
+            prefetch_token = _current_prefetcher.set(prefetcher)
+        
+        try:
+            return await asyncio.wait_for(
+                self._process_query_planned(query, session_id, emit),
+                timeout=budget.timeout
+            )
+        except (asyncio.TimeoutError, BudgetExhausted) as e:
+            reason = str(e) or f"Query deadline of {budget.timeout}s exceeded"
+            logger.warning(f"Query budget exhausted after {budget.llm_calls} LLM calls: {reason}")
+            await self._emit(emit, "degraded", {"reason": reason, "partial_tools": list(budget.partial_results)})
+            return self._degraded_response(budget, reason)
+        finally:
+            if prefetcher:
+                prefetcher.cancel_unused()
+                _current_prefetcher.reset(prefetch_token)
+            _current_budget.reset(token)
+    
+    def _degraded_response(self, budget: QueryBudget, reason: str) -> Dict[str, Any]:
+        """Best partial result when the budget runs out: tool data without synthesized text"""
+        partial = budget.partial_results
+        if len(partial) == 1:
+            result = next(iter(partial.values()))
+        elif partial:
+            result = {
+                "tool_results": partial,
+                **self._build_multi_format_response("", partial)
+            }
+        else:
+            result = {"error": f"Query could not be completed in time: {reason}"}
+        
+        return {
+            "result": result,
+            "processing_source": "partial_result",
+            "intent": "degraded",
+            "degraded": True,
+            "degradation_reason": reason,
+            "partial_tools": list(partial),
+            "confidence": 0.0,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _unclear_query_response(self) -> Dict[str, Any]:
+        """Answer for queries no tool, plan or SQL can serve"""
+        return {
+            "error": "Query is too vague or unclear for ARGO data analysis. Please ask specific questions about oceanographic data, float IDs, regions, or parameters.",
+            "suggestions": [
+                "Try: 'temperature of float 2902296'",
+                "Try: 'floats in arabian sea'", 
+                "Try: 'list all floats'",
+                "Try: 'compare floats 2902296 and 2902297'",
+                "Try: 'locations of all floats in indian ocean'"
+            ],
+            "processing_source": "query_validation",
+            "intent": "unclear_query",
+            "confidence": 0.0,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    async def _run_layer2(self, query: str, session_id: str, context: dict,
+                          emit: Optional[EventEmitter] = None) -> Optional[Dict[str, Any]]:
+        """Layer 2 orchestration; the response on success, None when it produced nothing usable"""
+        await self._emit(emit, "routing", {"layer": 2, "processing_source": "complex_orchestration"})
+        layer2_result = await self.layer2_complex_orchestration(query, context, emit)
+        
+        if layer2_result and not layer2_result.get("error"):
+            logger.info("LAYER 2 SUCCESS - Complex orchestration completed")
+            self.memory.add_exchange(session_id, query, layer2_result, "complex_orchestration", {})
+            return {
+                "result": layer2_result,
+                "processing_source": "complex_orchestration", 
+                "intent": "complex_query",
+                "confidence": 0.7,
+                "timestamp": datetime.now().isoformat()
+            }
+        return None
+    
+    async def _process_query_layers(self, query: str, session_id: str, emit: Optional[EventEmitter] = None) -> Dict[str, Any]:
+        """Layer cascade behind process_query_optimized (SQL templates were already tried by _process_query_planned)"""
         logger.info(f"PROCESSING QUERY: {query}, Session: {session_id}")
         
         context = self.memory.get_context(session_id)
@@ -1252,39 +3404,19 @@ class OptimizedArgoMCPServer:
             parameters = layer1_result.get('parameters', {})
             
             logger.info(f"LAYER 1 SUCCESS - Executing {tool_name} with {parameters}")
-            
-            if tool_name in ['greeting', 'farewell', 'capabilities']:
-                result = self._handle_conversational_intent(tool_name)
-                self.memory.add_exchange(session_id, query, result, tool_name, parameters)
-                
-                return {
-                    "result": result,
-                    "processing_source": "conversational",
-                    "intent": tool_name,
-                    "confidence": confidence,
-                    "timestamp": datetime.now().isoformat()
-                }
-            
-            result = await self.execute_tool(tool_name, parameters)
-            self.memory.add_exchange(session_id, query, result, tool_name, parameters)
-            
-            return {
-                "result": result,
-                "processing_source": "single_tool",
-                "intent": tool_name,
-                "confidence": confidence,
-                "timestamp": datetime.now().isoformat()
-            }
+            return await self._run_single_tool(query, session_id, tool_name, parameters, confidence, 1, emit)
     
         # Check if query requires SQL aggregation (Layer 3)
         if layer1_result.get('requires_sql'):
             logger.info("LAYER 1 DETECTED ANALYTICAL QUERY → LAYER 3: SQL Generation")
-            layer3_result = await self.sql_generator.generate_sql_response(query, context)
+            await self._emit(emit, "routing", {"layer": 3, "processing_source": "sql_generation"})
+            layer3_result = await self.sql_generator.generate_sql_response(query, context, check_templates=False)
             
             self.memory.add_exchange(session_id, query, layer3_result, "sql_generation", {})
             
             if layer3_result.get("success"):
                 logger.info("LAYER 3 SUCCESS - SQL generation completed")
+                await self._emit(emit, "tool_result", self._tool_result_event("sql_generation", layer3_result))
                 return {
                     "result": layer3_result,
                     "processing_source": "sql_generation",
@@ -1295,7 +3427,9 @@ class OptimizedArgoMCPServer:
     
         if layer1_result.get('requires_multiple_tools'):
             logger.info("LAYER 1 DETECTED MULTI-TOOL QUERY → LAYER 2: Complex Orchestration")
-            layer2_result = await self.layer2_complex_orchestration(query, context)
+            await self._emit(emit, "routing", {"layer": 2, "processing_source": "complex_orchestration",
+                                               "suggested_tools": layer1_result.get("suggested_tools", [])})
+            layer2_result = await self.layer2_complex_orchestration(query, context, emit)
             
             if layer2_result and not layer2_result.get("error"):
                 logger.info("LAYER 2 SUCCESS - Complex orchestration completed")
@@ -1311,41 +3445,21 @@ class OptimizedArgoMCPServer:
         logger.info("LAYER 1 UNCERTAIN → LAYER 2: Complex Orchestration")
         
         if layer1_result.get('confidence', 0) == 0 and 'ambiguous' in layer1_result.get('reasoning', '').lower():
-            return {
-                "error": "Query is too vague or unclear for ARGO data analysis. Please ask specific questions about oceanographic data, float IDs, regions, or parameters.",
-                "suggestions": [
-                    "Try: 'temperature of float 2902296'",
-                    "Try: 'floats in arabian sea'", 
-                    "Try: 'list all floats'",
-                    "Try: 'compare floats 2902296 and 2902297'",
-                    "Try: 'locations of all floats in indian ocean'"
-                ],
-                "processing_source": "query_validation",
-                "intent": "unclear_query",
-                "confidence": 0.0,
-                "timestamp": datetime.now().isoformat()
-            }
-        
-        layer2_result = await self.layer2_complex_orchestration(query, context)
+            return self._unclear_query_response()
         
-        if layer2_result and not layer2_result.get("error"):
-            logger.info("LAYER 2 SUCCESS - Complex orchestration completed")
-            self.memory.add_exchange(session_id, query, layer2_result, "complex_orchestration", {})
-            return {
-                "result": layer2_result,
-                "processing_source": "complex_orchestration", 
-                "intent": "complex_query",
-                "confidence": 0.7,
-                "timestamp": datetime.now().isoformat()
-            }
+        layer2_response = await self._run_layer2(query, session_id, context, emit)
+        if layer2_response:
+            return layer2_response
         
         logger.info("LAYER 2 FAILED → LAYER 3: SQL Generation")
-        layer3_result = await self.sql_generator.generate_sql_response(query, context)
+        await self._emit(emit, "routing", {"layer": 3, "processing_source": "sql_generation"})
+        layer3_result = await self.sql_generator.generate_sql_response(query, context, check_templates=False)
         
         self.memory.add_exchange(session_id, query, layer3_result, "sql_generation", {})
         
         if layer3_result.get("success"):
             logger.info("LAYER 3 SUCCESS - SQL generation completed")
+            await self._emit(emit, "tool_result", self._tool_result_event("sql_generation", layer3_result))
             return {
                 "result": layer3_result,
                 "processing_source": "sql_generation",
@@ -1355,7 +3469,8 @@ class OptimizedArgoMCPServer:
             }
         else:
             logger.info("ULTIMATE FALLBACK - Direct AI analysis")
-            analysis = await self.analyze_with_llm(query)
+            await self._emit(emit, "routing", {"layer": 4, "processing_source": "emergency_fallback"})
+            analysis = await self.analyze_with_llm(query, emit=emit)
             fallback_result = {"ai_analysis": analysis, "note": "Used ultimate fallback"}
             return {
                 "result": fallback_result,
@@ -1365,17 +3480,112 @@ class OptimizedArgoMCPServer:
                 "timestamp": datetime.now().isoformat()
             }
     
+    async def _run_single_tool(self, query: str, session_id: str, tool_name: str, parameters: Dict[str, Any],
+                               confidence: float, layer: Any, emit: Optional[EventEmitter] = None) -> Dict[str, Any]:
+        """Execute one selected tool (or conversational intent) and record the exchange"""
+        if tool_name in ['greeting', 'farewell', 'capabilities']:
+            await self._emit(emit, "routing", {"layer": layer, "processing_source": "conversational", "tool": tool_name, "confidence": confidence})
+            result = self._handle_conversational_intent(tool_name)
+            self.memory.add_exchange(session_id, query, result, tool_name, parameters)
+            
+            return {
+                "result": result,
+                "processing_source": "conversational",
+                "intent": tool_name,
+                "confidence": confidence,
+                "timestamp": datetime.now().isoformat()
+            }
+        
+        await self._emit(emit, "routing", {"layer": layer, "processing_source": "single_tool", "tool": tool_name,
+                                           "parameters": parameters, "confidence": confidence})
+        result = await self.execute_tool(tool_name, parameters)
+        await self._emit(emit, "tool_result", self._tool_result_event(tool_name, result))
+        self.memory.add_exchange(session_id, query, result, tool_name, parameters)
+        
+        return {
+            "result": result,
+            "processing_source": "single_tool",
+            "intent": tool_name,
+            "confidence": confidence,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    # ==================== STREAMING HELPERS ====================
+    async def _emit(self, emit: Optional[EventEmitter], event: str, data: Dict[str, Any]):
+        """Push a progress event to the streaming client, if any"""
+        if emit is None:
+            return
+        try:
+            await emit(event, data)
+        except Exception as e:
+            logger.warning(f"Failed to emit {event} event: {e}")
+    
+    def _tool_result_event(self, tool_name: str, result: Any) -> Dict[str, Any]:
+        """Package one tool result with its map/graph formats so the client can render it early"""
+        standardized = self.standardize_response({"result": result if isinstance(result, dict) else {"data": result}})
+        return {
+            "tool": tool_name,
+            "formats": standardized["formats"],
+            "response_type": standardized["response_type"],
+            "summary": standardized["ai_synthesized_response"]
+        }
+    
+    async def _stream_llm_text(self, prompt: str, emit: EventEmitter) -> str:
+        """Stream an LLM completion, forwarding each chunk as a 'token' event. Returns the full text."""
+        async def on_token(text: str):
+            await self._emit(emit, "token", {"text": text})
+        
+        return await self.llm.stream(prompt, on_token)
+    
     # ==================== TOOL EXECUTION ====================
+    def tool_cache_key(self, tool_name: str, parameters: Dict[str, Any]) -> str:
+        """Canonical key for a tool call: parameters bound to the tool signature with defaults applied"""
+        params = dict(parameters)
+        try:
+            bound = inspect.signature(getattr(self, tool_name)).bind(**params)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+        except (TypeError, AttributeError):
+            pass
+        return json.dumps([tool_name, params], sort_keys=True, default=str)
+    
     async def execute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
-        """Execute a single tool with parameters"""
+        """Execute a single tool with parameters (served from the versioned result cache when possible)"""
         if not hasattr(self, tool_name):
             return {"error": f"Tool {tool_name} not found"}
         
         try:
             tool_func = getattr(self, tool_name)
-            logger.info(f"Executing tool: {tool_name} with parameters: {parameters}")
-            result = await tool_func(**parameters)
+            call_key = self.tool_cache_key(tool_name, parameters)
+            cache_key = self.tool_cache.key_for(tool_name, call_key, parameters)
+            if cache_key:
+                cached = await self.tool_cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"Tool {tool_name} served from cache")
+                    budget = current_budget()
+                    if budget:
+                        budget.record(tool_name, cached)
+                    return cached
+            
+            prefetcher = current_prefetcher()
+            prefetched = prefetcher.claim(call_key) if prefetcher else None
+            if prefetched is not None:
+                logger.info(f"Using speculative prefetch for {tool_name} with parameters: {parameters}")
+                result = await prefetched
+            elif self.singleflight:
+                logger.info(f"Executing tool: {tool_name} with parameters: {parameters}")
+                result, shared = await self.tool_flight.do(call_key, partial(tool_func, **parameters))
+                if shared:
+                    logger.info(f"Coalesced with in-flight {tool_name} call")
+            else:
+                logger.info(f"Executing tool: {tool_name} with parameters: {parameters}")
+                result = await tool_func(**parameters)
             logger.info(f"Tool {tool_name} execution completed")
+            if cache_key:
+                await self.tool_cache.set(cache_key, result)
+            budget = current_budget()
+            if budget:
+                budget.record(tool_name, result)
             return result
         except Exception as e:
             logger.error(f"Tool execution failed for {tool_name}: {e}")
@@ -1554,6 +3764,16 @@ class OptimizedArgoMCPServer:
                 count = len(td.get("data", {}).get("values", []))
                 response["ai_synthesized_response"] = f"Time series for {param} from float {fid} ({count} points)."
 
+            # get_climatology
+            elif result_data.get("source") == "climatology_cube":
+                stats = result_data.get("statistics", {})
+                where = f" in the {result_data['region'].replace('_', ' ')}" if result_data.get("region") else ""
+                low, high = result_data.get("pressure_range", [None, None])
+                response["ai_synthesized_response"] = (
+                    f"Mean {result_data.get('parameter')}{where} at {low:g}-{high:g} dbar: {stats.get('mean'):.3f} "
+                    f"({stats.get('count')} measurements, {len(result_data.get('by_month', []))} months)."
+                )
+
             # compare_floats
             elif "comparison" in result_data:
                 comp = result_data.get("comparison", {})
@@ -1819,16 +4039,56 @@ class OptimizedArgoMCPServer:
                 })
         return markers
     
+    # profile_levels array column holding each measurements parameter (depth_m is stored as pressure)
+    LEVEL_ARRAYS = {"pressure": "pressure", "depth_m": "pressure", "temperature": "temperature", "salinity": "salinity"}
+
+    @staticmethod
+    def _expand_profile_levels(row) -> List[Dict]:
+        """profile_levels row -> measurements-style level dicts, in level order"""
+        temperature = row['temperature'] or [None] * len(row['n_level'])
+        salinity = row['salinity'] or [None] * len(row['n_level'])
+        return [
+            {"cycle_number": row['cycle_number'], "n_level": n_level, "pressure": pressure, "depth_m": pressure,
+             "temperature": temp, "salinity": psal}
+            for n_level, pressure, temp, psal in zip(row['n_level'], row['pressure'], temperature, salinity)
+        ]
+
     async def query_measurements(self, float_id: Optional[int] = None, parameter: Optional[str] = None,
                                depth_range: Optional[Tuple[float, float]] = None,
-                               cycle_range: Optional[Tuple[int, int]] = None, limit: int = 1000) -> Any:
-        """Query ARGO measurements - returns raw data with visualization"""
+                               cycle_range: Optional[Tuple[int, int]] = None, limit: int = 1000,
+                               page_token: Optional[str] = None) -> Any:
+        """Query ARGO measurements - returns raw data with visualization
+        
+        Keyset-paginated on (float_id, cycle_number, n_level): when more rows match than `limit`,
+        metadata.has_more is set and metadata.next_page_token continues after the last row.
+        """
         if not self.db_pool:
             return {"error": "Database not connected"}
         
         if not float_id and not depth_range and not parameter:
             return {"error": "At least one of float_id, depth_range, or parameter is required"}
         
+        if parameter and parameter not in ['temperature', 'salinity', 'pressure', 'depth_m']:
+            return {"error": f"Invalid parameter: {parameter}. Must be one of: temperature, salinity, pressure, depth_m"}
+        
+        filters = {"float_id": float_id, "parameter": parameter, "depth_range": depth_range, "cycle_range": cycle_range}
+        after = None
+        if page_token:
+            try:
+                after = decode_page_token(page_token, "measurements", filters)
+            except InvalidPageToken as e:
+                return {"error": str(e)}
+        page_size = clamp_page_size(limit, 1000)
+        
+        columns = self.hot_floats.lookup(float_id) if float_id else None
+        if columns is not None:
+            # Same filters and keyset order as the SQL below, sliced from the cached columns
+            match = np.flatnonzero(columns.mask(parameter, cycle_range, depth_range,
+                                                after=(after[1], after[2]) if after else None))
+            has_more = len(match) > page_size
+            return self._measurements_page(columns.rows(match[:page_size]), float_id, parameter, filters,
+                                           after, has_more)
+        
         async with self.db_pool.acquire() as conn:
             sql = """
             SELECT m.float_id, m.cycle_number, m.n_level, m.pressure, m.depth_m, 
@@ -1852,54 +4112,121 @@ class OptimizedArgoMCPServer:
                 params.extend(cycle_range)
             
             if parameter:
-                if parameter not in ['temperature', 'salinity', 'pressure', 'depth_m']:
-                    return {"error": f"Invalid parameter: {parameter}. Must be one of: temperature, salinity, pressure, depth_m"}
                 sql += f" AND m.{parameter} IS NOT NULL"
             
-            sql += f" ORDER BY m.float_id, m.cycle_number, m.n_level LIMIT ${len(params) + 1}"
-            params.append(limit)
+            if after:
+                # Row comparison walks the (float_id, cycle_number, n_level) unique index
+                n = len(params)
+                sql += f" AND (m.float_id, m.cycle_number, m.n_level) > (${n + 1}::int, ${n + 2}::int, ${n + 3}::int)"
+                params.extend(after)
+            
+            sql += " ORDER BY m.float_id, m.cycle_number, m.n_level"
             
             try:
-                rows = await conn.fetch(sql, *params)
-                data = [dict(row) for row in rows]
-                
-                if not data:
-                    return {"error": f"No data found for float {float_id} and parameter {parameter}"}
-                
-                result = {
-                    "data": data,
-                    "metadata": {
-                        "float_id": float_id,
-                        "parameter": parameter,
-                        "total_points": len(data),
-                        "depth_range": [min(r['pressure'] for r in data if r['pressure']), max(r['pressure'] for r in data if r['pressure'])] if data else None,
-                        "value_range": [min(r[parameter] for r in data if r[parameter]), max(r[parameter] for r in data if r[parameter])] if parameter and data else None
-                    },
-                    "viz": {
-                        "kind": "profile",
-                        "spec": {
-                            "x": parameter or "value",
-                            "y": "pressure",
-                            "x_label": parameter.replace('_', ' ').title() if parameter else "Value",
-                            "y_label": "Pressure (dbar)",
-                            "invert_y": True
-                        }
-                    }
-                }
-                
-                logger.info(f"Retrieved {len(data)} measurements for float {float_id}")
-                return result
-                
+                rows, has_more = await fetch_page(conn, sql, params, page_size)
+                return self._measurements_page([dict(row) for row in rows], float_id, parameter, filters,
+                                               after, has_more)
             except Exception as e:
                 logger.exception("Query error")
                 err_msg = str(e) if str(e) else "Query failed; check server logs for details"
                 return {"error": err_msg}
 
-    async def get_float_profile(self, float_id: int, cycle_number: Optional[int] = None) -> Dict:
-        """Get complete float profile - returns raw data"""
+    def _measurements_page(self, data: List[Dict], float_id: Optional[int], parameter: Optional[str],
+                           filters: Dict[str, Any], after: Optional[List[Any]], has_more: bool) -> Dict:
+        """query_measurements response for one page of rows (from SQL or the hot-float cache)"""
+        if not data:
+            if after:
+                return {"data": [], "metadata": {"float_id": float_id, "parameter": parameter, "total_points": 0,
+                                                 "has_more": False, "next_page_token": None}}
+            return {"error": f"No data found for float {float_id} and parameter {parameter}"}
+        
+        last = data[-1]
+        next_token = encode_page_token("measurements", filters, [last['float_id'], last['cycle_number'], last['n_level']]) if has_more else None
+        
+        result = {
+            "data": data,
+            "metadata": {
+                "float_id": float_id,
+                "parameter": parameter,
+                "total_points": len(data),
+                "has_more": has_more,
+                "next_page_token": next_token,
+                "depth_range": [min(r['pressure'] for r in data if r['pressure']), max(r['pressure'] for r in data if r['pressure'])] if data else None,
+                "value_range": [min(r[parameter] for r in data if r[parameter]), max(r[parameter] for r in data if r[parameter])] if parameter and data else None
+            },
+            "viz": {
+                "kind": "profile",
+                "spec": {
+                    "x": parameter or "value",
+                    "y": "pressure",
+                    "x_label": parameter.replace('_', ' ').title() if parameter else "Value",
+                    "y_label": "Pressure (dbar)",
+                    "invert_y": True
+                }
+            }
+        }
+        
+        logger.info(f"Retrieved {len(data)} measurements for float {float_id}{' (more pages)' if has_more else ''}")
+        return result
+
+    async def _fetch_array_profile_page(self, conn, float_id: int, cycle_number: Optional[int],
+                                        after: Optional[List[Any]], page_size: int) -> Tuple[List[Dict], bool]:
+        """
+        get_float_profile page from profile_levels: profiles are read through a cursor from the
+        token's cycle onwards and expanded to levels until page_size + 1 levels are collected.
+        """
+        sql = """
+        SELECT pl.cycle_number, pl.n_level, pl.pressure, pl.temperature, pl.salinity,
+               p.profile_date, p.latitude, p.longitude, p.direction, p.max_depth, p.n_levels
+        FROM profile_levels pl
+        LEFT JOIN profiles p ON p.float_id = pl.float_id AND p.cycle_number = pl.cycle_number
+        WHERE pl.float_id = $1
+        """
+        params: List[Any] = [float_id]
+        if cycle_number:
+            params.append(cycle_number)
+            sql += f" AND pl.cycle_number = ${len(params)}"
+        if after:
+            params.append(after[0])
+            sql += f" AND pl.cycle_number >= ${len(params)}"
+        sql += " ORDER BY pl.cycle_number"
+        
+        after_key = (after[0], after[1]) if after else None
+        levels: List[Dict] = []
+        async with conn.transaction(readonly=True):
+            cursor = await conn.cursor(sql, *params, timeout=db_timeout())
+            while len(levels) <= page_size:
+                batch = await cursor.fetch(32, timeout=db_timeout())
+                if not batch:
+                    break
+                for row in batch:
+                    profile = {k: row[k] for k in ("profile_date", "latitude", "longitude", "direction", "max_depth", "n_levels")}
+                    for level in self._expand_profile_levels(row):
+                        if after_key and (level['cycle_number'], level['n_level']) <= after_key:
+                            continue
+                        level.update(profile)
+                        levels.append(level)
+        return levels[:page_size], len(levels) > page_size
+
+    async def get_float_profile(self, float_id: int, cycle_number: Optional[int] = None,
+                                limit: Optional[int] = None, page_token: Optional[str] = None) -> Dict:
+        """Get complete float profile - returns raw data
+        
+        Measurements are keyset-paginated on (cycle_number, n_level), FLOAT_PROFILE_PAGE_SIZE rows
+        per page by default; follow next_page_token for the rest.
+        """
         if not self.db_pool:
             return {"error": "Database not connected"}
         
+        filters = {"float_id": float_id, "cycle_number": cycle_number}
+        after = None
+        if page_token:
+            try:
+                after = decode_page_token(page_token, "float_profile", filters)
+            except InvalidPageToken as e:
+                return {"error": str(e)}
+        page_size = clamp_page_size(limit, FLOAT_PROFILE_PAGE_SIZE)
+        
         async with self.db_pool.acquire() as conn:
             meta_sql = """
             SELECT platform_number as float_id, float_serial_number, launch_date, start_date, end_of_life,
@@ -1908,7 +4235,7 @@ class OptimizedArgoMCPServer:
             FROM float_metadata 
             WHERE platform_number = $1
             """
-            meta_row = await conn.fetchrow(meta_sql, float_id)
+            meta_row = await conn.fetchrow(meta_sql, float_id, timeout=db_timeout())
             
             if not meta_row:
                 return {"error": f"Float {float_id} not found"}
@@ -1926,13 +4253,28 @@ class OptimizedArgoMCPServer:
                 data_sql += " AND m.cycle_number = $2"
                 params.append(cycle_number)
             
+            if after:
+                n = len(params)
+                data_sql += f" AND (m.cycle_number, m.n_level) > (${n + 1}::int, ${n + 2}::int)"
+                params.extend(after)
+            
             data_sql += " ORDER BY m.cycle_number, m.n_level"
             
             try:
-                data_rows = await conn.fetch(data_sql, *params)
+                if self.measurement_storage == "arrays":
+                    measurements, has_more = await self._fetch_array_profile_page(conn, float_id, cycle_number, after, page_size)
+                else:
+                    data_rows, has_more = await fetch_page(conn, data_sql, params, page_size)
+                    measurements = [dict(row) for row in data_rows]
+                next_token = None
+                if has_more:
+                    last = measurements[-1]
+                    next_token = encode_page_token("float_profile", filters, [last['cycle_number'], last['n_level']])
                 return {
                     "metadata": dict(meta_row),
-                    "measurements": [dict(row) for row in data_rows]
+                    "measurements": measurements,
+                    "has_more": has_more,
+                    "next_page_token": next_token
                 }
             except Exception as e:
                 logger.exception("Profile query error")
@@ -1956,7 +4298,7 @@ class OptimizedArgoMCPServer:
             """
             
             try:
-                rows = await conn.fetch(sql, float_id)
+                rows = await conn.fetch(sql, float_id, timeout=db_timeout())
                 trajectory_data = [dict(row) for row in rows]
                 
                 if not trajectory_data:
@@ -1971,95 +4313,85 @@ class OptimizedArgoMCPServer:
                 logger.error(f"Trajectory query failed for float {float_id}: {str(e)}")
                 return []  # ✅ Return empty list instead of error dict
 
-    async def get_multiple_trajectories(self, float_ids: List[int]) -> Dict:
-        """Get trajectories for MULTIPLE floats - PROPERLY FIXED"""
+    async def get_multiple_trajectories(self, float_ids: List[int], max_points_per_float: Optional[int] = None) -> Dict:
+        """Get trajectories for MULTIPLE floats in one query
+        
+        Rows come back ordered by float and cycle and are grouped in a single pass into
+        per-float lat/lon point lists. With max_points_per_float, long tracks are thinned in SQL
+        (evenly spaced cycles, first and last always kept) before they leave the database.
+        """
         if not self.db_pool:
             return {"error": "Database not connected"}
         
         if not float_ids:
             return {"error": "No float IDs provided"}
         
-        all_trajectories = {}
-        successful_trajectories = 0
+        ids = list(dict.fromkeys(int(f) for f in float_ids))
+        if max_points_per_float is not None:
+            max_points_per_float = max(2, int(max_points_per_float))
         
-        for float_id in float_ids:
-            try:
-                trajectory_result = await self.get_trajectory(float_id)
-                
-                # FIX: Check if get_trajectory returned SUCCESS (has map_data) or ERROR
-                if isinstance(trajectory_result, dict) and "map_data" in trajectory_result:
-                    # ✅ SUCCESS - Extract points in frontend format
-                    traj_data = trajectory_result.get("map_data", {})
-                    points = []
-                    
-                    # Extract points from viz.spec if available
-                    if "viz" in traj_data and "spec" in traj_data["viz"]:
-                        raw_points = traj_data["viz"]["spec"].get("points", [])
-                        # Convert to lat/lon format
-                        points = [{"lat": p.get("latitude") or p.get("lat"), 
-                                  "lon": p.get("longitude") or p.get("lon")} 
-                                 for p in raw_points]
-                    else:
-                        # Fallback: try trajectory_result.viz.spec.points
-                        if "viz" in trajectory_result and "spec" in trajectory_result["viz"]:
-                            raw_points = trajectory_result["viz"]["spec"].get("points", [])
-                            points = [{"lat": p.get("latitude") or p.get("lat"), 
-                                      "lon": p.get("longitude") or p.get("lon")} 
-                                     for p in raw_points]
-                    
-                    all_trajectories[float_id] = {
-                        "float_id": float_id,
-                        "points": points,
-                        "status": "success"
-                    }
-                    successful_trajectories += 1
-                    logger.info(f"✅ Successfully retrieved trajectory for float {float_id} with {len(points)} points")
-                    
-                elif isinstance(trajectory_result, dict) and "error" in trajectory_result:
-                    # ❌ ERROR from get_trajectory
-                    all_trajectories[float_id] = {
-                        "error": trajectory_result["error"],
-                        "status": "failed"
-                    }
-                    logger.warning(f"Trajectory failed for float {float_id}: {trajectory_result['error']}")
-                    
-                else:
-                    # Unexpected response
-                    all_trajectories[float_id] = {
-                        "error": "Unexpected response from trajectory service",
-                        "status": "error"
-                    }
-                    logger.error(f"Unexpected response for float {float_id}: {trajectory_result}")
-                    
-            except Exception as e:
+        sql = """
+        SELECT float_id, latitude, longitude, n_points
+        FROM (
+            SELECT float_id, cycle_number, latitude, longitude,
+                   ROW_NUMBER() OVER (PARTITION BY float_id ORDER BY cycle_number) - 1 AS rn,
+                   COUNT(*) OVER (PARTITION BY float_id) AS n_points
+            FROM profiles
+            WHERE float_id = ANY($1::int[])
+            AND latitude IS NOT NULL 
+            AND longitude IS NOT NULL
+        ) t
+        WHERE $2::int IS NULL
+           OR n_points <= $2
+           -- keep rn = floor(i * (n - 1) / ($2 - 1)) for i = 0 .. $2 - 1: exactly $2 points, first and last included
+           OR ((rn * ($2 - 1) + n_points - 2) / NULLIF(n_points - 1, 0)) * (n_points - 1) / ($2 - 1) = rn
+        ORDER BY float_id, cycle_number
+        """
+        
+        try:
+            async with self.db_pool.acquire() as conn:
+                rows = await conn.fetch(sql, ids, max_points_per_float, timeout=db_timeout())
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            logger.error(f"Bulk trajectory query failed: {e}")
+            return {"error": f"Trajectory query failed: {str(e)}"}
+        
+        grouped: Dict[int, Dict[str, Any]] = {}
+        for row in rows:
+            fid = row["float_id"]
+            track = grouped.get(fid)
+            if track is None:
+                track = grouped[fid] = {"float_id": fid, "points": [], "original_point_count": row["n_points"],
+                                        "status": "success"}
+            track["points"].append({"lat": row["latitude"], "lon": row["longitude"]})
+        
+        all_trajectories = {}
+        for float_id in ids:
+            if float_id in grouped:
+                all_trajectories[float_id] = grouped[float_id]
+            else:
                 all_trajectories[float_id] = {
-                    "error": f"Trajectory query failed: {str(e)}",
-                    "status": "error"
+                    "error": f"No trajectory data found for float {float_id}",
+                    "status": "failed"
                 }
-                logger.error(f"Exception getting trajectory for float {float_id}: {e}")
-        
-        # Build visualization data for successful trajectories
-        viz_trajectories = []
-        for float_id, trajectory_info in all_trajectories.items():
-            if trajectory_info.get("status") == "success" and "trajectory_data" in trajectory_info:
-                trajectory_data = trajectory_info["trajectory_data"]
-                if "viz" in trajectory_data and "spec" in trajectory_data["viz"]:
-                    viz_trajectories.append({
-                        "float_id": float_id,
-                        "points": trajectory_data["viz"]["spec"].get("points", [])
-                    })
+        successful_trajectories = len(grouped)
+        logger.info(f"Retrieved {successful_trajectories}/{len(ids)} trajectories, {len(rows)} points in one query")
         
         return {
             "type": "multiple_trajectories",
             "float_ids": float_ids,
-            "total_floats": len(float_ids),
+            "total_floats": len(ids),
             "successful_trajectories": successful_trajectories,
-            "failed_trajectories": len(float_ids) - successful_trajectories,
+            "failed_trajectories": len(ids) - successful_trajectories,
+            "max_points_per_float": max_points_per_float,
             "trajectories": all_trajectories,
             "viz": {
                 "kind": "multiple_trajectories_map",
                 "spec": {
-                    "trajectories": viz_trajectories
+                    "trajectories": [
+                        {"float_id": fid, "point_count": len(t["points"])} for fid, t in grouped.items()
+                    ]
                 }
             }
         }
@@ -2091,9 +4423,10 @@ class OptimizedArgoMCPServer:
             logger.error(f"Semantic search error: {e}")
             return {"error": str(e)}
 
-    async def analyze_with_llm(self, query: str, context_data: Optional[List[Dict]] = None) -> str:
+    async def analyze_with_llm(self, query: str, context_data: Optional[List[Dict]] = None,
+                               emit: Optional[EventEmitter] = None) -> str:
         """Direct AI analysis fallback"""
-        if not self.gemini_model:
+        if not self.llm:
             return "LLM not available"
         
         context = ""
@@ -2110,33 +4443,139 @@ class OptimizedArgoMCPServer:
         """
         
         try:
-            response = await asyncio.to_thread(
-                lambda: self.gemini_model.generate_content(prompt)
-            )
+            if emit:
+                return (await self._stream_llm_text(prompt, emit)).strip()
+            response = await self.llm.generate(prompt)
             return response.text.strip()
+        except BudgetExhausted:
+            raise
         except Exception as e:
             return f"Analysis error: {str(e)}"
 
+    def build_export_query(self, float_ids: Optional[List[int]] = None, region: Optional[str] = None,
+                           cycle_min: Optional[int] = None, cycle_max: Optional[int] = None,
+                           depth_min: Optional[float] = None, depth_max: Optional[float] = None,
+                           date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> Tuple[str, List[Any]]:
+        """
+        SQL and parameters for a filtered measurement export (columns in bulk_export.COLUMNS order).
+        date_to is exclusive; pass it through _as_datetime(..., end_of_day=True) so a bare date covers that day.
+        """
+        if region and region not in REGIONS:
+            raise ValueError(f"Invalid region: {region}. Valid regions: {list(REGIONS.keys())}")
+        sql = """
+        SELECT m.float_id, m.cycle_number, m.n_level, p.profile_date, p.latitude, p.longitude,
+               m.pressure, m.depth_m, m.temperature, m.salinity
+        FROM measurements m
+        JOIN profiles p ON m.float_id = p.float_id AND m.cycle_number = p.cycle_number
+        WHERE 1=1
+        """
+        params: List[Any] = []
+        
+        def add(clause: str, value: Any):
+            params.append(value)
+            return clause.replace("?", f"${len(params)}")
+        
+        if float_ids:
+            sql += add(" AND m.float_id = ANY(?::int[])", [int(f) for f in float_ids])
+        if region:
+            # Same membership as the region tools: every measurement of the floats seen in the region
+            sql += add(" AND m.float_id IN (SELECT float_id FROM float_region WHERE region = ?)", region)
+        if cycle_min is not None:
+            sql += add(" AND m.cycle_number >= ?", int(cycle_min))
+        if cycle_max is not None:
+            sql += add(" AND m.cycle_number <= ?", int(cycle_max))
+        if depth_min is not None:
+            sql += add(" AND m.pressure >= ?", float(depth_min))
+        if depth_max is not None:
+            sql += add(" AND m.pressure <= ?", float(depth_max))
+        if date_from is not None:
+            sql += add(" AND p.profile_date >= ?", date_from)
+        if date_to is not None:
+            sql += add(" AND p.profile_date < ?", date_to)
+        sql += " ORDER BY m.float_id, m.cycle_number, m.n_level"
+        return sql, params
+
+    async def stream_export(self, format_type: str, sql: str, params: List[Any], writer=None):
+        """
+        Encoded export bytes, chunk by chunk: a server-side cursor reads EXPORT_CHUNK_ROWS rows
+        at a time and the writer encodes each chunk before the next is fetched (constant memory).
+        Encoding runs in a worker thread so a large export does not stall other requests.
+        """
+        writer = writer or bulk_export.make_writer(format_type)
+        async with self.export_slots:
+            async with self.db_pool.acquire() as conn:
+                async with conn.transaction(readonly=True):
+                    cursor = await conn.cursor(sql, *params)
+                    head = writer.begin()
+                    if head:
+                        yield head
+                    total = 0
+                    while True:
+                        rows = await cursor.fetch(EXPORT_CHUNK_ROWS)
+                        if not rows:
+                            break
+                        total += len(rows)
+                        chunk = await asyncio.to_thread(lambda: writer.write([tuple(r) for r in rows]))
+                        if chunk:
+                            yield chunk
+                    tail = await asyncio.to_thread(writer.finish)
+                    if tail:
+                        yield tail
+        logger.info(f"Exported {total} rows as {format_type}")
+
+    def cached_export_columns(self, float_ids: Optional[List[int]], region: Optional[str] = None) -> Optional[List[float_columns.FloatColumns]]:
+        """Hot-float columns for an export of explicit floats, when every one of them is resident"""
+        if not float_ids or region:
+            return None
+        columns = [self.hot_floats.peek(f) for f in dict.fromkeys(int(f) for f in float_ids)]
+        return None if any(c is None for c in columns) else sorted(columns, key=lambda c: c.float_id)
+
+    async def stream_export_columns(self, format_type: str, columns: List[float_columns.FloatColumns],
+                                    cycle_min: Optional[int] = None, cycle_max: Optional[int] = None,
+                                    depth_min: Optional[float] = None, depth_max: Optional[float] = None,
+                                    date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, writer=None):
+        """stream_export for cached floats: same filters, row order and chunking, sliced from the columns"""
+        writer = writer or bulk_export.make_writer(format_type)
+        cycle_range = (-2**31 if cycle_min is None else int(cycle_min), 2**31 - 1 if cycle_max is None else int(cycle_max))
+        depth_range = None  # levels without a pressure only match when no depth filter is given
+        if depth_min is not None or depth_max is not None:
+            depth_range = (-np.inf if depth_min is None else float(depth_min), np.inf if depth_max is None else float(depth_max))
+        dates = (date_from, date_to) if date_from is not None or date_to is not None else None
+        head = writer.begin()
+        if head:
+            yield head
+        total = 0
+        for float_data in columns:
+            match = np.flatnonzero(float_data.mask(cycle_range=cycle_range, depth_range=depth_range,
+                                                   date_range=dates, with_profile=True))
+            for start in range(0, len(match), EXPORT_CHUNK_ROWS):
+                rows = float_data.export_rows(match[start:start + EXPORT_CHUNK_ROWS])
+                total += len(rows)
+                chunk = await asyncio.to_thread(writer.write, rows)
+                if chunk:
+                    yield chunk
+        tail = await asyncio.to_thread(writer.finish)
+        if tail:
+            yield tail
+        logger.info(f"Exported {total} cached rows as {format_type}")
+
     async def export_data_ascii(self, float_id: int, format_type: str = "csv") -> str:
-        """Export ARGO data in ASCII format"""
+        """Export ARGO data in ASCII format (all of one float; use /export for larger selections)"""
         if not self.db_pool:
             return "Database not connected"
         
+        if format_type not in ("csv", "tsv"):
+            return "Unsupported format. Use 'csv' or 'tsv'."
+        
         try:
-            data = await self.query_measurements(float_id=float_id, limit=10000)
-            if isinstance(data, dict) and data.get("error"):
-                return data["error"]
-            
-            records = data if isinstance(data, list) else data.get("data", [])
-            df = pd.DataFrame(records)
-            
-            if format_type == "csv":
-                return df.to_csv(index=False)
-            elif format_type == "tsv":
-                return df.to_csv(index=False, sep="\t")
+            columns = self.hot_floats.lookup(float_id)
+            if columns is not None:
+                stream = self.stream_export_columns(format_type, [columns])
             else:
-                return "Unsupported format. Use 'csv' or 'tsv'."
-                
+                sql, params = self.build_export_query(float_ids=[float_id])
+                stream = self.stream_export(format_type, sql, params)
+            parts = [chunk async for chunk in stream]
+            return b"".join(parts).decode()
         except Exception as e:
             logger.error(f"Export error: {e}")
             return f"Export failed: {str(e)}"
@@ -2150,42 +4589,43 @@ class OptimizedArgoMCPServer:
             return {"error": f"Invalid region: {region}. Valid regions: {list(REGIONS.keys())}"}
         
         async with self.db_pool.acquire() as conn:
-            lat_min, lat_max, lon_min, lon_max = REGIONS[region]
-            
-            sql = """
-            SELECT DISTINCT float_id FROM profiles 
-            WHERE latitude BETWEEN $1 AND $2 
-            AND longitude BETWEEN $3 AND $4
-            """
             try:
-                rows = await conn.fetch(sql, lat_min, lat_max, lon_min, lon_max)
-                float_ids = [r['float_id'] for r in rows]
-                
-                if not float_ids:
-                    return {"region": region, "floats": [], "float_count": 0}
+                rows = await conn.fetch("""
+                SELECT fr.float_id, fr.profile_count, fr.last_profile_date, fm.float_serial_number, fm.launch_date,
+                       fm.start_date, fm.end_of_life, fm.launch_latitude, fm.launch_longitude, fm.firmware_version,
+                       fm.pi_name, fm.project_name, fm.deployment_platform, fm.float_owner, fm.operating_institute
+                FROM float_region fr
+                LEFT JOIN float_metadata fm ON fm.platform_number = fr.float_id
+                WHERE fr.region = $1
+                ORDER BY fr.float_id
+                """, region, timeout=db_timeout())
                 
-                placeholders = ','.join([f'${i+1}' for i in range(len(float_ids))])
-                meta_sql = f"""
-                SELECT platform_number, float_serial_number, launch_date, start_date, end_of_life,
-                       launch_latitude, launch_longitude, firmware_version, pi_name, project_name,
-                       deployment_platform, float_owner, operating_institute
-                FROM float_metadata 
-                WHERE platform_number IN ({placeholders})
-                """
-                meta_rows = await conn.fetch(meta_sql, *float_ids)
+                floats = []
+                for row in rows:
+                    item = dict(row)
+                    item["platform_number"] = item.pop("float_id")
+                    floats.append(item)
                 
-                return {
+                result = {
                     "region": region,
                     "bounding_box": REGIONS[region],
-                    "float_count": len(float_ids),
-                    "floats": [dict(row) for row in meta_rows]
+                    "float_count": len(floats),
+                    "floats": floats
                 }
+                if spatial.REGIONS[region].polygon is not None:
+                    result["polygon"] = spatial.REGIONS[region].describe()["polygon"]
+                return result
             except Exception as e:
                 logger.error(f"Error fetching floats in region {region}: {e}")
                 return {"error": str(e)}
 
     async def compare_floats(self, float_ids: List[int], parameter: str = "temperature") -> Dict:
-        """Compare multiple floats - returns raw data"""
+        """Compare multiple floats - returns raw data
+        
+        One grouped aggregate over measurements (float_id = ANY($1)) joined to float_metadata,
+        so latency stays flat as the number of floats grows. Floats already in the hot-float cache
+        are summarized from their columns and skipped by the aggregate (misses are not loaded).
+        """
         if not self.db_pool:
             return {"error": "Database not connected"}
         
@@ -2195,126 +4635,505 @@ class OptimizedArgoMCPServer:
         if len(float_ids) < 2:
             return {"error": "At least two float IDs required"}
         
+        ids = list(dict.fromkeys(int(f) for f in float_ids))
+        cached = {}
+        for fid in ids:
+            columns = self.hot_floats.peek(fid)
+            if columns is not None:
+                cached[fid] = columns.summary(parameter)
+        uncached = [fid for fid in ids if fid not in cached]
+        
+        source = "measurements"
+        if self.measurement_storage == "arrays":
+            # Unnest only the compared array from each profile row
+            source = f"""(SELECT pl.float_id, u.value::float8 AS {parameter}
+                FROM profile_levels pl CROSS JOIN LATERAL unnest(pl.{self.LEVEL_ARRAYS[parameter]}) AS u(value)
+                WHERE pl.float_id = ANY($2::int[]))"""
+        
+        sql = f"""
+        WITH ids AS (
+            SELECT float_id, ord FROM unnest($1::int[]) WITH ORDINALITY AS t(float_id, ord)
+        ),
+        stats AS (
+            SELECT 
+                m.float_id,
+                AVG(m.{parameter}) as avg_value,
+                MIN(m.{parameter}) as min_value,
+                MAX(m.{parameter}) as max_value,
+                COUNT(m.{parameter}) as measurement_count,
+                STDDEV_SAMP(m.{parameter}) as stddev_value,
+                percentile_cont(ARRAY[0.1, 0.5, 0.9]) WITHIN GROUP (ORDER BY m.{parameter}) as percentiles
+            FROM {source} m
+            WHERE m.float_id = ANY($2::int[]) AND m.{parameter} IS NOT NULL
+            GROUP BY m.float_id
+        )
+        SELECT 
+            ids.float_id, fm.platform_number, fm.pi_name, fm.operating_institute, fm.project_name,
+            s.avg_value, s.min_value, s.max_value, COALESCE(s.measurement_count, 0) as measurement_count,
+            s.stddev_value, s.percentiles
+        FROM ids
+        LEFT JOIN stats s ON s.float_id = ids.float_id
+        LEFT JOIN float_metadata fm ON fm.platform_number = ids.float_id
+        ORDER BY ids.ord
+        """
+        
         async with self.db_pool.acquire() as conn:
-            comparison_data = {}
-            
-            for float_id in float_ids:
-                stats_sql = f"""
-                SELECT 
-                    AVG({parameter}) as avg_value,
-                    MIN({parameter}) as min_value,
-                    MAX({parameter}) as max_value,
-                    COUNT({parameter}) as measurement_count
-                FROM measurements m
-                WHERE m.float_id = $1 AND m.{parameter} IS NOT NULL
-                """
-                stats_row = await conn.fetchrow(stats_sql, float_id)
-                
-                if stats_row:
-                    meta_sql = """
-                    SELECT platform_number, pi_name, operating_institute, project_name
-                    FROM float_metadata 
-                    WHERE platform_number = $1
-                    """
-                    meta_row = await conn.fetchrow(meta_sql, float_id)
-                    
-                    comparison_data[float_id] = {
-                        "metadata": dict(meta_row) if meta_row else {"platform_number": float_id},
-                        "statistics": dict(stats_row)
-                    }
+            rows = await conn.fetch(sql, ids, uncached, timeout=db_timeout())
+        
+        comparison_data = {}
+        for row in rows:
+            percentiles = row["percentiles"] or [None, None, None]
+            stats = cached.get(row["float_id"])
+            if stats is not None:
+                row = {**dict(row), "avg_value": stats["mean"], "min_value": stats["min"], "max_value": stats["max"],
+                       "measurement_count": stats["count"], "stddev_value": stats["stddev"]}
+                percentiles = stats["percentiles"]
+            metadata = {
+                "platform_number": row["platform_number"],
+                "pi_name": row["pi_name"],
+                "operating_institute": row["operating_institute"],
+                "project_name": row["project_name"]
+            } if row["platform_number"] is not None else {"platform_number": row["float_id"]}
             
-            return {
-                "parameter": parameter,
-                "comparison": comparison_data,
-                "float_count": len(comparison_data),
-                "float_ids": float_ids
+            comparison_data[row["float_id"]] = {
+                "metadata": metadata,
+                "statistics": {
+                    "avg_value": row["avg_value"],
+                    "min_value": row["min_value"],
+                    "max_value": row["max_value"],
+                    "measurement_count": row["measurement_count"],
+                    "stddev_value": row["stddev_value"],
+                    "p10_value": percentiles[0],
+                    "median_value": percentiles[1],
+                    "p90_value": percentiles[2]
+                }
             }
+        
+        return {
+            "parameter": parameter,
+            "comparison": comparison_data,
+            "float_count": len(comparison_data),
+            "float_ids": float_ids
+        }
+
+    @staticmethod
+    def _as_datetime(value: Any, end_of_day: bool = False) -> Optional[datetime]:
+        """date / datetime / ISO string -> naive datetime (a bare date used as an end bound covers that whole day)"""
+        if value is None or value == "":
+            return None
+        if isinstance(value, date) and not isinstance(value, datetime):
+            value = datetime.combine(value, datetime.min.time())
+            return value + timedelta(days=1) if end_of_day else value
+        text = str(value)
+        parsed = value if isinstance(value, datetime) else datetime.fromisoformat(text)
+        if parsed.tzinfo is not None:
+            # profile_date is stored as naive UTC
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed + timedelta(days=1) if end_of_day and len(text) == 10 else parsed
+
+    async def _temporal_buckets_sql(self, conn, float_id: int, parameter: str, bucket: str,
+                                    window_start: Optional[datetime], window_end: Optional[datetime],
+                                    depth_min: Optional[float], depth_max: Optional[float]) -> Tuple[List[Dict], Dict]:
+        """Per-bucket and overall statistics in one GROUPING SETS query"""
+        trunc = f"date_trunc('{bucket}', p.profile_date)"
+        sql = f"""
+        SELECT GROUPING({trunc}) = 1 AS is_total,
+               {trunc} AS bucket_start,
+               COUNT(*) AS count,
+               COUNT(DISTINCT m.cycle_number) AS profiles,
+               AVG(m.{parameter}) AS mean,
+               MIN(m.{parameter}) AS min,
+               MAX(m.{parameter}) AS max,
+               STDDEV_SAMP(m.{parameter}) AS stddev,
+               AVG(p.latitude) AS latitude,
+               AVG(p.longitude) AS longitude,
+               MIN(p.profile_date) AS first_date,
+               MAX(p.profile_date) AS last_date
+        FROM profiles p
+        JOIN measurements m ON m.float_id = p.float_id AND m.cycle_number = p.cycle_number
+        WHERE p.float_id = $1 AND m.float_id = $1
+        AND p.profile_date IS NOT NULL
+        AND m.{parameter} IS NOT NULL
+        """
+        params: List[Any] = [float_id]
+        for clause, value in ((" AND p.profile_date >= ${}", window_start), (" AND p.profile_date < ${}", window_end),
+                              (" AND m.pressure >= ${}", depth_min), (" AND m.pressure <= ${}", depth_max)):
+            if value is not None:
+                params.append(value)
+                sql += clause.format(len(params))
+        sql += f" GROUP BY GROUPING SETS (({trunc}), ()) ORDER BY is_total, bucket_start"
+        
+        rows = await conn.fetch(sql, *params, timeout=db_timeout())
+        buckets = [dict(r) for r in rows if not r['is_total']]
+        if not buckets:
+            return [], {}
+        total = next(dict(r) for r in rows if r['is_total'])
+        for item in buckets:
+            del item['is_total']
+        return buckets, total
 
     async def get_temporal_analysis(self, float_id: int, parameter: str, 
-                                  start_date: date, end_date: date) -> Dict:
-        """Perform temporal analysis on float data - returns raw data"""
+                                  start_date: Optional[Any] = None, end_date: Optional[Any] = None,
+                                  bucket: Optional[str] = None,
+                                  depth_min: Optional[float] = None, depth_max: Optional[float] = None) -> Dict:
+        """Perform temporal analysis on float data - per-bucket statistics computed in SQL
+        
+        Measurements are grouped into date_trunc(bucket) buckets (day / week / month; chosen from the
+        window length when omitted), optionally within a pressure band. Without start/end dates
+        the window is the float's own data range (float_summary). One GROUPING SETS query returns
+        the buckets and the overall statistics together, or they are computed from the hot-float
+        columns when the float is cached.
+        """
         if not self.db_pool:
             return {"error": "Database not connected"}
         
         if parameter not in ['temperature', 'salinity', 'pressure', 'depth_m']:
             return {"error": f"Invalid parameter: {parameter}"}
         
+        if bucket is not None and bucket not in TIME_BUCKETS:
+            return {"error": f"Invalid bucket: {bucket}. Use one of: {', '.join(TIME_BUCKETS)}"}
+        
+        try:
+            window_start = self._as_datetime(start_date)
+            window_end = self._as_datetime(end_date, end_of_day=True)
+        except ValueError:
+            return {"error": f"Invalid date range: {start_date} - {end_date} (use YYYY-MM-DD)"}
+        
+        columns = self.hot_floats.lookup(float_id)
+        
         async with self.db_pool.acquire() as conn:
-            sql = f"""
-            SELECT p.profile_date, m.{parameter}, p.latitude, p.longitude
-            FROM measurements m
-            LEFT JOIN profiles p ON m.float_id = p.float_id AND m.cycle_number = p.cycle_number
-            WHERE m.float_id = $1 
-            AND p.profile_date BETWEEN $2 AND $3
-            AND m.{parameter} IS NOT NULL
-            ORDER BY p.profile_date
-            """
             try:
-                rows = await conn.fetch(sql, float_id, start_date, end_date + timedelta(days=1))
-                data = [dict(row) for row in rows]
+                span = await conn.fetchrow(
+                    "SELECT first_profile_date, last_profile_date FROM float_summary WHERE float_id = $1",
+                    float_id, timeout=db_timeout())
+                if bucket is None:
+                    first = window_start or (span['first_profile_date'] if span else None)
+                    last = window_end or (span['last_profile_date'] if span else None)
+                    days = (last - first).days if first and last else 0
+                    bucket = "day" if days <= 120 else "week" if days <= 3 * 365 else "month"
                 
-                if not data:
-                    return {"error": f"No {parameter} data found for float {float_id} between {start_date} and {end_date}"}
-                
-                values = [item[parameter] for item in data if item.get(parameter) is not None]
-                dates = [item['profile_date'] for item in data if item.get('profile_date') is not None]
+                if columns is not None:
+                    buckets, total = columns.bucket_stats(parameter, bucket, window_start, window_end, depth_min, depth_max)
+                else:
+                    buckets, total = await self._temporal_buckets_sql(conn, float_id, parameter, bucket, window_start,
+                                                                      window_end, depth_min, depth_max)
                 
-                if not values:
-                    return {"error": f"No valid {parameter} values found"}
+                if not buckets:
+                    window = f"between {start_date} and {end_date}" if start_date or end_date else "in its data range"
+                    return {"error": f"No {parameter} data found for float {float_id} {window}"}
                 
                 meta_sql = """
                 SELECT platform_number, pi_name, operating_institute, project_name
                 FROM float_metadata 
                 WHERE platform_number = $1
                 """
-                meta_row = await conn.fetchrow(meta_sql, float_id)
+                meta_row = await conn.fetchrow(meta_sql, float_id, timeout=db_timeout())
                 
                 return {
                     "metadata": dict(meta_row) if meta_row else {"platform_number": float_id},
                     "parameter": parameter,
-                    "start_date": start_date,
-                    "end_date": end_date,
+                    "start_date": window_start or total['first_date'],
+                    "end_date": window_end or total['last_date'],
+                    "bucket": bucket,
+                    "depth_range": [depth_min, depth_max] if depth_min is not None or depth_max is not None else None,
                     "statistics": {
-                        "count": len(values),
-                        "mean": sum(values) / len(values),
-                        "min": min(values),
-                        "max": max(values),
-                        "date_range": [min(dates), max(dates)] if dates else None
+                        "count": total['count'],
+                        "profiles": total['profiles'],
+                        "mean": total['mean'],
+                        "min": total['min'],
+                        "max": total['max'],
+                        "stddev": total['stddev'],
+                        "date_range": [total['first_date'], total['last_date']]
                     },
-                    "data": data
+                    "buckets": buckets
                 }
             except Exception as e:
                 logger.error(f"Temporal analysis error: {e}")
                 return {"error": str(e)}
 
+    @staticmethod
+    def _merge_moments(count, total, total_sq, low, high) -> Dict[str, Any]:
+        """Mean / sample stddev / min / max from merged count, sum and sum of squares"""
+        count = int(count)
+        mean = total / count
+        variance = max(total_sq - count * mean * mean, 0.0) / (count - 1) if count > 1 else None
+        return {
+            "count": count,
+            "mean": float(mean),
+            "stddev": math.sqrt(variance) if variance is not None else None,
+            "min": float(low),
+            "max": float(high)
+        }
+
+    async def get_climatology(self, parameter: str = "temperature", region: Optional[str] = None,
+                              depth: Optional[float] = None, depth_min: Optional[float] = None,
+                              depth_max: Optional[float] = None, month: Optional[int] = None) -> Dict:
+        """Monthly climatology of a parameter in a region / pressure band, from climatology_cube
+        
+        The cube holds count / sum / sum of squares / min / max per (grid cell, pressure bin,
+        month), so this merges a few hundred pre-aggregated rows instead of scanning measurements.
+        Cells are assigned to the region by their centre (spatial.REGIONS); depth selects the
+        pressure bin containing it, depth_min / depth_max every bin overlapping the band.
+        """
+        if not self.db_pool:
+            return {"error": "Database not connected"}
+        
+        from argo_ingestion import CLIMATOLOGY_PARAMETERS
+        if parameter not in CLIMATOLOGY_PARAMETERS:
+            return {"error": f"Invalid parameter: {parameter}. Use one of: {', '.join(CLIMATOLOGY_PARAMETERS)}"}
+        area = spatial.REGIONS.get(region) if region else None
+        if region and area is None:
+            return {"error": f"Unknown region: {region}. Available: {', '.join(REGIONS.keys())}"}
+        if month is not None and not 1 <= int(month) <= 12:
+            return {"error": f"Invalid month: {month} (use 1-12)"}
+        if depth is not None:
+            depth_min = depth_max = float(depth)
+        
+        async with self.db_pool.acquire() as conn:
+            try:
+                grid = await conn.fetchrow("SELECT cell_deg, pressure_bin FROM climatology_state WHERE id",
+                                           timeout=db_timeout())
+                if not grid:
+                    return {"error": "Climatology cube has not been built yet; restart the backend to build it"}
+                cell_deg, bin_width = grid['cell_deg'], grid['pressure_bin']
+                
+                sql = """
+                SELECT cell_lat, cell_lon, month, MIN(pressure_bin) AS bin_low, MAX(pressure_bin) AS bin_high,
+                       SUM(value_count) AS n, SUM(value_sum) AS total, SUM(value_sum_sq) AS total_sq,
+                       MIN(value_min) AS low, MAX(value_max) AS high
+                FROM climatology_cube
+                WHERE parameter = $1
+                """
+                params: List[Any] = [parameter]
+                if depth_min is not None:
+                    params.append(float(depth_min) - bin_width)
+                    sql += f" AND pressure_bin > ${len(params)}"
+                if depth_max is not None:
+                    params.append(float(depth_max))
+                    sql += f" AND pressure_bin <= ${len(params)}"
+                if month is not None:
+                    params.append(int(month))
+                    sql += f" AND month = ${len(params)}"
+                if area is not None:
+                    # Bounding-box prefilter on latitude; longitude (and polygons) are checked below
+                    params.extend([area.bounds[0] - cell_deg, area.bounds[1]])
+                    sql += f" AND cell_lat >= ${len(params) - 1} AND cell_lat <= ${len(params)}"
+                sql += " GROUP BY cell_lat, cell_lon, month"
+                
+                rows = await conn.fetch(sql, *params, timeout=db_timeout())
+            except Exception as e:
+                logger.error(f"Climatology query failed: {e}")
+                return {"error": str(e)}
+        
+        if rows:
+            cells = np.array([(r['cell_lat'], r['cell_lon'], r['month'], r['bin_low'], r['bin_high'],
+                               r['n'], r['total'], r['total_sq'], r['low'], r['high']) for r in rows], dtype=np.float64)
+            if area is not None:
+                cells = cells[area.contains(cells[:, 0] + cell_deg / 2, cells[:, 1] + cell_deg / 2)]
+        if not rows or not len(cells):
+            where = f" in {region.replace('_', ' ')}" if region else ""
+            return {"error": f"No {parameter} climatology{where} for that depth/month selection"}
+        
+        months = cells[:, 2].astype(np.int64)
+        n = np.bincount(months, weights=cells[:, 5], minlength=13)
+        total = np.bincount(months, weights=cells[:, 6], minlength=13)
+        total_sq = np.bincount(months, weights=cells[:, 7], minlength=13)
+        low = np.full(13, np.inf)
+        high = np.full(13, -np.inf)
+        np.minimum.at(low, months, cells[:, 8])
+        np.maximum.at(high, months, cells[:, 9])
+        by_month = [
+            {"month": m, **self._merge_moments(n[m], total[m], total_sq[m], low[m], high[m])}
+            for m in range(1, 13) if n[m] > 0
+        ]
+        
+        return {
+            "parameter": parameter,
+            "region": region,
+            "pressure_range": [float(cells[:, 3].min()), float(cells[:, 4].max() + bin_width)],
+            "month": month,
+            "statistics": self._merge_moments(n.sum(), total.sum(), total_sq.sum(), low.min(), high.max()),
+            "by_month": by_month,
+            "cells": int(len(np.unique(cells[:, :2], axis=0))),
+            "grid": {"cell_deg": cell_deg, "pressure_bin": bin_width},
+            "source": "climatology_cube"
+        }
+
     async def get_depth_profile(self, float_id: int, cycle_number: Optional[int] = None, 
-                          parameter: str = "temperature") -> Dict:
-        """Get depth profile data for frontend plotting"""
+                          parameter: str = "temperature", max_points: Optional[int] = None,
+                          mode: Optional[str] = None, near_date: Optional[str] = None) -> Dict:
+        """Get depth profile data for frontend plotting (binned down to max_points levels)
+        
+        mode picks the profile(s): "latest" (default; newest cycle with data), "cycle" (cycle_number,
+        implied when it is given), "nearest_date" (closest to near_date) or "all" (the
+        PROFILE_MAX_SERIES most recent cycles, one series each). Cycles are chosen on profiles'
+        (float_id, cycle_number DESC) / (float_id, profile_date) indexes, then only their levels are read.
+        """
         if parameter not in ['temperature', 'salinity', 'pressure', 'depth_m']:
             return {"error": f"Invalid parameter: {parameter}"}
-
-        if cycle_number:
-            query_result = await self.query_measurements(float_id=float_id, cycle_range=(cycle_number, cycle_number), limit=1000)
+        
+        mode = mode or ("cycle" if cycle_number is not None else "latest")
+        if mode not in ("latest", "cycle", "nearest_date", "all"):
+            return {"error": f"Invalid mode: {mode}. Use latest, cycle, nearest_date or all"}
+        if mode == "cycle" and cycle_number is None:
+            return {"error": "mode 'cycle' needs a cycle_number"}
+        if mode == "nearest_date":
+            try:
+                target = datetime.fromisoformat(str(near_date)).replace(tzinfo=None)
+            except ValueError:
+                return {"error": f"mode 'nearest_date' needs near_date as YYYY-MM-DD (got {near_date})"}
+        
+        if not self.db_pool:
+            return {"error": "Database not connected"}
+        
+        columns = self.hot_floats.lookup(float_id)
+        if columns is not None:
+            return self._depth_profile_from_columns(columns, parameter, max_points, mode, cycle_number,
+                                                    target if mode == "nearest_date" else None)
+        
+        arrays = self.measurement_storage == "arrays"
+        # Cycles that actually have values for the parameter
+        if arrays:
+            has_data = f"""EXISTS (SELECT 1 FROM profile_levels pl WHERE pl.float_id = p.float_id
+                           AND pl.cycle_number = p.cycle_number AND pl.{self.LEVEL_ARRAYS[parameter]} IS NOT NULL)"""
         else:
-            query_result = await self.query_measurements(float_id=float_id, limit=1000)
-
-        if isinstance(query_result, dict) and "error" in query_result:
-            return query_result
+            has_data = f"""EXISTS (SELECT 1 FROM measurements m WHERE m.float_id = p.float_id
+                           AND m.cycle_number = p.cycle_number AND m.{parameter} IS NOT NULL)"""
+        select_profiles = "SELECT p.cycle_number, p.profile_date, p.latitude, p.longitude FROM profiles p"
         
-        measurements_data = query_result.get("data", [])
-
-        if not measurements_data:
+        async with self.db_pool.acquire() as conn:
+            try:
+                if mode == "latest":
+                    profiles = await conn.fetch(f"""
+                        {select_profiles} WHERE p.float_id = $1 AND {has_data}
+                        ORDER BY p.cycle_number DESC LIMIT 1
+                    """, float_id, timeout=db_timeout())
+                elif mode == "cycle":
+                    profiles = await conn.fetch(f"{select_profiles} WHERE p.float_id = $1 AND p.cycle_number = $2",
+                                                float_id, int(cycle_number), timeout=db_timeout())
+                elif mode == "nearest_date":
+                    # One index probe on each side of the target date
+                    candidates = await conn.fetch(f"""
+                        ({select_profiles} WHERE p.float_id = $1 AND p.profile_date <= $2 AND {has_data}
+                         ORDER BY p.profile_date DESC LIMIT 1)
+                        UNION ALL
+                        ({select_profiles} WHERE p.float_id = $1 AND p.profile_date > $2 AND {has_data}
+                         ORDER BY p.profile_date LIMIT 1)
+                    """, float_id, target, timeout=db_timeout())
+                    profiles = sorted(candidates, key=lambda r: abs((r['profile_date'] - target).total_seconds()))[:1]
+                else:
+                    profiles = await conn.fetch(f"""
+                        {select_profiles} WHERE p.float_id = $1 AND {has_data}
+                        ORDER BY p.cycle_number DESC LIMIT $2
+                    """, float_id, PROFILE_MAX_SERIES, timeout=db_timeout())
+                
+                if not profiles:
+                    where = f" cycle {cycle_number}" if mode == "cycle" else ""
+                    return {"error": f"No {parameter} profile found for float {float_id}{where}"}
+                
+                cycles = [p['cycle_number'] for p in profiles]
+                if arrays:
+                    # One array row per chosen profile (primary key lookup)
+                    array_rows = await conn.fetch("""
+                        SELECT cycle_number, n_level, pressure, temperature, salinity FROM profile_levels
+                        WHERE float_id = $1 AND cycle_number = ANY($2::int[])
+                        ORDER BY cycle_number DESC
+                    """, float_id, cycles, timeout=db_timeout())
+                    rows = [level for r in array_rows for level in self._expand_profile_levels(r)
+                            if level[parameter] is not None]
+                else:
+                    # Measurements only for the chosen cycles (unique index on float_id, cycle_number, n_level)
+                    rows = await conn.fetch(f"""
+                        SELECT cycle_number, pressure, {parameter} FROM measurements
+                        WHERE float_id = $1 AND cycle_number = ANY($2::int[]) AND {parameter} IS NOT NULL
+                        ORDER BY cycle_number DESC, n_level
+                    """, float_id, cycles, timeout=db_timeout())
+            except Exception as e:
+                logger.error(f"Depth profile query failed for float {float_id}: {e}")
+                return {"error": str(e)}
+        
+        if not rows:
             return {"error": f"No measurement data found for float {float_id}"}
+        
+        by_cycle: Dict[int, List[Dict]] = defaultdict(list)
+        for row in rows:
+            by_cycle[row['cycle_number']].append(dict(row))
+        
+        series = []
+        for profile in profiles:
+            levels = by_cycle.get(profile['cycle_number'])
+            if not levels:
+                continue
+            series.append({
+                "cycle_number": profile['cycle_number'],
+                "profile_date": profile['profile_date'],
+                "latitude": profile['latitude'],
+                "longitude": profile['longitude'],
+                "plot_data": self.data_formatter.format_depth_profile_data(levels, parameter, float_id, max_points)
+            })
+        
+        primary = series[0]
+        result = {
+            "float_id": float_id,
+            "cycle_number": primary["cycle_number"],
+            "profile_date": primary["profile_date"],
+            "mode": mode,
+            "parameter": parameter,
+            "data_points": len(rows),
+            "plot_data": primary["plot_data"]
+        }
+        if mode == "all":
+            result["series"] = series
+        return result
 
-        formatted_data = self.data_formatter.format_depth_profile_data(measurements_data, parameter, float_id)
-
-        return {
+    def _depth_profile_from_columns(self, columns: float_columns.FloatColumns, parameter: str,
+                                    max_points: Optional[int], mode: str, cycle_number: Optional[int],
+                                    target: Optional[datetime]) -> Dict:
+        """get_depth_profile from hot-float columns: same profile choice as the SQL path, no per-level dicts"""
+        float_id = columns.float_id
+        with_data = columns.profiles_with(parameter)  # ascending cycle order
+        if mode == "latest":
+            chosen = with_data[-1:]
+        elif mode == "cycle":
+            chosen = with_data[columns.profile_cycle[with_data] == int(cycle_number)]
+        elif mode == "nearest_date":
+            dated = with_data[~np.isnat(columns.profile_date[with_data])]
+            gaps = np.abs(columns.profile_date[dated] - np.datetime64(target, "us"))
+            chosen = dated[[int(np.argmin(gaps))]] if len(dated) else dated
+        else:
+            chosen = with_data[::-1][:PROFILE_MAX_SERIES]
+        
+        if not len(chosen):
+            where = f" cycle {cycle_number}" if mode == "cycle" else ""
+            return {"error": f"No {parameter} profile found for float {float_id}{where}"}
+        
+        series = []
+        data_points = 0
+        for position in chosen.tolist():
+            pressure, values = columns.profile_levels(position, parameter)
+            data_points += len(values)
+            latitude, longitude = columns.profile_lat[position], columns.profile_lon[position]
+            series.append({
+                "cycle_number": int(columns.profile_cycle[position]),
+                "profile_date": columns.profile_date[position].astype(datetime),
+                "latitude": None if np.isnan(latitude) else float(latitude),
+                "longitude": None if np.isnan(longitude) else float(longitude),
+                "plot_data": self.data_formatter.format_depth_profile_arrays(pressure, values, parameter, float_id, max_points)
+            })
+        
+        primary = series[0]
+        result = {
             "float_id": float_id,
-            "cycle_number": cycle_number,
+            "cycle_number": primary["cycle_number"],
+            "profile_date": primary["profile_date"],
+            "mode": mode,
             "parameter": parameter,
-            "data_points": len(measurements_data),
-            "plot_data": formatted_data
+            "data_points": data_points,
+            "plot_data": primary["plot_data"]
         }
+        if mode == "all":
+            result["series"] = series
+        return result
 
     async def get_trajectory(self, float_id: int) -> Dict:
         """Get trajectory data for frontend mapping - FIXED"""
@@ -2360,27 +5179,38 @@ class OptimizedArgoMCPServer:
             logger.error(f"Error in get_trajectory: {str(e)}", exc_info=True)
             return {"error": f"Failed to get trajectory: {str(e)}"}
 
-    async def get_timeseries(self, float_id: int, parameter: str = "temperature") -> Dict:
-        """Get time series data for frontend plotting"""
+    async def get_timeseries(self, float_id: int, parameter: str = "temperature", max_points: Optional[int] = None,
+                             start_date: Optional[str] = None, end_date: Optional[str] = None,
+                             bucket: Optional[str] = None,
+                             depth_min: Optional[float] = None, depth_max: Optional[float] = None) -> Dict:
+        """Get time series data for frontend plotting
+        
+        One point per time bucket (mean, with min/max) from get_temporal_analysis; the window
+        defaults to the float's own data range. LTTB-reduced to max_points if still too long.
+        """
         if parameter not in ['temperature', 'salinity', 'pressure', 'depth_m']:
             return {"error": f"Invalid parameter: {parameter}"}
         
-        end_date = date.today()
-        start_date = end_date - timedelta(days=365)
-        
-        data = await self.get_temporal_analysis(float_id, parameter, start_date, end_date)
+        data = await self.get_temporal_analysis(float_id, parameter, start_date, end_date, bucket, depth_min, depth_max)
         if isinstance(data, dict) and data.get("error"):
             return data
         
-        ts_data = data.get("data", [])
-        formatted_data = self.data_formatter.format_timeseries_data(ts_data, parameter, float_id)
+        buckets = data.get("buckets", [])
+        ts_data = [
+            {"profile_date": b["bucket_start"], parameter: b["mean"],
+             f"{parameter}_min": b["min"], f"{parameter}_max": b["max"]}
+            for b in buckets
+        ]
+        formatted_data = self.data_formatter.format_timeseries_data(ts_data, parameter, float_id, max_points)
         
         return {
             "float_id": float_id,
             "parameter": parameter,
+            "bucket": data["bucket"],
             "data_points": len(ts_data),
+            "statistics": data["statistics"],
             "timeseries_data": formatted_data,
-            "date_range": [start_date, end_date]
+            "date_range": [data["start_date"], data["end_date"]]
         }
 
     async def get_region_data(self, region: str) -> Dict:
@@ -2397,44 +5227,80 @@ class OptimizedArgoMCPServer:
             "region_data": formatted_data
         }
 
-    async def list_all_floats(self, limit: int = 10, offset: int = 0) -> Dict:
-        """List all available floats with visualization data"""
+    async def list_all_floats(self, limit: int = 10, offset: int = 0, page_token: Optional[str] = None) -> Dict:
+        """List all available floats with visualization data
+        
+        Most recent first. page_token (from next_page_token) continues after the last float of the
+        previous page on the sort key (last_profile_date, platform_number); offset is kept for
+        old clients but costs a scan of every skipped row.
+        """
         if not self.db_pool:
             return {"error": "Database not connected"}
         
+        after = None
+        if page_token:
+            try:
+                after = decode_page_token(page_token, "floats", {})
+            except InvalidPageToken as e:
+                return {"error": str(e)}
+        page_size = clamp_page_size(limit, 10)
+        
         async with self.db_pool.acquire() as conn:
             try:
-                total_count = await conn.fetchval("SELECT COUNT(*) FROM float_metadata")
+                total_count = await conn.fetchval("SELECT COUNT(*) FROM float_metadata", timeout=db_timeout())
                 
-                sql = """
-                SELECT platform_number, float_serial_number, launch_date, 
-                       launch_latitude, launch_longitude, 
-                       operating_institute, project_name,
-                       (SELECT profile_date 
-                        FROM profiles p 
-                        WHERE p.float_id = float_metadata.platform_number 
-                        ORDER BY profile_date DESC LIMIT 1) as last_profile_date
-                FROM float_metadata 
-                ORDER BY 
-                    CASE WHEN (
-                        SELECT profile_date 
-                        FROM profiles p 
-                        WHERE p.float_id = float_metadata.platform_number 
-                        ORDER BY profile_date DESC LIMIT 1
-                    ) IS NOT NULL THEN 0 ELSE 1 END,
-                    last_profile_date DESC NULLS LAST,
-                    platform_number
-                LIMIT $1 OFFSET $2
+                # float_summary is maintained by ingestion; ordering walks float_summary_recent_idx
+                select = """
+                SELECT fm.platform_number, fm.float_serial_number, fm.launch_date, 
+                       fm.launch_latitude, fm.launch_longitude, 
+                       fm.operating_institute, fm.project_name,
+                       fs.last_profile_date, fs.last_latitude, fs.last_longitude, fs.cycle_count,
+                       COALESCE(fs.last_profile_date >= NOW() - INTERVAL '30 days', FALSE) as is_active
+                FROM float_summary fs
+                JOIN float_metadata fm ON fm.platform_number = fs.float_id
                 """
+                order = " ORDER BY last_profile_date DESC NULLS LAST, platform_number"
+                if after:
+                    # Keyset on (last_profile_date DESC NULLS LAST, float_id). Each branch is a plain range
+                    # on float_summary_recent_idx capped at one page, so deep pages cost the same as the first:
+                    # the rest of the current date, older dates, then floats without profiles
+                    last_date = after[0]
+                    if last_date is None:
+                        sql = select + " WHERE fs.last_profile_date IS NULL AND fs.float_id > $1 ORDER BY fs.float_id"
+                        params = [after[1]]
+                    else:
+                        sql = f"""
+                        ({select} WHERE fs.last_profile_date = $1 AND fs.float_id > $2
+                         ORDER BY fs.float_id LIMIT $3)
+                        UNION ALL
+                        ({select} WHERE fs.last_profile_date < $1
+                         ORDER BY fs.last_profile_date DESC NULLS LAST, fs.float_id LIMIT $3)
+                        UNION ALL
+                        ({select} WHERE fs.last_profile_date IS NULL
+                         ORDER BY fs.float_id LIMIT $3)
+                        {order}
+                        """
+                        params = [last_date, after[1], page_size + 1]
+                else:
+                    sql = select + " ORDER BY fs.last_profile_date DESC NULLS LAST, fs.float_id OFFSET $1"
+                    params = [max(0, offset)]
                 
-                rows = await conn.fetch(sql, limit, offset)
+                rows, has_more = await fetch_page(conn, sql, params, page_size)
                 floats = [dict(r) for r in rows]
+                next_token = None
+                if has_more:
+                    last = floats[-1]
+                    next_token = encode_page_token("floats", {}, [
+                        last["last_profile_date"].isoformat() if last.get("last_profile_date") else None,
+                        last["platform_number"]
+                    ])
                 
                 result = {
                     "floats": floats,
                     "total_count": total_count,
                     "returned_count": len(floats),
-                    "has_more": (offset + limit) < total_count,
+                    "has_more": has_more,
+                    "next_page_token": next_token,
                     "viz": {
                         "kind": "float_list",
                         "spec": {
@@ -2468,54 +5334,35 @@ class OptimizedArgoMCPServer:
             
         async with self.db_pool.acquire() as conn:
             try:
-                float_ids_in_region = None
                 if region:
                     if region not in REGIONS:
                         return {"error": f"Invalid region: {region}. Valid regions: {list(REGIONS.keys())}"}
-                    
-                    lat_min, lat_max, lon_min, lon_max = REGIONS[region]
-                    
-                    region_float_ids_sql = """
-                        SELECT DISTINCT float_id FROM profiles 
-                        WHERE latitude BETWEEN $1 AND $2 AND longitude BETWEEN $3 AND $4
-                    """
-                    rows = await conn.fetch(region_float_ids_sql, lat_min, lat_max, lon_min, lon_max)
-                    float_ids_in_region = [r['float_id'] for r in rows]
-
-                    if not float_ids_in_region:
-                        return {
-                            "total_floats": 0, "active_floats": 0, "by_institution": [], "by_project": [], "region": region,
-                            "viz": {"kind": "summary", "spec": {"total": 0, "active": 0, "institutions": 0, "projects": 0}}
-                        }
 
                 total_count_query = "SELECT COUNT(DISTINCT platform_number) FROM float_metadata"
                 inst_counts_query = "SELECT operating_institute, COUNT(*) as count FROM float_metadata"
                 proj_counts_query = "SELECT project_name, COUNT(*) as count FROM float_metadata"
-                active_count_query = "SELECT COUNT(DISTINCT float_id) FROM profiles WHERE profile_date >= NOW() - INTERVAL '30 days'"
+                active_count_query = "SELECT COUNT(*) FROM float_summary WHERE last_profile_date >= NOW() - INTERVAL '30 days'"
 
                 meta_params = []
-                if float_ids_in_region is not None:
-                    placeholders = ','.join(f'${i+1}' for i in range(len(float_ids_in_region)))
-                    meta_where_clause = f" WHERE platform_number IN ({placeholders})"
+                active_params = []
+                if region:
+                    # Semi-join against float_region: one bind parameter however many floats match
+                    meta_where_clause = " WHERE platform_number IN (SELECT float_id FROM float_region WHERE region = $1)"
                     total_count_query += meta_where_clause
                     inst_counts_query += meta_where_clause
                     proj_counts_query += meta_where_clause
-                    meta_params = float_ids_in_region
+                    meta_params = [region]
+                    active_count_query += " AND float_id IN (SELECT float_id FROM float_region WHERE region = $1)"
+                    active_params = [region]
                 
                 inst_counts_query += " GROUP BY operating_institute ORDER BY count DESC"
                 proj_counts_query += " GROUP BY project_name ORDER BY count DESC"
 
-                total_count = await conn.fetchval(total_count_query, *meta_params)
-                inst_counts = await conn.fetch(inst_counts_query, *meta_params)
-                proj_counts = await conn.fetch(proj_counts_query, *meta_params)
+                total_count = await conn.fetchval(total_count_query, *meta_params, timeout=db_timeout())
+                inst_counts = await conn.fetch(inst_counts_query, *meta_params, timeout=db_timeout())
+                proj_counts = await conn.fetch(proj_counts_query, *meta_params, timeout=db_timeout())
 
-                active_params = []
-                if float_ids_in_region is not None:
-                    placeholders = ','.join(f'${i+1}' for i in range(len(float_ids_in_region)))
-                    active_count_query += f" AND float_id IN ({placeholders})"
-                    active_params = float_ids_in_region
-                
-                active_count = await conn.fetchval(active_count_query, *active_params)
+                active_count = await conn.fetchval(active_count_query, *active_params, timeout=db_timeout())
 
                 result = {
                     "total_floats": total_count or 0,
@@ -2547,52 +5394,123 @@ class OptimizedArgoMCPServer:
                 logger.error(f"Error counting floats: {str(e)}", exc_info=True)
                 return {"error": f"Failed to count floats: {str(e)}"}
 
-    async def search_floats_by_location(self, latitude: float, longitude: float, radius: float = 5.0) -> Dict:
-        """Search for floats near a specific latitude/longitude within a radius (in degrees)"""
+    async def search_floats_by_location(self, latitude: float, longitude: float, radius: float = 5.0,
+                                        k: Optional[int] = None, latest_only: bool = False) -> Dict:
+        """Search for floats near a specific latitude/longitude within a radius (in degrees)
+        
+        With k, the k nearest floats are returned whatever their distance (radius is ignored).
+        With latest_only, each float's last known position is used instead of all its profiles.
+        Served from the in-memory position index (great-circle distances) when it is ready;
+        otherwise from SQL (a grid-cell scan over the ±radius box for profile positions).
+        """
         if not self.db_pool:
             return {"error": "Database not connected"}
+        
+        if isinstance(latest_only, str):
+            latest_only = latest_only.strip().lower() in ("1", "true", "yes")
+        limit = max(1, int(k)) if k is not None else 10
+        
+        if self.position_index.usable:
+            return await self._search_floats_indexed(latitude, longitude, radius, k, latest_only, limit)
             
         try:
             async with self.db_pool.acquire() as conn:
-                query = """
-                    SELECT DISTINCT f.*, 
-                           2 * 6371 * asin(sqrt(
+                # Each float is reported at its nearest profile (or its last position with latest_only);
+                # haversine is only computed for the candidate rows
+                distance = """2 * 6371 * asin(sqrt(
                                sin(radians($1 - p.latitude)/2)^2 + 
                                cos(radians(p.latitude)) * cos(radians($1)) * 
                                sin(radians($2 - p.longitude)/2)^2
-                           )) as distance_km
-                    FROM float_metadata f
-                    JOIN profiles p ON f.platform_number = p.float_id
-                    WHERE ABS(p.latitude - $1) <= $3 
-                    AND ABS(p.longitude - $2) <= $3
-                    ORDER BY distance_km ASC
-                    LIMIT 10;
+                           ))"""
+                params: List[Any] = [latitude, longitude]
+                having = ""
+                if latest_only:
+                    source = """(SELECT float_id, last_latitude AS latitude, last_longitude AS longitude FROM float_summary
+                                 WHERE last_latitude IS NOT NULL AND last_longitude IS NOT NULL) p"""
+                    if k is None:
+                        having = f"HAVING MIN({distance}) <= $3"
+                        params.append(radius * FloatPositionIndex.KM_PER_DEGREE)
+                elif k is None:
+                    # Candidates come from the grid cells covering the ±radius box (wrapping the antimeridian)
+                    cell_join, box_params = spatial.box_filter(*spatial.radius_box(latitude, longitude, radius),
+                                                               alias="p", first_param=3)
+                    source = f"profiles p {cell_join}"
+                    params.extend(box_params)
+                else:
+                    source = "profiles p"
+                query = f"""
+                    SELECT f.*, nearest.distance_km
+                    FROM (
+                        SELECT p.float_id, MIN({distance}) as distance_km
+                        FROM {source}
+                        GROUP BY p.float_id
+                        {having}
+                    ) nearest
+                    JOIN float_metadata f ON f.platform_number = nearest.float_id
+                    ORDER BY nearest.distance_km ASC
+                    LIMIT {limit};
                 """
                 
-                rows = await conn.fetch(query, latitude, longitude, radius)
+                rows = await conn.fetch(query, *params, timeout=db_timeout())
                 floats = []
                 
                 for row in rows:
                     float_data = dict(row)
-                    distance = float_data.pop('distance_km', None)
+                    distance_km = float_data.pop('distance_km', None)
                     floats.append({
                         "float_data": float_data,
-                        "distance_km": distance
+                        "distance_km": distance_km
                     })
                 
-                return {
-                    "success": True,
-                    "type": "location_search",
-                    "center": {"latitude": latitude, "longitude": longitude},
-                    "radius_degrees": radius,
-                    "floats_found": len(floats),
-                    "floats": floats
-                }
+                return self._location_search_result(latitude, longitude, radius, k, latest_only, floats)
                 
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.error(f"Location search failed: {str(e)}", exc_info=True)
             return {"error": f"Failed to search floats by location: {str(e)}"}
 
+    def _location_search_result(self, latitude: float, longitude: float, radius: float, k: Optional[int],
+                                latest_only: bool, floats: List[Dict[str, Any]]) -> Dict:
+        return {
+            "success": True,
+            "type": "location_search",
+            "center": {"latitude": latitude, "longitude": longitude},
+            "radius_degrees": None if k is not None else radius,
+            "k": k,
+            "position": "last_known" if latest_only else "any_profile",
+            "floats_found": len(floats),
+            "floats": floats
+        }
+
+    async def _search_floats_indexed(self, latitude: float, longitude: float, radius: float,
+                                     k: Optional[int], latest_only: bool, limit: int) -> Dict:
+        """search_floats_by_location via the KD-tree; the DB is only asked for metadata of the hits"""
+        try:
+            if k is not None:
+                hits = self.position_index.nearest(latitude, longitude, limit * 3, use_last_position=latest_only)
+            else:
+                hits = self.position_index.within(latitude, longitude, radius * FloatPositionIndex.KM_PER_DEGREE,
+                                                  use_last_position=latest_only)
+            # Hits without a float_metadata row are skipped, as with the SQL join
+            candidates = hits[:limit * 3]
+            async with self.db_pool.acquire() as conn:
+                rows = await conn.fetch("SELECT * FROM float_metadata WHERE platform_number = ANY($1::int[])",
+                                        [fid for fid, _ in candidates], timeout=db_timeout())
+            metadata = {row["platform_number"]: dict(row) for row in rows}
+            floats = [
+                {"float_data": metadata[fid], "distance_km": round(km, 3)}
+                for fid, km in candidates if fid in metadata
+            ][:limit]
+            
+            return {**self._location_search_result(latitude, longitude, radius, k, latest_only, floats),
+                    "index": "kd_tree"}
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            logger.error(f"Indexed location search failed: {str(e)}", exc_info=True)
+            return {"error": f"Failed to search floats by location: {str(e)}"}
+    
     # ==================== UTILITY METHODS ====================
     def get_tool_list(self) -> List[str]:
         """Get list of available MCP tools"""
@@ -2602,7 +5520,7 @@ class OptimizedArgoMCPServer:
             "get_floats_in_region", "compare_floats", "get_temporal_analysis",
             "get_depth_profile", "get_trajectory", "get_timeseries", "get_multiple_trajectories",
             "get_region_data", "list_all_floats", "count_floats",
-            "search_floats_by_location"
+            "search_floats_by_location", "get_climatology"
         ]
     
     async def set_database_pool(self, pool):
@@ -2612,11 +5530,13 @@ class OptimizedArgoMCPServer:
         self.collection = collection
     
     async def set_gemini_model(self, model):
+        """Accepts any model exposing generate_content (Gemini or DeterministicLLMStub)"""
         self.gemini_model = model
+        self.llm = LLMGateway(model)
     
-    async def set_supabase(self, supabase):
+    async def set_supabase(self, supabase, rpc_client: Optional[SupabaseRPCClient] = None):
         self.supabase = supabase
-        self.sql_generator = SQLGenerationSystem(self.gemini_model, supabase, self.db_pool)
+        self.sql_generator = SQLGenerationSystem(self.llm, supabase, self.db_pool, rpc_client)
 
 # ==================== FASTAPI APPLICATION ====================
 
@@ -2662,25 +5582,70 @@ async def create_tables(conn):
     )
     """)
     
+    # Single heap, or hash-partitioned by float_id when MEASUREMENTS_PARTITIONS > 0 (new databases;
+    # existing ones are converted with migrate_measurements.py)
+    # (or, with MEASUREMENTS_STORAGE=arrays, profile_levels plus a measurements view)
+    from argo_ingestion import (create_measurements_table, measurements_is_partitioned,
+                                measurements_storage, create_profile_levels)
+    partitioned = await measurements_is_partitioned(conn)
+    if partitioned is None and MEASUREMENTS_STORAGE == "arrays":
+        await create_profile_levels(conn)
+    elif partitioned is None:
+        await create_measurements_table(conn, "measurements", MEASUREMENTS_PARTITIONS)
+    elif await measurements_storage(conn) == "arrays":
+        await create_profile_levels(conn)
+    elif not partitioned:
+        await create_measurements_table(conn, "measurements", 0)
+        if MEASUREMENTS_PARTITIONS > 0:
+            logger.warning("measurements is not partitioned; run migrate_measurements.py to convert it")
+    if MEASUREMENTS_STORAGE == "arrays" and await measurements_storage(conn) != "arrays":
+        logger.warning("measurements uses row storage; run migrate_measurements.py --arrays to convert it")
+    await conn.execute("CREATE INDEX IF NOT EXISTS profiles_float_id_idx ON profiles(float_id);")
+    await conn.execute("CREATE INDEX IF NOT EXISTS profiles_cycle_idx ON profiles(cycle_number);")
+    
+    # 1° grid cell, computed by Postgres on every insert (see spatial.py); covering index for box scans
+    await conn.execute(f"""
+    ALTER TABLE profiles ADD COLUMN IF NOT EXISTS grid_cell INTEGER
+    GENERATED ALWAYS AS {spatial.GRID_CELL_SQL} STORED
+    """)
     await conn.execute("""
-    CREATE TABLE IF NOT EXISTS measurements (
-        id SERIAL PRIMARY KEY,
-        float_id INTEGER NOT NULL,
-        cycle_number INTEGER NOT NULL,
-        n_level INTEGER NOT NULL,
-        pressure DOUBLE PRECISION,
-        depth_m DOUBLE PRECISION,
-        temperature DOUBLE PRECISION,
-        salinity DOUBLE PRECISION,
-        created_at TIMESTAMP DEFAULT NOW(),
-        UNIQUE (float_id, cycle_number, n_level)
-    )
+    CREATE INDEX IF NOT EXISTS profiles_grid_cell_idx
+    ON profiles (grid_cell, float_id, latitude, longitude)
     """)
     
-    await conn.execute("CREATE INDEX IF NOT EXISTS measurements_float_id_idx ON measurements(float_id);")
-    await conn.execute("CREATE INDEX IF NOT EXISTS measurements_cycle_idx ON measurements(cycle_number);")
-    await conn.execute("CREATE INDEX IF NOT EXISTS profiles_float_id_idx ON profiles(float_id);")
-    await conn.execute("CREATE INDEX IF NOT EXISTS profiles_cycle_idx ON profiles(cycle_number);")
+    # Profile selection for get_depth_profile: newest cycles first, and nearest-date probes
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS profiles_float_cycle_desc_idx
+    ON profiles (float_id, cycle_number DESC) INCLUDE (profile_date, latitude, longitude)
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS profiles_float_date_idx ON profiles (float_id, profile_date)")
+    
+    # Per-float summary (last profile, last position, cycle count), kept current by ingestion
+    from argo_ingestion import ensure_float_summary, refresh_float_summary
+    await ensure_float_summary(conn)
+    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM float_summary)"):
+        await refresh_float_summary(conn)
+    
+    # Shared data versions (cache invalidation across workers and ingesters)
+    await data_versions.ensure_table(conn)
+    rebuilt = False
+    
+    # Region membership (spatial.REGIONS): only new or changed regions are rebuilt
+    from argo_ingestion import ensure_float_region, sync_float_regions
+    await ensure_float_region(conn)
+    if await sync_float_regions(conn):
+        rebuilt = True
+    
+    # Climatology cube (get_climatology), rebuilt when never built or when the grid settings changed
+    from argo_ingestion import ensure_climatology, climatology_grid, refresh_climatology
+    await ensure_climatology(conn)
+    if await climatology_grid(conn) != (CLIMATOLOGY_CELL_DEG, CLIMATOLOGY_PRESSURE_BIN):
+        await refresh_climatology(conn, None, CLIMATOLOGY_CELL_DEG, CLIMATOLOGY_PRESSURE_BIN)
+        rebuilt = True
+    
+    # Other workers may hold results computed from the old membership / cube
+    if rebuilt:
+        await data_versions.record_change(conn)
     
     logger.info("Database tables and indexes checked/created successfully.")
 
@@ -2702,8 +5667,12 @@ async def lifespan(app: FastAPI):
         logger.error(f"Database connection failed: {e}")
         app.state.pool = None
 
-    genai.configure(api_key=GEMINI_API_KEY)
-    app.state.gemini_model = genai.GenerativeModel("gemini-2.5-flash")
+    if LLM_BACKEND == "stub":
+        logger.info("Using deterministic offline LLM stub")
+        app.state.gemini_model = DeterministicLLMStub()
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
+        app.state.gemini_model = genai.GenerativeModel("gemini-2.5-flash")
     await mcp_server.set_gemini_model(app.state.gemini_model)
 
     ef = embedding_functions.SentenceTransformerEmbeddingFunction(
@@ -2716,18 +5685,33 @@ async def lifespan(app: FastAPI):
     await mcp_server.set_collection(app.state.collection)
 
     app.state.supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    await mcp_server.set_supabase(app.state.supabase)
+    app.state.supabase_rpc = SupabaseRPCClient(SUPABASE_URL, SUPABASE_KEY)
+    await mcp_server.set_supabase(app.state.supabase, app.state.supabase_rpc)
 
     if app.state.pool:
         async with app.state.pool.acquire() as conn:
             await create_tables(conn)
+            from argo_ingestion import measurements_storage
+            mcp_server.measurement_storage = await measurements_storage(conn)
+            logger.info(f"Measurement storage: {mcp_server.measurement_storage}")
+            await data_versions.sync(conn, notify=False)
+        app.state.version_follower = asyncio.create_task(data_versions.follow(DATABASE_URL))
+        mcp_server.position_index.start(app.state.pool)
+        mcp_server.hot_floats.start(app.state.pool, mcp_server.measurement_storage)
 
     yield
     
     logger.info("Shutting down ARGO AI Optimized System...")
+    if getattr(app.state, 'version_follower', None):
+        app.state.version_follower.cancel()
+    mcp_server.hot_floats.stop()
     if hasattr(app.state, 'pool') and app.state.pool:
         await app.state.pool.close()
         logger.info("Database pool closed successfully")
+    if mcp_server.llm:
+        mcp_server.llm.shutdown()
+    if getattr(app.state, 'supabase_rpc', None):
+        await app.state.supabase_rpc.aclose()
 
 app = FastAPI(
     title="ARGO AI Optimized System - AI-First 3-Layer Approach",
@@ -2781,6 +5765,23 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime performance counters"""
+    return {
+        "llm": mcp_server.llm.get_stats() if mcp_server.llm else None,
+        "prefetch": {"enabled": mcp_server.speculative_prefetch, **mcp_server.prefetch_stats.snapshot()},
+        "singleflight": {
+            "enabled": mcp_server.singleflight,
+            "queries": mcp_server.query_flight.get_stats(),
+            "tools": mcp_server.tool_flight.get_stats()
+        },
+        "tool_cache": mcp_server.tool_cache.get_stats(),
+        "sql": mcp_server.sql_generator.get_stats() if mcp_server.sql_generator else None,
+        "position_index": mcp_server.position_index.get_stats(),
+        "hot_floats": mcp_server.hot_floats.get_stats()
+    }
+
 @app.post("/query")
 async def process_query(payload: Dict[str, Any]):
     """Main query endpoint using optimized AI-first approach"""
@@ -2818,6 +5819,65 @@ async def process_query(payload: Dict[str, Any]):
             "error": "System error occurred"
         }
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Encode one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/query/stream")
+async def process_query_stream(payload: Dict[str, Any]):
+    """
+    Streaming variant of /query using Server-Sent Events
+    
+    Events (in order): "routing", "plan" (Layer 2 only), "tool_result" (one per tool as it completes),
+    "token" (synthesized text chunks), then a final "done" carrying the same body /query returns.
+    """
+    query = payload.get("query", "").strip()
+    session_id = payload.get("session_id", str(uuid.uuid4()))
+    
+    if not query:
+        raise HTTPException(status_code=400, detail="Query text required")
+    
+    logger.info(f"Streaming query: {query} (session: {session_id})")
+    
+    async def event_stream():
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def emit(event: str, data: Dict[str, Any]):
+            await queue.put(_sse_event(event, data))
+        
+        async def run_pipeline():
+            try:
+                raw_result = await mcp_server.process_query_optimized(query, session_id, emit=emit)
+                standardized_response = mcp_server.standardize_response(raw_result)
+                standardized_response["session_id"] = session_id
+                standardized_response["query"] = query
+                standardized_response["raw_result"] = raw_result
+                await queue.put(_sse_event("done", standardized_response))
+            except Exception as e:
+                logger.error(f"Streaming query processing failed: {e}")
+                await queue.put(_sse_event("error", {"error": "System error occurred", "detail": str(e), "session_id": session_id}))
+            finally:
+                await queue.put(None)
+        
+        task = asyncio.create_task(run_pipeline())
+        try:
+            yield _sse_event("accepted", {"session_id": session_id, "query": query})
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            # Client went away before the pipeline finished
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/session/{session_id}/history")
 async def get_session_history(session_id: str):
     """Get conversation history for a session"""
@@ -2838,27 +5898,31 @@ async def clear_session(session_id: str):
 
 # Additional endpoints for direct access
 @app.get("/floats")
-async def list_floats(limit: int = 100, offset: int = 0):
-    """List all available floats"""
-    result = await mcp_server.list_all_floats(limit, offset)
+async def list_floats(limit: int = 100, offset: int = 0, page_token: Optional[str] = None):
+    """List all available floats (pass next_page_token back as page_token for the next page)"""
+    params = {"limit": limit, "page_token": page_token} if page_token else {"limit": limit, "offset": offset}
+    result = await mcp_server.execute_tool("list_all_floats", params)
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or "Failed to list floats; check server logs for details"
         raise HTTPException(status_code=404, detail=detail)
     return result
 
 @app.get("/float/{float_id}")
-async def get_float_details(float_id: int):
-    """Get detailed information about a specific float"""
-    result = await mcp_server.get_float_profile(float_id)
+async def get_float_details(float_id: int, cycle_number: Optional[int] = None,
+                            limit: Optional[int] = None, page_token: Optional[str] = None):
+    """Get detailed information about a specific float (measurements paged via next_page_token)"""
+    result = await mcp_server.execute_tool("get_float_profile", {
+        "float_id": float_id, "cycle_number": cycle_number, "limit": limit, "page_token": page_token
+    })
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or f"Float {float_id} could not be retrieved; check server logs"
         raise HTTPException(status_code=404, detail=detail)
     return result
 
 @app.get("/data/depth_profile/{float_id}")
-async def get_depth_profile_data(float_id: int, parameter: str = "temperature"):
-    """Get depth profile data for frontend plotting"""
-    result = await mcp_server.get_depth_profile(float_id, None, parameter)
+async def get_depth_profile_data(float_id: int, parameter: str = "temperature", max_points: Optional[int] = None):
+    """Get depth profile data for frontend plotting (max_points=0 returns every level)"""
+    result = await mcp_server.execute_tool("get_depth_profile", {"float_id": float_id, "parameter": parameter, "max_points": max_points})
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or f"Depth profile for float {float_id} not available; see server logs"
         raise HTTPException(status_code=404, detail=detail)
@@ -2867,16 +5931,22 @@ async def get_depth_profile_data(float_id: int, parameter: str = "temperature"):
 @app.get("/data/trajectory/{float_id}")
 async def get_trajectory_data(float_id: int):
     """Get trajectory data for frontend mapping"""
-    result = await mcp_server.get_trajectory(float_id)
+    result = await mcp_server.execute_tool("get_trajectory", {"float_id": float_id})
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or f"Trajectory for float {float_id} not available; see server logs"
         raise HTTPException(status_code=404, detail=detail)
     return result
 
 @app.get("/data/timeseries/{float_id}")
-async def get_timeseries_data(float_id: int, parameter: str = "temperature"):
-    """Get time series data for frontend plotting"""
-    result = await mcp_server.get_timeseries(float_id, parameter)
+async def get_timeseries_data(float_id: int, parameter: str = "temperature", max_points: Optional[int] = None,
+                              start_date: Optional[str] = None, end_date: Optional[str] = None, bucket: Optional[str] = None,
+                              depth_min: Optional[float] = None, depth_max: Optional[float] = None):
+    """Get time series data for frontend plotting (per-bucket statistics; max_points=0 disables LTTB)"""
+    result = await mcp_server.execute_tool("get_timeseries", {
+        "float_id": float_id, "parameter": parameter, "max_points": max_points,
+        "start_date": start_date, "end_date": end_date, "bucket": bucket,
+        "depth_min": depth_min, "depth_max": depth_max
+    })
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or f"Timeseries for float {float_id} not available; see server logs"
         raise HTTPException(status_code=404, detail=detail)
@@ -2885,12 +5955,26 @@ async def get_timeseries_data(float_id: int, parameter: str = "temperature"):
 @app.get("/data/region/{region_name}")
 async def get_region_data(region_name: str):
     """Get data for a specific region"""
-    result = await mcp_server.get_region_data(region_name)
+    result = await mcp_server.execute_tool("get_region_data", {"region": region_name})
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or f"Region data for {region_name} not available; see server logs"
         raise HTTPException(status_code=404, detail=detail)
     return result
 
+@app.get("/data/climatology")
+async def get_climatology_data(parameter: str = "temperature", region: Optional[str] = None,
+                               depth: Optional[float] = None, depth_min: Optional[float] = None,
+                               depth_max: Optional[float] = None, month: Optional[int] = None):
+    """Monthly climatology from the pre-aggregated cube (region / depth band / month filters)"""
+    result = await mcp_server.execute_tool("get_climatology", {
+        "parameter": parameter, "region": region, "depth": depth,
+        "depth_min": depth_min, "depth_max": depth_max, "month": month
+    })
+    if isinstance(result, dict) and "error" in result:
+        detail = result.get("error") or "Climatology not available; see server logs"
+        raise HTTPException(status_code=404, detail=detail)
+    return result
+
 @app.post("/compare")
 async def compare_floats(payload: Dict[str, Any]):
     """Compare multiple floats"""
@@ -2900,7 +5984,7 @@ async def compare_floats(payload: Dict[str, Any]):
     if len(float_ids) < 2:
         raise HTTPException(status_code=400, detail="At least two float IDs required for comparison")
     
-    result = await mcp_server.compare_floats(float_ids, parameter)
+    result = await mcp_server.execute_tool("compare_floats", {"float_ids": float_ids, "parameter": parameter})
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or "Comparison failed; see server logs for details"
         raise HTTPException(status_code=404, detail=detail)
@@ -2914,12 +5998,52 @@ async def get_multiple_trajectories(payload: Dict[str, Any]):
     if len(float_ids) < 1:
         raise HTTPException(status_code=400, detail="At least one float ID required")
     
-    result = await mcp_server.get_multiple_trajectories(float_ids)
+    result = await mcp_server.execute_tool("get_multiple_trajectories", {
+        "float_ids": float_ids,
+        "max_points_per_float": payload.get("max_points_per_float")
+    })
     if isinstance(result, dict) and "error" in result:
         detail = result.get("error") or "Multiple trajectories failed; see server logs for details"
         raise HTTPException(status_code=404, detail=detail)
     return result
 
+@app.get("/export")
+async def export_measurements(format: str = "csv", float_ids: Optional[str] = None, region: Optional[str] = None,
+                              cycle_min: Optional[int] = None, cycle_max: Optional[int] = None,
+                              depth_min: Optional[float] = None, depth_max: Optional[float] = None,
+                              date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """
+    Stream measurements as csv, tsv, parquet or arrow (float_ids is comma-separated; dates are ISO 8601,
+    and a bare date_to such as 2024-03-31 includes that whole day)
+    """
+    if not mcp_server.db_pool:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    try:
+        writer = bulk_export.make_writer(format)
+        ids = [int(f) for f in float_ids.split(",") if f.strip()] if float_ids else None
+        filters = dict(
+            cycle_min=cycle_min, cycle_max=cycle_max, depth_min=depth_min, depth_max=depth_max,
+            date_from=mcp_server._as_datetime(date_from),
+            date_to=mcp_server._as_datetime(date_to, end_of_day=True)
+        )
+        sql, params = mcp_server.build_export_query(float_ids=ids, region=region, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Explicit floats that are all in the hot-float cache stream from their columns
+    cached = mcp_server.cached_export_columns(ids, region)
+    if cached is not None:
+        stream = mcp_server.stream_export_columns(format, cached, writer=writer, **filters)
+    else:
+        stream = mcp_server.stream_export(format, sql, params, writer=writer)
+    media_type, extension = bulk_export.FORMATS[format]
+    filename = f"argo_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # ==================== ADMIN ENDPOINTS - FLOAT INGESTION ====================
 
 @app.post("/admin/download-float")
@@ -2995,6 +6119,23 @@ async def admin_ingest_float(payload: Dict[str, Any]):
         logger.error(f"Ingestion endpoint error: {e}")
         raise HTTPException(status_code=500, detail=f"Ingestion failed: {str(e)}")
 
+@app.post("/admin/cache/invalidate")
+async def admin_invalidate_cache(payload: Dict[str, Any]):
+    """
+    Invalidate cached results in every worker after data changed without going through the
+    ingesters (which record their changes themselves), e.g. manual SQL fixes
+    
+    Body: { "float_id": "1902669" } for one float, or {} for everything
+    """
+    if not mcp_server.db_pool:
+        raise HTTPException(status_code=503, detail="Database not available")
+    float_id = str(payload.get("float_id", "")).strip()
+    async with mcp_server.db_pool.acquire() as conn:
+        await data_versions.record_change(conn, float_id or None)
+    if not float_id:
+        await mcp_server.tool_cache.clear()
+    return {"success": True, "float_id": float_id or None, "data_versions": data_versions.versions.snapshot()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("backend16:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-float queries against the measurements layout
+
+Run: python benchmark_partitions.py [--floats 2902296,2902297] [--runs 5]
+
+For each per-float tool query (query_measurements, get_depth_profile, compare_floats,
+get_temporal_analysis) this runs EXPLAIN (ANALYZE, BUFFERS) and reports:
+- partitions scanned (1 of N when pruning works; 1 of 1 on a plain table)
+- buffers touched and median execution time
+If migrate_measurements.py left measurements_unpartitioned (or measurements_rows, after
+--arrays) behind, the same queries run against it for comparison.
+"""
+
+import os
+import json
+import asyncio
+import argparse
+import statistics
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Same shapes as the backend tools; {t} is the measurements table under test
+QUERIES = {
+    "query_measurements": ("""
+        SELECT m.float_id, m.cycle_number, m.n_level, m.pressure, m.temperature, m.salinity
+        FROM {t} m WHERE m.float_id = $1 AND m.temperature IS NOT NULL
+        ORDER BY m.float_id, m.cycle_number, m.n_level LIMIT 1000
+    """, lambda fids: [fids[0]]),
+    "get_depth_profile (latest)": ("""
+        SELECT cycle_number, pressure, temperature FROM {t}
+        WHERE float_id = $1 AND cycle_number = (SELECT MAX(cycle_number) FROM profiles WHERE float_id = $1)
+        AND temperature IS NOT NULL ORDER BY n_level
+    """, lambda fids: [fids[0]]),
+    "compare_floats": ("""
+        SELECT float_id, COUNT(*), AVG(temperature), MIN(temperature), MAX(temperature)
+        FROM {t} WHERE float_id = ANY($1::int[]) AND temperature IS NOT NULL GROUP BY float_id
+    """, lambda fids: [fids]),
+    "get_temporal_analysis": ("""
+        SELECT date_trunc('month', p.profile_date), COUNT(*), AVG(m.temperature)
+        FROM profiles p JOIN {t} m ON m.float_id = p.float_id AND m.cycle_number = p.cycle_number
+        WHERE p.float_id = $1 AND m.float_id = $1 AND m.temperature IS NOT NULL
+        GROUP BY 1
+    """, lambda fids: [fids[0]]),
+}
+
+def scanned_relations(plan, table_names):
+    """Names of table partitions (or the table itself) read by a plan tree"""
+    found = set()
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if node.get("Relation Name") in table_names:
+            found.add(node["Relation Name"])
+        stack.extend(node.get("Plans", []))
+    return found
+
+async def partitions_of(conn, table):
+    if await conn.fetchval("SELECT relkind = 'v' FROM pg_class WHERE oid = $1::text::regclass", table):
+        return ["profile_levels"]
+    rows = await conn.fetch("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::text::regclass
+    """, table)
+    return [r['relname'] for r in rows] or [table]
+
+async def run(conn, table, float_ids, runs):
+    partitions = await partitions_of(conn, table)
+    print(f"\n{table} ({len(partitions)} partition{'s' if len(partitions) != 1 else ''})")
+    print(f"  {'query':<28} {'scanned':>10} {'buffers':>10} {'median ms':>10}")
+    for name, (sql, make_params) in QUERIES.items():
+        times, scanned, buffers = [], set(), 0
+        for _ in range(runs):
+            raw = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.format(t=table)}", *make_params(float_ids))
+            result = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+            times.append(result["Execution Time"])
+            scanned = scanned_relations(result["Plan"], set(partitions))
+            buffers = result["Plan"].get("Shared Hit Blocks", 0) + result["Plan"].get("Shared Read Blocks", 0)
+        print(f"  {name:<28} {f'{len(scanned)}/{len(partitions)}':>10} {buffers:>10} {statistics.median(times):>10.2f}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE per-float queries on measurements")
+    parser.add_argument("--floats", help="comma-separated float ids (default: the three with the most cycles)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(DATABASE_URL, statement_cache_size=0)
+    try:
+        if args.floats:
+            float_ids = [int(f) for f in args.floats.split(",")]
+        else:
+            rows = await conn.fetch("SELECT float_id FROM float_summary ORDER BY cycle_count DESC LIMIT 3")
+            float_ids = [r['float_id'] for r in rows]
+        if not float_ids:
+            print("No floats found; ingest some data first")
+            return
+
+        print("=" * 60)
+        print(f"Per-float query benchmark, floats {float_ids}, {args.runs} runs each")
+        print("=" * 60)
+
+        await run(conn, "measurements", float_ids, args.runs)
+        for old_table in ("measurements_unpartitioned", "measurements_rows"):
+            if await conn.fetchval("SELECT to_regclass($1::text) IS NOT NULL", old_table):
+                await run(conn, old_table, float_ids, args.runs)
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""
+Bulk Export Writers
+
+Incremental encoders for measurement exports: each writer turns chunks of rows into bytes
+as they arrive, so an export never holds more than one chunk in memory.
+- csv / tsv: plain text, header first
+- parquet: one row group per chunk, footer on close (requires pyarrow)
+- arrow: Arrow IPC stream, one record batch per chunk (requires pyarrow)
+"""
+
+import csv
+import io
+from datetime import datetime
+from typing import List, Any, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Exported columns, in output order
+COLUMNS = [
+    "float_id", "cycle_number", "n_level", "profile_date", "latitude", "longitude",
+    "pressure", "depth_m", "temperature", "salinity"
+]
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "tsv": ("text/tab-separated-values", "tsv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+ARROW_FORMATS = ("parquet", "arrow")
+
+
+def arrow_schema():
+    return pa.schema([
+        ("float_id", pa.int32()),
+        ("cycle_number", pa.int32()),
+        ("n_level", pa.int32()),
+        ("profile_date", pa.timestamp("us")),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("pressure", pa.float64()),
+        ("depth_m", pa.float64()),
+        ("temperature", pa.float64()),
+        ("salinity", pa.float64()),
+    ])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands back whatever was written since the last drain()"""
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+class DelimitedWriter:
+    def __init__(self, delimiter: str = ","):
+        self.delimiter = delimiter
+
+    def _encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=self.delimiter, lineterminator="\n")
+        writer.writerows(
+            ["" if v is None else (v.isoformat() if isinstance(v, datetime) else v) for v in row]
+            for row in rows
+        )
+        return buffer.getvalue().encode()
+
+    def begin(self) -> bytes:
+        return self._encode([COLUMNS])
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        return self._encode(rows)
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ArrowWriterBase:
+    def __init__(self):
+        self.schema = arrow_schema()
+        self.sink = _ChunkSink()
+        self.writer = None
+
+    def _batch(self, rows: Sequence[Sequence[Any]]):
+        columns = list(zip(*rows))
+        return pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema
+        )
+
+    def begin(self) -> bytes:
+        return self.sink.drain()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+class ParquetWriter(_ArrowWriterBase):
+    def __init__(self):
+        super().__init__()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression="zstd")
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        self.writer.write_batch(self._batch(rows))
+        return self.sink.drain()
+
+
+class ArrowStreamWriter(_ArrowWriterBase):
+    def __init__(self):
+        super().__init__()
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        self.writer.write_batch(self._batch(rows))
+        return self.sink.drain()
+
+
+def make_writer(format_type: str):
+    """Writer for an export format; ValueError for unknown formats or a missing pyarrow"""
+    if format_type not in FORMATS:
+        raise ValueError(f"Unsupported format: {format_type}. Use one of: {', '.join(FORMATS)}")
+    if format_type in ARROW_FORMATS and pa is None:
+        raise ValueError(f"{format_type} export requires pyarrow (pip install pyarrow)")
+    if format_type == "csv":
+        return DelimitedWriter(",")
+    if format_type == "tsv":
+        return DelimitedWriter("\t")
+    if format_type == "parquet":
+        return ParquetWriter()
+    return ArrowStreamWriter()
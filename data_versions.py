@@ -0,0 +1,183 @@
+"""
+ARGO Data Version Registry
+
+Monotonic counters that change whenever float data changes. Caches tag their entries
+with these versions so results stay correct right after an ingest.
+
+The counters live in the data_versions table, so every backend worker and every ingester
+(argo_ingestion.ingest_float, ingest_floats.py) shares them. Ingesters call record_change()
+after a successful ingest; it bumps the rows and sends a NOTIFY that is delivered on commit.
+Each backend process keeps an in-memory mirror (versions) that follow() updates from those
+notifications, so building a cache key never needs a database round trip. Listeners
+(in-memory indexes) are notified whenever the mirror advances.
+"""
+
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Any, Optional, Iterable, Tuple, Callable, List
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "argo_data_versions"
+GLOBAL_SCOPE = "global"
+EPOCH_SCOPE = "epoch"
+FLOAT_SCOPE = "float:"
+
+DATA_VERSIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS data_versions (
+    scope TEXT PRIMARY KEY,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+# Bumps the given scopes and notifies listeners with the new values (sent when the transaction commits)
+BUMP_SQL = f"""
+WITH bumped AS (
+    INSERT INTO data_versions (scope, version)
+    SELECT unnest($1::text[]), 1
+    ON CONFLICT (scope) DO UPDATE SET version = data_versions.version + 1, updated_at = NOW()
+    RETURNING scope, version
+)
+SELECT pg_notify('{CHANNEL}', json_object_agg(scope, version)::text) AS notified,
+       json_object_agg(scope, version)::text AS versions
+FROM bumped
+"""
+
+
+class DataVersions:
+    """
+    In-process mirror of the shared per-float and global data versions.
+
+    - a float change advances that float's version and the global version
+      (aggregate results such as region counts include every float)
+    - a full reload advances the epoch, invalidating everything
+    Values only move forward, so applying the same change twice (locally and again
+    from its notification) is harmless.
+    """
+    def __init__(self):
+        self.epoch = 0
+        self.global_version = 0
+        self.float_versions: Dict[str, int] = defaultdict(int)
+        self.listeners: List[Callable[[Optional[str]], None]] = []
+        self.synced = False
+        self.notifications = 0
+
+    def subscribe(self, listener: Callable[[Optional[str]], None]):
+        """Call listener(float_id or None) whenever the versions advance (e.g. to refresh in-memory indexes)"""
+        self.listeners.append(listener)
+
+    def apply(self, scopes: Dict[str, int], notify: bool = True):
+        """Merge versions read from data_versions; listeners hear about every float that advanced"""
+        changed: List[Optional[str]] = []
+        for scope, version in scopes.items():
+            version = int(version)
+            if scope == GLOBAL_SCOPE:
+                self.global_version = max(self.global_version, version)
+            elif scope == EPOCH_SCOPE:
+                if version > self.epoch:
+                    self.epoch = version
+                    changed.append(None)
+                    logger.info(f"Data epoch advanced to {self.epoch}")
+            elif scope.startswith(FLOAT_SCOPE):
+                float_id = scope[len(FLOAT_SCOPE):]
+                if version > self.float_versions.get(float_id, 0):
+                    self.float_versions[float_id] = version
+                    changed.append(float_id)
+                    logger.info(f"Data version for float {float_id} advanced to {version}")
+        if not notify:
+            return
+        # A full reload covers every float
+        for float_id in ([None] if None in changed else changed):
+            for listener in self.listeners:
+                try:
+                    listener(float_id)
+                except Exception as e:
+                    logger.error(f"Data version listener failed: {e}")
+
+    def tag(self, float_ids: Optional[Iterable[Any]] = None) -> Tuple:
+        """Version tag for a result: per-float when it only reads the given floats, global otherwise"""
+        if float_ids is None:
+            return ("g", self.global_version)
+        return ("f", self.epoch) + tuple(sorted((str(f), self.float_versions.get(str(f), 0)) for f in float_ids))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "epoch": self.epoch,
+            "global_version": self.global_version,
+            "floats_versioned": len(self.float_versions),
+            "synced": self.synced,
+            "notifications": self.notifications
+        }
+
+
+versions = DataVersions()
+
+
+def subscribe(listener: Callable[[Optional[str]], None]):
+    versions.subscribe(listener)
+
+
+async def ensure_table(conn):
+    await conn.execute(DATA_VERSIONS_TABLE_SQL)
+
+
+async def record_change(conn, float_id: Optional[Any] = None) -> Dict[str, int]:
+    """
+    Record that data changed for a float (or for everything when float_id is None).
+    Call only after the change has committed. Every process following the versions sees it
+    through NOTIFY; this process's mirror is updated immediately.
+    """
+    await ensure_table(conn)
+    scopes = [GLOBAL_SCOPE, EPOCH_SCOPE if float_id is None else FLOAT_SCOPE + str(float_id)]
+    row = await conn.fetchrow(BUMP_SQL, scopes)
+    bumped = json.loads(row["versions"])
+    versions.apply(bumped)
+    return bumped
+
+
+async def sync(conn, notify: bool = True):
+    """Load every version from data_versions into the mirror"""
+    await ensure_table(conn)
+    rows = await conn.fetch("SELECT scope, version FROM data_versions")
+    versions.apply({r["scope"]: r["version"] for r in rows}, notify=notify)
+    versions.synced = True
+
+
+def _on_notification(connection, pid, channel, payload):
+    try:
+        versions.notifications += 1
+        versions.apply(json.loads(payload))
+    except Exception as e:
+        logger.error(f"Bad data version notification {payload!r}: {e}")
+
+
+async def follow(dsn: str, retry_delay: float = 5.0):
+    """
+    Keep the mirror current for the life of the process: LISTEN on a dedicated connection and
+    re-sync from the table after every (re)connect, so changes made while disconnected are not missed.
+    """
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn, statement_cache_size=0)
+            lost = asyncio.get_running_loop().create_future()
+            conn.add_termination_listener(lambda _: lost.done() or lost.set_result(None))
+            await conn.add_listener(CHANNEL, _on_notification)
+            await sync(conn)
+            logger.info("Following shared data versions")
+            await lost
+            logger.warning("Data version listener connection lost; reconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Data version listener failed: {e}; retrying in {retry_delay}s")
+        finally:
+            versions.synced = False
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(retry_delay)
@@ -0,0 +1,72 @@
+"""
+Plot Downsampling
+
+Bounded-size reductions for chart payloads, vectorized with NumPy:
+- bin_profile: depth profiles averaged into equal-width pressure bins (mean pressure and value
+  per non-empty bin), which keeps thermocline / halocline shape
+- lttb: Largest-Triangle-Three-Buckets selection for time series, which keeps peaks and troughs
+  that plain striding would drop
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+
+def bin_profile(pressure, values, max_points: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (mean pressure, mean value, sample count) per pressure bin, at most max_points bins,
+    ordered by pressure. Points with a NaN pressure or value are dropped.
+    """
+    pressure = np.asarray(pressure, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    keep = ~(np.isnan(pressure) | np.isnan(values))
+    pressure, values = pressure[keep], values[keep]
+    if len(pressure) <= max_points:
+        order = np.argsort(pressure, kind="stable")
+        return pressure[order], values[order], np.ones(len(pressure), dtype=np.int64)
+
+    lo, hi = pressure.min(), pressure.max()
+    if hi == lo:
+        return np.array([lo]), np.array([values.mean()]), np.array([len(values)])
+    bins = np.minimum(((pressure - lo) / (hi - lo) * max_points).astype(np.int64), max_points - 1)
+    counts = np.bincount(bins, minlength=max_points)
+    p_sum = np.bincount(bins, weights=pressure, minlength=max_points)
+    v_sum = np.bincount(bins, weights=values, minlength=max_points)
+    filled = counts > 0
+    return p_sum[filled] / counts[filled], v_sum[filled] / counts[filled], counts[filled]
+
+
+def lttb(x, y, max_points: int) -> np.ndarray:
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets (first and last always kept).
+    x must be sorted ascending (e.g. epoch seconds); NaN y values are never selected.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    n = len(valid)
+    if max_points >= n or n <= 2:
+        return valid
+    if max_points < 3:
+        return valid[[0, -1]]
+    xs, ys = x[valid], y[valid]
+
+    # Interior points split into max_points - 2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for b in range(max_points - 2):
+        start, end = edges[b], max(edges[b + 1], edges[b] + 1)
+        # Third vertex: mean of the next bucket (the last point for the final bucket)
+        if b + 2 < len(edges):
+            nxt = slice(edges[b + 1], max(edges[b + 2], edges[b + 1] + 1))
+            cx, cy = xs[nxt].mean(), ys[nxt].mean()
+        else:
+            cx, cy = xs[-1], ys[-1]
+        ax, ay = xs[prev], ys[prev]
+        area = np.abs((xs[start:end] - ax) * (cy - ay) - (cx - ax) * (ys[start:end] - ay))
+        prev = start + int(np.argmax(area))
+        selected[b + 1] = prev
+    return valid[selected]
@@ -0,0 +1,275 @@
+"""
+Per-Float Measurement Columns
+
+One float's measurements held as NumPy column arrays instead of one dict per row:
+- level columns (cycle_number, n_level, pressure, depth_m, temperature, salinity) in
+  (cycle_number, n_level) order, float64 values (as the SQL path returns them) with NaN for missing ones
+- profile columns (cycle, date, latitude, longitude), one entry per cycle, joined to levels
+  through an index array rather than repeated per level
+Tools slice these with boolean masks and only turn the rows they return into Python objects.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LEVEL_VALUES = ("pressure", "depth_m", "temperature", "salinity")
+
+
+def _floats(values: Sequence[Any]) -> np.ndarray:
+    """float64 array with NaN for None"""
+    return np.array(values, dtype=np.float64)
+
+
+def _py(values: np.ndarray) -> List[Any]:
+    """Python floats / datetimes with None for NaN / NaT (JSON-ready)"""
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[us]").tolist()
+    return [None if v != v else v for v in values.tolist()]
+
+
+def _stats(values: np.ndarray) -> Dict[str, Any]:
+    """count / mean / min / max / sample stddev of the non-NaN values (float64 accumulation)"""
+    values = values[~np.isnan(values)].astype(np.float64)
+    if not len(values):
+        return {"count": 0, "mean": None, "min": None, "max": None, "stddev": None}
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "stddev": float(values.std(ddof=1)) if len(values) > 1 else None,
+    }
+
+
+class FloatColumns:
+    """Column arrays of one float's measurements; nbytes is what the hot-float cache charges for it"""
+    __slots__ = ("float_id", "cycle_number", "n_level", "pressure", "depth_m", "temperature", "salinity",
+                 "profile_cycle", "profile_date", "profile_lat", "profile_lon", "profile_found",
+                 "profile_index", "nbytes")
+
+    def __init__(self, float_id: int, cycle_number: np.ndarray, n_level: np.ndarray,
+                 values: Dict[str, np.ndarray], profile_cycle: np.ndarray, profile_date: np.ndarray,
+                 profile_lat: np.ndarray, profile_lon: np.ndarray, profile_found: np.ndarray):
+        self.float_id = int(float_id)
+        self.cycle_number = cycle_number.astype(np.int32)
+        self.n_level = n_level.astype(np.int32)
+        self.pressure = values["pressure"]
+        self.depth_m = values["depth_m"]
+        self.temperature = values["temperature"]
+        self.salinity = values["salinity"]
+        self.profile_cycle = profile_cycle.astype(np.int32)
+        self.profile_date = profile_date.astype("datetime64[us]")
+        self.profile_lat = profile_lat.astype(np.float64)
+        self.profile_lon = profile_lon.astype(np.float64)
+        self.profile_found = profile_found.astype(bool)
+        self.profile_index = np.searchsorted(self.profile_cycle, self.cycle_number).astype(np.int32)
+        self.nbytes = sum(getattr(self, name).nbytes for name in self.__slots__
+                          if isinstance(getattr(self, name, None), np.ndarray))
+
+    @classmethod
+    def from_level_rows(cls, float_id: int, rows: Sequence[Sequence[Any]]) -> "FloatColumns":
+        """
+        Rows of (cycle_number, n_level, pressure, depth_m, temperature, salinity, profile_date,
+        latitude, longitude, profile_found) in (cycle_number, n_level) order.
+        """
+        columns = list(zip(*rows)) if rows else [()] * 10
+        cycle = np.array(columns[0], dtype=np.int32)
+        starts = np.flatnonzero(np.r_[True, cycle[1:] != cycle[:-1]]) if len(cycle) else np.empty(0, dtype=np.int64)
+        pick = lambda i: [columns[i][s] for s in starts]
+        return cls(
+            float_id, cycle, np.array(columns[1], dtype=np.int32),
+            {name: _floats(columns[2 + k]) for k, name in enumerate(LEVEL_VALUES)},
+            cycle[starts], np.array(pick(6), dtype="datetime64[us]"),
+            np.array(pick(7), dtype=np.float64), np.array(pick(8), dtype=np.float64),
+            np.array(pick(9), dtype=bool)
+        )
+
+    @classmethod
+    def from_profile_arrays(cls, float_id: int, rows: Sequence[Any]) -> "FloatColumns":
+        """
+        profile_levels rows (cycle_number, n_level[], pressure[], temperature[], salinity[],
+        profile_date, latitude, longitude, profile_found) in cycle order; depth_m is the pressure.
+        """
+        sizes = np.array([len(r[1]) for r in rows], dtype=np.int64)
+        total = int(sizes.sum())
+
+        def joined(position: int) -> np.ndarray:
+            parts = [_floats(r[position]) if r[position] is not None else np.full(len(r[1]), np.nan, dtype=np.float64)
+                     for r in rows]
+            return np.concatenate(parts) if parts else np.empty(0, dtype=np.float64)
+
+        pressure = joined(2)
+        profile_cycle = np.array([r[0] for r in rows], dtype=np.int32)
+        return cls(
+            float_id, np.repeat(profile_cycle, sizes),
+            np.concatenate([np.asarray(r[1], dtype=np.int32) for r in rows]) if total else np.empty(0, dtype=np.int32),
+            {"pressure": pressure, "depth_m": pressure, "temperature": joined(3), "salinity": joined(4)},
+            profile_cycle, np.array([r[5] for r in rows], dtype="datetime64[us]"),
+            np.array([r[6] for r in rows], dtype=np.float64), np.array([r[7] for r in rows], dtype=np.float64),
+            np.array([r[8] for r in rows], dtype=bool)
+        )
+
+    def __len__(self) -> int:
+        return len(self.cycle_number)
+
+    def values(self, parameter: str) -> np.ndarray:
+        return getattr(self, parameter)
+
+    def level_dates(self) -> np.ndarray:
+        return self.profile_date[self.profile_index]
+
+    def mask(self, parameter: Optional[str] = None, cycle_range: Optional[Tuple[int, int]] = None,
+             depth_range: Optional[Tuple[float, float]] = None, after: Optional[Tuple[int, int]] = None,
+             date_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None,
+             with_profile: bool = False) -> np.ndarray:
+        """
+        Levels matching the filters: parameter present, inclusive cycle / pressure ranges, a
+        half-open [start, end) date range, after a (cycle_number, n_level) key, and (with_profile)
+        a matching profiles row.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if parameter:
+            keep &= ~np.isnan(self.values(parameter))
+        if cycle_range:
+            keep &= (self.cycle_number >= cycle_range[0]) & (self.cycle_number <= cycle_range[1])
+        if depth_range:
+            keep &= (self.pressure >= depth_range[0]) & (self.pressure <= depth_range[1])
+        if after:
+            keep &= (self.cycle_number > after[0]) | ((self.cycle_number == after[0]) & (self.n_level > after[1]))
+        if date_range:
+            dates = self.level_dates()
+            if date_range[0] is not None:
+                keep &= dates >= np.datetime64(date_range[0], "us")
+            if date_range[1] is not None:
+                keep &= dates < np.datetime64(date_range[1], "us")
+        if with_profile:
+            keep &= self.profile_found[self.profile_index]
+        return keep
+
+    def rows(self, index: np.ndarray) -> List[Dict[str, Any]]:
+        """query_measurements rows for the given level positions"""
+        profile = self.profile_index[index]
+        columns = {
+            "cycle_number": self.cycle_number[index].tolist(),
+            "n_level": self.n_level[index].tolist(),
+            **{name: _py(self.values(name)[index]) for name in LEVEL_VALUES},
+            "profile_date": _py(self.profile_date[profile]),
+            "latitude": _py(self.profile_lat[profile]),
+            "longitude": _py(self.profile_lon[profile]),
+        }
+        names = list(columns)
+        return [{"float_id": self.float_id, **dict(zip(names, values))} for values in zip(*columns.values())]
+
+    def export_rows(self, index: np.ndarray) -> List[Tuple]:
+        """Rows in bulk_export.COLUMNS order for the given level positions"""
+        profile = self.profile_index[index]
+        return list(zip(
+            [self.float_id] * len(index), self.cycle_number[index].tolist(), self.n_level[index].tolist(),
+            _py(self.profile_date[profile]), _py(self.profile_lat[profile]), _py(self.profile_lon[profile]),
+            *(_py(self.values(name)[index]) for name in LEVEL_VALUES)
+        ))
+
+    def profiles_with(self, parameter: str) -> np.ndarray:
+        """Positions (into the profile arrays) of cycles holding at least one value of parameter"""
+        present = np.bincount(self.profile_index[~np.isnan(self.values(parameter))], minlength=len(self.profile_cycle))
+        return np.flatnonzero((present > 0) & self.profile_found)
+
+    def profile_levels(self, profile: int, parameter: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(pressure, value) of one profile's levels holding parameter and a pressure, in level order"""
+        start, end = np.searchsorted(self.profile_index, [profile, profile + 1])
+        pressure, values = self.pressure[start:end], self.values(parameter)[start:end]
+        keep = ~np.isnan(values) & ~np.isnan(pressure)
+        return pressure[keep], values[keep]
+
+    def summary(self, parameter: str) -> Dict[str, Any]:
+        """compare_floats statistics: count / mean / min / max / stddev / p10 / median / p90"""
+        values = self.values(parameter)
+        stats = _stats(values)
+        present = values[~np.isnan(values)].astype(np.float64)
+        percentiles = np.percentile(present, [10, 50, 90]).tolist() if len(present) else [None, None, None]
+        return {**stats, "percentiles": percentiles}
+
+    def bucket_stats(self, parameter: str, bucket: str, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, depth_min: Optional[float] = None,
+                     depth_max: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        get_temporal_analysis statistics per date_trunc(bucket) of the profile date (weeks start
+        on Monday), within [start, end) and the inclusive pressure band, plus the overall totals.
+        """
+        values = self.values(parameter)
+        dates = self.level_dates()
+        keep = ~np.isnan(values) & ~np.isnat(dates) & self.profile_found[self.profile_index]
+        if start is not None:
+            keep &= dates >= np.datetime64(start, "us")
+        if end is not None:
+            keep &= dates < np.datetime64(end, "us")
+        if depth_min is not None:
+            keep &= self.pressure >= depth_min
+        if depth_max is not None:
+            keep &= self.pressure <= depth_max
+        if not keep.any():
+            return [], {}
+
+        values, dates = values[keep].astype(np.float64), dates[keep]
+        profiles = self.profile_index[keep]
+        lat, lon = self.profile_lat[profiles], self.profile_lon[profiles]
+        days = dates.astype("datetime64[D]")
+        if bucket == "month":
+            starts = days.astype("datetime64[M]").astype("datetime64[us]")
+        elif bucket == "week":
+            # 1970-01-01 was a Thursday: (days + 3) % 7 is the weekday with Monday = 0
+            day_numbers = days.astype(np.int64)
+            starts = (day_numbers - (day_numbers + 3) % 7).astype("datetime64[D]").astype("datetime64[us]")
+        else:
+            starts = days.astype("datetime64[us]")
+
+        keys, group = np.unique(starts, return_inverse=True)
+        count = np.bincount(group, minlength=len(keys))
+        total = np.bincount(group, weights=values, minlength=len(keys))
+        total_sq = np.bincount(group, weights=values * values, minlength=len(keys))
+        low, high = np.full(len(keys), np.inf), np.full(len(keys), -np.inf)
+        np.minimum.at(low, group, values)
+        np.maximum.at(high, group, values)
+        stamps = dates.astype(np.int64)
+        first = np.full(len(keys), np.iinfo(np.int64).max)
+        last = np.full(len(keys), np.iinfo(np.int64).min)
+        np.minimum.at(first, group, stamps)
+        np.maximum.at(last, group, stamps)
+        first, last = first.astype("datetime64[us]"), last.astype("datetime64[us]")
+        pairs = np.unique(np.stack([group, profiles]), axis=1)
+        distinct_profiles = np.bincount(pairs[0], minlength=len(keys))
+        mean = total / count
+        variance = np.where(count > 1, (total_sq - count * mean * mean) / np.maximum(count - 1, 1), np.nan)
+
+        def located(coordinate: np.ndarray) -> List[Any]:
+            known = ~np.isnan(coordinate)
+            sums = np.bincount(group[known], weights=coordinate[known], minlength=len(keys))
+            counts = np.bincount(group[known], minlength=len(keys))
+            return [float(s / c) if c else None for s, c in zip(sums, counts)]
+
+        latitudes, longitudes = located(lat), located(lon)
+        buckets = [
+            {
+                "bucket_start": keys[i].astype(datetime),
+                "count": int(count[i]),
+                "profiles": int(distinct_profiles[i]),
+                "mean": float(mean[i]),
+                "min": float(low[i]),
+                "max": float(high[i]),
+                "stddev": float(np.sqrt(max(variance[i], 0.0))) if count[i] > 1 else None,
+                "latitude": latitudes[i],
+                "longitude": longitudes[i],
+                "first_date": first[i].astype(datetime),
+                "last_date": last[i].astype(datetime),
+            }
+            for i in range(len(keys))
+        ]
+        overall = {
+            **_stats(values),
+            "profiles": int(len(np.unique(profiles))),
+            "first_date": dates.min().astype(datetime),
+            "last_date": dates.max().astype(datetime),
+        }
+        return buckets, overall
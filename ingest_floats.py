@@ -21,6 +21,12 @@ import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
 
+from argo_ingestion import (
+    ensure_float_summary, refresh_float_summary, ensure_float_region, refresh_float_region,
+    measurements_storage, profile_level_row, write_profile_levels, refresh_climatology
+)
+import data_versions
+
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -154,6 +160,7 @@ async def ingest_profiles(prof_file, conn):
     
     platform_number = int(safe_str(ds.PLATFORM_NUMBER.values[0]))
     n_profs = ds.dims['N_PROF']
+    storage = await measurements_storage(conn)
     
     total_measurements = 0
     
@@ -187,7 +194,10 @@ async def ingest_profiles(prof_file, conn):
             
             records.append((platform_number, cycle_number, int(lvl), p_val, p_val, t_val, s_val))
         
-        if records:
+        if records and storage == "arrays":
+            await write_profile_levels(conn, [profile_level_row(records)])
+            total_measurements += len(records)
+        elif records:
             await conn.copy_records_to_table(
                 'measurements', records=records,
                 columns=['float_id', 'cycle_number', 'n_level', 'pressure', 'depth_m', 'temperature', 'salinity'],
@@ -218,6 +228,14 @@ async def ingest_float(float_id, data_dir="netcdf_data"):
             await ingest_profiles(prof_file, conn)
         else:
             print(f"  ⚠ No profile file")
+        
+        await ensure_float_summary(conn)
+        await refresh_float_summary(conn, float_id)
+        await ensure_float_region(conn)
+        await refresh_float_region(conn, float_id)
+        await refresh_climatology(conn, float_id)
+        # Running backends drop cached results for this float
+        await data_versions.record_change(conn, float_id)
             
     finally:
         await conn.close()
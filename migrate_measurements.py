@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Convert measurements to a hash-partitioned table (by float_id), or to array-per-profile storage
+
+Run: python migrate_measurements.py [--partitions 16] [--drop-old]
+     python migrate_measurements.py --arrays [--drop-old]
+
+This script:
+- Creates measurements_partitioned with the same columns (see argo_ingestion.create_measurements_table),
+  or with --arrays the profile_levels table (one row of real[] arrays per profile)
+- Copies rows float by float, so the API keeps serving from the old table meanwhile
+- Briefly locks measurements, copies rows added since the copy began, and swaps the tables
+  (--arrays: measurements becomes a view over profile_levels)
+- Keeps the old table as measurements_unpartitioned / measurements_rows (dropped with --drop-old)
+
+Safe to re-run: copied rows are skipped or replaced, and an already converted table is left alone.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import asyncpg
+from dotenv import load_dotenv
+
+from argo_ingestion import (
+    MEASUREMENT_COLUMNS, MEASUREMENTS_VIEW_SQL, create_measurements_table, measurements_is_partitioned,
+    measurements_storage, create_profile_levels
+)
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+NEW_TABLE = "measurements_partitioned"
+OLD_TABLE = "measurements_unpartitioned"
+COLUMNS = ", ".join(["id"] + MEASUREMENT_COLUMNS)
+ROWS_TABLE = "measurements_rows"
+
+# Rows of the given floats regrouped into one profile_levels row per profile
+PACK_PROFILES_SQL = """
+INSERT INTO profile_levels (float_id, cycle_number, n_level, pressure, temperature, salinity)
+SELECT float_id, cycle_number,
+       array_agg(n_level::smallint ORDER BY n_level),
+       array_agg(pressure::real ORDER BY n_level),
+       CASE WHEN bool_or(temperature IS NOT NULL) THEN array_agg(temperature::real ORDER BY n_level) END,
+       CASE WHEN bool_or(salinity IS NOT NULL) THEN array_agg(salinity::real ORDER BY n_level) END
+FROM measurements
+WHERE float_id = ANY($1::int[]) AND pressure IS NOT NULL
+GROUP BY float_id, cycle_number
+ON CONFLICT (float_id, cycle_number) DO UPDATE SET
+    n_level = EXCLUDED.n_level, pressure = EXCLUDED.pressure,
+    temperature = EXCLUDED.temperature, salinity = EXCLUDED.salinity
+"""
+
+async def related_relations(conn, table: str):
+    """Indexes, partitions (and their indexes) and the owned id sequence of a table"""
+    rows = await conn.fetch("""
+        WITH tables AS (
+            SELECT $1::text::regclass AS oid
+            UNION ALL
+            SELECT inhrelid FROM pg_inherits WHERE inhparent = $1::text::regclass
+        )
+        SELECT c.relname, c.relkind FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid IN (SELECT oid FROM tables)
+        UNION ALL
+        SELECT c.relname, c.relkind FROM pg_class c
+        WHERE c.oid IN (SELECT oid FROM tables) AND c.oid <> $1::text::regclass
+        UNION ALL
+        SELECT c.relname, c.relkind FROM pg_class c
+        WHERE c.oid = pg_get_serial_sequence($1::text, 'id')::regclass
+    """, table)
+    return [(r['relname'], r['relkind']) for r in rows]
+
+async def rename_with_prefix(conn, table: str, old_prefix: str, new_prefix: str):
+    """Rename a table and every related relation whose name starts with old_prefix"""
+    for relname, relkind in await related_relations(conn, table):
+        if not relname.startswith(old_prefix):
+            continue
+        kind = {"i": "INDEX", "I": "INDEX", "S": "SEQUENCE"}.get(relkind, "TABLE")
+        await conn.execute(f'ALTER {kind} "{relname}" RENAME TO "{new_prefix + relname[len(old_prefix):]}"')
+    await conn.execute(f'ALTER TABLE "{table}" RENAME TO "{new_prefix + table[len(old_prefix):]}"')
+
+async def convert_to_arrays(conn, drop_old: bool):
+    print("=" * 60)
+    print("Packing measurements into profile_levels (one row per profile)")
+    print("=" * 60)
+
+    await create_profile_levels(conn, with_view=False)
+    high_water = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM measurements")
+    float_ids = [r['float_id'] for r in await conn.fetch("SELECT DISTINCT float_id FROM measurements ORDER BY float_id")]
+
+    started = time.time()
+    packed = 0
+    for i, float_id in enumerate(float_ids, 1):
+        result = await conn.execute(PACK_PROFILES_SQL, [float_id])
+        packed += int(result.split()[-1])
+        print(f"  [{i}/{len(float_ids)}] float {float_id}: {packed} profiles packed")
+
+    print("\nSwapping measurements for the view (measurements is locked for the catch-up copy)...")
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE measurements IN ACCESS EXCLUSIVE MODE")
+        changed = [r['float_id'] for r in await conn.fetch(
+            "SELECT DISTINCT float_id FROM measurements WHERE id > $1", high_water)]
+        if changed:
+            await conn.execute(PACK_PROFILES_SQL, changed)
+        print(f"  {len(changed)} floats re-packed after changes during the copy")
+        await rename_with_prefix(conn, "measurements", "measurements", ROWS_TABLE)
+        await conn.execute(MEASUREMENTS_VIEW_SQL)
+
+    old_rows = await conn.fetchval(f"SELECT COUNT(*) FROM {ROWS_TABLE} WHERE pressure IS NOT NULL")
+    new_rows = await conn.fetchval("SELECT COUNT(*) FROM measurements")
+    sizes = await conn.fetchrow(f"""
+        SELECT pg_size_pretty(pg_total_relation_size('{ROWS_TABLE}')) AS rows_size,
+               pg_size_pretty(pg_total_relation_size('profile_levels')) AS arrays_size
+    """)
+    print(f"\n✓ Done in {time.time() - started:.1f}s: {new_rows} levels via the view ({old_rows} rows before)")
+    print(f"  Storage: {sizes['rows_size']} as rows → {sizes['arrays_size']} as arrays")
+
+    if drop_old:
+        if new_rows >= old_rows:
+            await conn.execute(f"DROP TABLE {ROWS_TABLE}")
+            print(f"✓ Dropped {ROWS_TABLE}")
+        else:
+            print(f"⚠ Row counts differ; kept {ROWS_TABLE}")
+
+    await conn.execute("ANALYZE profile_levels")
+    print("Restart the backend so it detects array storage.")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Hash-partition measurements by float_id, or pack it into arrays")
+    parser.add_argument("--partitions", type=int, default=int(os.getenv("MEASUREMENTS_PARTITIONS") or 16))
+    parser.add_argument("--arrays", action="store_true", help="convert to array-per-profile storage instead")
+    parser.add_argument("--drop-old", action="store_true", help="drop the old table after the swap")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(DATABASE_URL, statement_cache_size=0)
+    try:
+        state = await measurements_is_partitioned(conn)
+        if state is None:
+            print("measurements does not exist; start the backend with MEASUREMENTS_PARTITIONS / MEASUREMENTS_STORAGE set instead")
+            return
+        if await measurements_storage(conn) == "arrays":
+            print("measurements already uses array storage; nothing to do")
+            return
+        if args.arrays:
+            await convert_to_arrays(conn, args.drop_old)
+            return
+        if state:
+            print("measurements is already partitioned; nothing to do")
+            return
+
+        print("=" * 60)
+        print(f"Partitioning measurements into {args.partitions} hash partitions")
+        print("=" * 60)
+
+        await create_measurements_table(conn, NEW_TABLE, args.partitions)
+        high_water = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM measurements")
+        float_ids = [r['float_id'] for r in await conn.fetch("SELECT DISTINCT float_id FROM measurements ORDER BY float_id")]
+
+        started = time.time()
+        copied = 0
+        for i, float_id in enumerate(float_ids, 1):
+            result = await conn.execute(f"""
+                INSERT INTO {NEW_TABLE} ({COLUMNS})
+                SELECT {COLUMNS} FROM measurements WHERE float_id = $1 AND id <= $2
+                ON CONFLICT DO NOTHING
+            """, float_id, high_water)
+            copied += int(result.split()[-1])
+            print(f"  [{i}/{len(float_ids)}] float {float_id}: {copied} rows copied")
+
+        print("\nSwapping tables (measurements is locked for the catch-up copy)...")
+        async with conn.transaction():
+            await conn.execute("LOCK TABLE measurements IN ACCESS EXCLUSIVE MODE")
+            result = await conn.execute(f"""
+                INSERT INTO {NEW_TABLE} ({COLUMNS})
+                SELECT {COLUMNS} FROM measurements WHERE id > $1
+                ON CONFLICT DO NOTHING
+            """, high_water)
+            print(f"  {result.split()[-1]} rows added during the copy")
+            await conn.execute(f"""
+                SELECT setval(pg_get_serial_sequence('{NEW_TABLE}', 'id'),
+                              GREATEST((SELECT COALESCE(MAX(id), 0) FROM {NEW_TABLE}), 1))
+            """)
+            await rename_with_prefix(conn, "measurements", "measurements", OLD_TABLE)
+            await rename_with_prefix(conn, NEW_TABLE, NEW_TABLE, "measurements")
+
+        old_rows = await conn.fetchval(f"SELECT COUNT(*) FROM {OLD_TABLE}")
+        new_rows = await conn.fetchval("SELECT COUNT(*) FROM measurements")
+        print(f"\n✓ Done in {time.time() - started:.1f}s: {new_rows} rows partitioned ({old_rows} in {OLD_TABLE})")
+
+        if args.drop_old:
+            if new_rows >= old_rows:
+                await conn.execute(f"DROP TABLE {OLD_TABLE}")
+                print(f"✓ Dropped {OLD_TABLE}")
+            else:
+                print(f"⚠ Row counts differ; kept {OLD_TABLE}")
+
+        await conn.execute("ANALYZE measurements")
+        print("Restart the backend so pooled connections drop cached plans for the old table.")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
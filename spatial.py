@@ -0,0 +1,369 @@
+"""
+Spatial Indexing Helpers
+
+Fixed 1° grid over the globe, used without PostGIS:
+- profiles.grid_cell is a stored generated column (GRID_CELL_SQL) with a btree index
+- box and radius searches become a handful of cell-id ranges; only cells on the edge of
+  the box need the exact latitude/longitude check
+
+KD-tree over unit-sphere coordinates for in-process nearest / radius queries.
+
+Region engine: named boxes and polygons (antimeridian-aware) used to maintain the
+float_region membership table at ingest time.
+"""
+
+import hashlib
+import heapq
+import json
+import math
+from typing import List, Tuple, Any, Dict
+
+import numpy as np
+
+GRID_DEGREES = 1
+LON_CELLS = 360 // GRID_DEGREES
+LAT_CELLS = 180 // GRID_DEGREES
+
+# Must match cell_of() exactly; used for the generated column on profiles
+GRID_CELL_SQL = (
+    "(LEAST(179, GREATEST(0, FLOOR(latitude + 90)))::int * 360 "
+    "+ MOD(MOD(FLOOR(longitude + 180)::int, 360) + 360, 360))"
+)
+
+
+def normalize_lon(lon: float) -> float:
+    """Longitude in [-180, 180)"""
+    return ((lon + 180.0) % 360.0) - 180.0
+
+
+def cell_of(latitude: float, longitude: float) -> int:
+    lat_idx = min(LAT_CELLS - 1, max(0, math.floor(latitude + 90)))
+    lon_idx = math.floor(longitude + 180) % LON_CELLS
+    return lat_idx * LON_CELLS + lon_idx
+
+
+def _lon_segments(lon_min: float, lon_max: float) -> List[Tuple[float, float]]:
+    """Non-wrapping longitude spans; lon_min > lon_max means the box crosses the antimeridian"""
+    if lon_max - lon_min >= 360:
+        return [(-180.0, 180.0)]
+    if lon_min <= lon_max and -180 <= lon_min and lon_max <= 180:
+        return [(lon_min, lon_max)]
+    lo, hi = normalize_lon(lon_min), normalize_lon(lon_max)
+    if lon_max == 180:
+        hi = 180.0
+    if lo <= hi:
+        return [(lo, hi)]
+    return [(lo, 180.0), (-180.0, hi)]
+
+
+def box_cell_ranges(lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> List[Tuple[int, int, bool]]:
+    """
+    Cell-id ranges (lo, hi, exact) covering a lat/lon box.
+    exact=True ranges lie entirely inside the box; the others need the per-row check.
+    """
+    lat_min, lat_max = max(-90.0, lat_min), min(90.0, lat_max)
+    if lat_min > lat_max:
+        return []
+    first_row = min(LAT_CELLS - 1, max(0, math.floor(lat_min + 90)))
+    last_row = min(LAT_CELLS - 1, max(0, math.floor(lat_max + 90)))
+
+    ranges = []
+    for lo_lon, hi_lon in _lon_segments(lon_min, lon_max):
+        first_col = min(LON_CELLS - 1, math.floor(lo_lon + 180))
+        last_col = min(LON_CELLS - 1, math.floor(hi_lon + 180))
+        # Columns whose whole 1° span is inside the segment
+        inner_first = math.ceil(lo_lon + 180)
+        inner_last = math.floor(hi_lon + 180) - 1
+
+        for row in range(first_row, last_row + 1):
+            base = row * LON_CELLS
+            row_inside = (row - 90) >= lat_min and (row - 89) <= lat_max
+            if not row_inside or inner_first > inner_last:
+                ranges.append((base + first_col, base + last_col, False))
+                continue
+            if first_col < inner_first:
+                ranges.append((base + first_col, base + inner_first - 1, False))
+            ranges.append((base + inner_first, base + inner_last, True))
+            if last_col > inner_last:
+                ranges.append((base + inner_last + 1, base + last_col, False))
+    if any(hi_lon >= 180 and lo_lon > -180 for lo_lon, hi_lon in _lon_segments(lon_min, lon_max)):
+        # longitude == 180 is stored in the -180 column
+        ranges.extend((row * LON_CELLS, row * LON_CELLS, False) for row in range(first_row, last_row + 1))
+    return ranges
+
+
+def box_filter(lat_min: float, lat_max: float, lon_min: float, lon_max: float,
+               alias: str = "p", first_param: int = 1) -> Tuple[str, List[Any]]:
+    """
+    JOIN clause restricting `alias` (a profiles row) to a lat/lon box via grid_cell ranges,
+    plus its bind parameters (always 7, regardless of box size).
+    lon_min > lon_max selects a box that crosses the antimeridian.
+    """
+    ranges = box_cell_ranges(lat_min, lat_max, lon_min, lon_max)
+    segments = _lon_segments(lon_min, lon_max)
+    # Exact check bounds: a single span, or (west edge, east edge) with west > east when wrapping
+    lon_min, lon_max = (segments[0][0], segments[-1][1]) if len(segments) == 1 else (segments[0][0], segments[1][1])
+    n = first_param
+    sql = (
+        f"JOIN unnest(${n}::int[], ${n + 1}::int[], ${n + 2}::bool[]) AS cells(lo, hi, exact) "
+        f"ON {alias}.grid_cell BETWEEN cells.lo AND cells.hi "
+        f"AND (cells.exact OR ({alias}.latitude BETWEEN ${n + 3} AND ${n + 4} "
+        f"AND ({alias}.longitude BETWEEN ${n + 5} AND ${n + 6} "
+        f"OR (${n + 5} > ${n + 6} AND ({alias}.longitude >= ${n + 5} OR {alias}.longitude <= ${n + 6})))))"
+    )
+    params = [
+        [r[0] for r in ranges], [r[1] for r in ranges], [r[2] for r in ranges],
+        float(lat_min), float(lat_max), float(lon_min), float(lon_max)
+    ]
+    return sql, params
+
+
+def radius_box(latitude: float, longitude: float, radius_degrees: float) -> Tuple[float, float, float, float]:
+    """Bounding box of ±radius degrees around a point, wrapping across the antimeridian"""
+    if radius_degrees >= 180:
+        return (-90.0, 90.0, -180.0, 180.0)
+    lon_min = normalize_lon(longitude - radius_degrees)
+    lon_max = normalize_lon(longitude + radius_degrees)
+    if longitude + radius_degrees == 180:
+        lon_max = 180.0
+    return (latitude - radius_degrees, latitude + radius_degrees, lon_min, lon_max)
+
+
+# ==================== KD-TREE ====================
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def to_unit_vectors(latitudes, longitudes) -> np.ndarray:
+    """(n, 3) points on the unit sphere; chord distances there are antimeridian-safe"""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_for_km(km: float) -> float:
+    return 2.0 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2.0)
+
+
+def km_for_chord(chord):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2.0, 0.0, 1.0))
+
+
+class KDTree:
+    """
+    Static KD-tree over (n, 3) points, stored as flat NumPy arrays.
+    Nodes keep bounding boxes for pruning; leaves are scanned vectorized.
+    """
+    def __init__(self, points: np.ndarray, leaf_size: int = 32):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.leaf_size = leaf_size
+        self.index = np.arange(len(self.points))
+        lo, hi, start, end, left, right = [], [], [], [], [], []
+        self._nodes = (lo, hi, start, end, left, right)
+        if len(self.points):
+            self._build(0, len(self.points))
+        self.lo = np.array(lo).reshape(-1, 3)
+        self.hi = np.array(hi).reshape(-1, 3)
+        self.start = np.array(start, dtype=np.int64)
+        self.end = np.array(end, dtype=np.int64)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        del self._nodes
+        # Python-side copies for the traversal loop
+        self._lo = [tuple(row) for row in self.lo.tolist()]
+        self._hi = [tuple(row) for row in self.hi.tolist()]
+        self._leaf = [(s, e) if l < 0 else None for s, e, l in zip(start, end, left)]
+        self._children = list(zip(left, right))
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _build(self, start: int, end: int) -> int:
+        lo, hi, starts, ends, left, right = self._nodes
+        members = self.index[start:end]
+        pts = self.points[members]
+        node_lo, node_hi = pts.min(axis=0), pts.max(axis=0)
+        node = len(lo)
+        lo.append(node_lo)
+        hi.append(node_hi)
+        starts.append(start)
+        ends.append(end)
+        left.append(-1)
+        right.append(-1)
+        if end - start > self.leaf_size:
+            dim = int(np.argmax(node_hi - node_lo))
+            mid = (start + end) // 2
+            order = np.argpartition(pts[:, dim], mid - start)
+            self.index[start:end] = members[order]
+            left[node] = self._build(start, mid)
+            right[node] = self._build(mid, end)
+        return node
+
+    def _box_dist2(self, node: int, q: Tuple[float, float, float]) -> float:
+        # Plain floats: per-node NumPy calls would dominate the query time
+        total = 0.0
+        for v, lo, hi in zip(q, self._lo[node], self._hi[node]):
+            if v < lo:
+                total += (lo - v) ** 2
+            elif v > hi:
+                total += (v - hi) ** 2
+        return total
+
+    def query_radius(self, q: np.ndarray, r: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices and distances of all points within r of q"""
+        if not len(self.points):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        q = np.asarray(q, dtype=np.float64)
+        qt = tuple(q.tolist())
+        r2 = r * r
+        found_idx, found_d2 = [], []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self._box_dist2(node, qt) > r2:
+                continue
+            leaf = self._leaf[node]
+            if leaf is not None:
+                members = self.index[leaf[0]:leaf[1]]
+                diff = self.points[members] - q
+                d2 = np.einsum("ij,ij->i", diff, diff)
+                hit = d2 <= r2
+                if hit.any():
+                    found_idx.append(members[hit])
+                    found_d2.append(d2[hit])
+            else:
+                stack.extend(self._children[node])
+        if not found_idx:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(found_idx), np.sqrt(np.concatenate(found_d2))
+
+    def query_knn(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices and distances of the k nearest points, nearest first"""
+        k = min(k, len(self.points))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        q = np.asarray(q, dtype=np.float64)
+        qt = tuple(q.tolist())
+        best: List[Tuple[float, int]] = []  # max-heap via negated squared distance
+        candidates = [(0.0, 0)]
+        while candidates:
+            box_d2, node = heapq.heappop(candidates)
+            if len(best) == k and box_d2 > -best[0][0]:
+                break
+            leaf = self._leaf[node]
+            if leaf is not None:
+                members = self.index[leaf[0]:leaf[1]]
+                diff = self.points[members] - q
+                d2 = np.einsum("ij,ij->i", diff, diff)
+                if len(best) == k:
+                    keep = d2 < -best[0][0]
+                    members, d2 = members[keep], d2[keep]
+                for i, dist2 in zip(members.tolist(), d2.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist2, i))
+                    elif dist2 < -best[0][0]:
+                        heapq.heapreplace(best, (-dist2, i))
+            else:
+                for child in self._children[node]:
+                    heapq.heappush(candidates, (self._box_dist2(child, qt), child))
+        best.sort(reverse=True)
+        return np.array([i for _, i in best], dtype=np.int64), np.sqrt([-d for d, _ in best])
+
+
+# ==================== REGIONS ====================
+
+# Named ocean regions. "bounds" is (lat_min, lat_max, lon_min, lon_max) with lon_min > lon_max
+# when the region crosses the antimeridian; an optional "polygon" of (lat, lon) vertices
+# narrows the region inside its bounds (computed from the polygon when bounds are omitted).
+REGION_DEFINITIONS = {
+    "equator": {"bounds": (-5, 5, -180, 180)},
+    "arabian_sea": {"bounds": (5, 25, 50, 75)},
+    "indian_ocean": {"bounds": (-40, 25, 40, 120)},
+    "bay_of_bengal": {"bounds": (5, 22, 80, 95)},
+    "south_atlantic": {"bounds": (-40, 0, -50, 20)},
+    "north_pacific": {"bounds": (0, 60, 120, -120)},
+}
+
+
+def _unwrap_lons(lons: List[float]) -> List[float]:
+    """Continuous longitudes along a ring: each step goes the short way round (<180°)"""
+    out = [float(lons[0])]
+    for lon in lons[1:]:
+        step = normalize_lon(float(lon) - out[-1])
+        out.append(out[-1] + step)
+    return out
+
+
+class Region:
+    """
+    Named region: a lat/lon box (may wrap across the antimeridian) and an optional polygon.
+    contains() is vectorized over NumPy arrays; the box doubles as the grid-cell prefilter.
+    """
+    def __init__(self, name: str, bounds: Tuple[float, float, float, float] = None,
+                 polygon: List[Tuple[float, float]] = None):
+        self.name = name
+        self.polygon = None
+        if polygon:
+            lats = [float(lat) for lat, _ in polygon]
+            lons = _unwrap_lons([lon for _, lon in polygon])
+            self.polygon = (np.array(lats), np.array(lons))
+            # Points are shifted into [west, west + 360) before the ray-casting test
+            self._west = min(lons)
+            if bounds is None:
+                east = max(lons)
+                bounds = (min(lats), max(lats), normalize_lon(self._west),
+                          180.0 if east - self._west >= 360 else normalize_lon(east))
+        if bounds is None:
+            raise ValueError(f"Region {name} needs bounds or a polygon")
+        self.bounds = tuple(float(b) for b in bounds)
+
+    def in_bounds(self, latitudes, longitudes) -> np.ndarray:
+        lat = np.asarray(latitudes, dtype=np.float64)
+        lon = np.asarray(longitudes, dtype=np.float64)
+        lat_min, lat_max, lon_min, lon_max = self.bounds
+        inside = (lat >= lat_min) & (lat <= lat_max)
+        segments = _lon_segments(lon_min, lon_max)
+        lon_inside = np.zeros(lon.shape, dtype=bool)
+        for lo, hi in segments:
+            lon_inside |= (lon >= lo) & (lon <= hi)
+            if hi >= 180 and lo > -180:
+                lon_inside |= lon == -180
+        return inside & lon_inside
+
+    def contains(self, latitudes, longitudes) -> np.ndarray:
+        """Boolean mask of the points inside the region (NaN positions are outside)"""
+        inside = self.in_bounds(latitudes, longitudes)
+        if self.polygon is None or not inside.any():
+            return inside
+        lat = np.asarray(latitudes, dtype=np.float64)
+        lon = (np.asarray(longitudes, dtype=np.float64) - self._west) % 360.0 + self._west
+        poly_lat, poly_lon = self.polygon
+        in_poly = np.zeros(lat.shape, dtype=bool)
+        j = len(poly_lat) - 1
+        for i in range(len(poly_lat)):
+            yi, yj, xi, xj = poly_lat[i], poly_lat[j], poly_lon[i], poly_lon[j]
+            crosses = (yi > lat) != (yj > lat)
+            if yi != yj:
+                x_cross = xi + (lat - yi) * (xj - xi) / (yj - yi)
+                in_poly ^= crosses & (lon < x_cross)
+            j = i
+        return inside & in_poly
+
+    def describe(self) -> Dict[str, Any]:
+        out = {"name": self.name, "bounding_box": self.bounds}
+        if self.polygon is not None:
+            out["polygon"] = [[float(lat), float(normalize_lon(lon))] for lat, lon in zip(*self.polygon)]
+        return out
+
+
+REGIONS: Dict[str, Region] = {
+    name: Region(name, spec.get("bounds"), spec.get("polygon"))
+    for name, spec in REGION_DEFINITIONS.items()
+}
+
+
+def region_signature(name: str) -> str:
+    """Changes whenever the region's definition changes; stored next to its float_region rows to detect stale ones"""
+    return hashlib.sha1(json.dumps(REGION_DEFINITIONS[name], sort_keys=True).encode()).hexdigest()[:16]
+
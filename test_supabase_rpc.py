@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Check the Supabase RPC fallback client against a local HTTP stand-in
+
+Run: python test_supabase_rpc.py      (or: python -m pytest test_supabase_rpc.py)
+
+A PostgREST-shaped server on 127.0.0.1 answers POST /rest/v1/rpc/execute_sql_query
+with rows, 4xx / 5xx errors or a slow reply, and each check drives
+backend16.SupabaseRPCClient against it:
+- rows are decoded and the event loop keeps running during a slow call
+- consecutive 5xx failures open the circuit, which then rejects calls without a request
+- the half-open trial closes the circuit again on success
+- 4xx (bad SQL) and timeouts are handled without stalling
+- a cancelled half-open trial does not leave the circuit stuck
+"""
+
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend16 import SupabaseRPCClient, CircuitBreaker, CircuitOpenError
+
+ROWS = [{"float_id": 2902296, "avg_temperature": 12.5}]
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Replies according to server.mode: ok, error500, error400 or slow"""
+    def do_POST(self):
+        self.server.requests += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.last_body = json.loads(body or b"{}")
+        mode = self.server.mode
+        if mode == "slow":
+            time.sleep(self.server.delay)
+        status = {"error500": 500, "error400": 400}.get(mode, 200)
+        payload = ROWS if status == 200 else {"message": mode}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out or was cancelled
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalSupabase:
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+        self.server.mode = "ok"
+        self.server.delay = 1.0
+        self.server.requests = 0
+        self.server.last_body = None
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_client(url, timeout=0.3, threshold=2, reset=0.2) -> SupabaseRPCClient:
+    return SupabaseRPCClient(url, "test-key", timeout=timeout,
+                             breaker=CircuitBreaker(failure_threshold=threshold, reset_timeout=reset))
+
+
+def test_rows_and_nonblocking():
+    async def run(stand_in):
+        client = make_client(stand_in.url, timeout=2.0)
+        try:
+            assert await client.rpc("execute_sql_query", {"query_text": "SELECT 1"}) == ROWS
+            assert stand_in.server.last_body == {"query_text": "SELECT 1"}
+
+            stand_in.server.mode, stand_in.server.delay = "slow", 0.5
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.05)
+                    ticks += 1
+
+            ticking = asyncio.create_task(ticker())
+            assert await client.rpc("execute_sql_query", {"query_text": "SELECT 1"}) == ROWS
+            ticking.cancel()
+            assert ticks >= 5, f"event loop stalled during the remote call ({ticks} ticks)"
+        finally:
+            await client.aclose()
+
+    with LocalSupabase() as stand_in:
+        asyncio.run(run(stand_in))
+
+
+def test_breaker_opens_and_recovers():
+    async def run(stand_in):
+        client = make_client(stand_in.url)
+        try:
+            stand_in.server.mode = "error500"
+            for _ in range(2):
+                try:
+                    await client.rpc("execute_sql_query", {})
+                    raise AssertionError("5xx should raise")
+                except Exception as e:
+                    assert not isinstance(e, (CircuitOpenError, AssertionError))
+            assert client.breaker.state == "open"
+
+            sent = stand_in.server.requests
+            try:
+                await client.rpc("execute_sql_query", {})
+                raise AssertionError("open circuit should reject")
+            except CircuitOpenError:
+                pass
+            assert stand_in.server.requests == sent, "rejected call still reached the remote"
+
+            await asyncio.sleep(0.25)
+            assert client.breaker.state == "half_open"
+            stand_in.server.mode = "ok"
+            assert await client.rpc("execute_sql_query", {}) == ROWS
+            assert client.breaker.state == "closed"
+        finally:
+            await client.aclose()
+
+    with LocalSupabase() as stand_in:
+        asyncio.run(run(stand_in))
+
+
+def test_client_errors_and_timeouts():
+    async def run(stand_in):
+        client = make_client(stand_in.url, threshold=1)
+        try:
+            stand_in.server.mode = "error400"
+            try:
+                await client.rpc("execute_sql_query", {})
+                raise AssertionError("4xx should raise")
+            except AssertionError:
+                raise
+            except Exception:
+                pass
+            assert client.breaker.state == "closed", "bad SQL must not open the circuit"
+
+            stand_in.server.mode, stand_in.server.delay = "slow", 1.0
+            started = time.monotonic()
+            try:
+                await client.rpc("execute_sql_query", {})
+                raise AssertionError("slow reply should time out")
+            except AssertionError:
+                raise
+            except Exception:
+                pass
+            assert time.monotonic() - started < 0.9, "timeout was not applied"
+            assert client.breaker.state == "open"
+        finally:
+            await client.aclose()
+
+    with LocalSupabase() as stand_in:
+        asyncio.run(run(stand_in))
+
+
+def test_cancelled_trial_releases_circuit():
+    async def run(stand_in):
+        client = make_client(stand_in.url, timeout=2.0, threshold=1)
+        try:
+            stand_in.server.mode = "error500"
+            try:
+                await client.rpc("execute_sql_query", {})
+            except Exception:
+                pass
+            await asyncio.sleep(0.25)
+
+            # The trial call is cancelled mid-flight, as the request deadline does
+            stand_in.server.mode, stand_in.server.delay = "slow", 0.5
+            trial = asyncio.create_task(client.rpc("execute_sql_query", {}))
+            await asyncio.sleep(0.1)
+            trial.cancel()
+            try:
+                await trial
+            except asyncio.CancelledError:
+                pass
+
+            stand_in.server.mode = "ok"
+            assert await client.rpc("execute_sql_query", {}) == ROWS
+            assert client.breaker.state == "closed"
+        finally:
+            await client.aclose()
+
+    with LocalSupabase() as stand_in:
+        asyncio.run(run(stand_in))
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Supabase RPC client against a local stand-in")
+    print("=" * 60)
+    for name, check in list(globals().items()):
+        if name.startswith("test_") and callable(check):
+            check()
+            print(f"  ✓ {name}")
+    print("All checks passed")